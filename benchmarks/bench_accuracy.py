@@ -0,0 +1,211 @@
+"""
+Accuracy versus speed of the methods on the datasets with known thicknesses.
+
+Run from the root of the repository::
+
+    python benchmarks/bench_accuracy.py -o accuracy.json
+
+Each configuration (method and parameters) is run on each dataset in a
+separate process. For each pair, the relative errors to the known
+thicknesses are reported next to the time per spectrum, and the fastest
+configuration reaching the required fraction of spectra within the
+tolerance is given for each dataset.
+
+Two runs can be compared with `benchmarks/compare.py`, for instance::
+
+    python benchmarks/compare.py before.json after.json --key fraction_within_tolerance
+    python benchmarks/compare.py before.json after.json --key cpu_seconds_per_spectrum --lower-is-better
+
+The reference values are read from the YAML files of the datasets
+(`spectraManue/known_values.py` holds the same values as
+`spectraLorene/sample*/sample*.yaml` and `spectraManue/sample3.yaml`).
+"""
+import argparse
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import yaml
+
+from optifik.io import load_spectrum
+from optifik.analysis import smooth_intensities
+from optifik.batch import analyse_spectrum
+
+from common import DATA_DIR, n_lambda, metadata, write_json
+
+
+# name: (method, parameters, wavelength_min, smooth, needs a void spectrum)
+CONFIGURATIONS = {
+    'fft': ('fft', {}, 450, False, False),
+    'fft[smooth]': ('fft', {}, 450, True, False),
+    'fft[N_padding=4]': ('fft', {'N_padding': 4}, 450, False, False),
+    'fft[wavelength_min=680]': ('fft', {}, 680, False, False),
+    'minmax[linreg]': ('minmax', {'min_peak_prominence': 0.02, 'method': 'linreg'},
+                       450, True, False),
+    'minmax[ransac]': ('minmax', {'min_peak_prominence': 0.02, 'method': 'ransac'},
+                       450, True, False),
+    'scheludko': ('scheludko', {'min_peak_prominence': 0.02}, 450, True, False),
+    'scheludko[prominence=0.01]': ('scheludko', {'min_peak_prominence': 0.01},
+                                   450, True, False),
+    'scheludko[order0]': ('scheludko', {'interference_order': 0}, 450, True, True),
+}
+
+
+def known_value_datasets():
+    """
+    Return a list of (name, paths, expected, refractive_index, void_path).
+
+    `refractive_index` is a scalar, or None for the dispersion `n_lambda`.
+    """
+    datasets = []
+    for yaml_file in sorted(DATA_DIR.rglob('*.yaml')):
+        with open(yaml_file) as fh:
+            content = yaml.safe_load(fh)
+        folder = yaml_file.parent
+        if (folder / yaml_file.stem).is_dir():
+            folder = folder / yaml_file.stem
+        known = content['known_thicknesses']
+        void = yaml_file.parent.parent / 'void.xy'
+        name = str(yaml_file.relative_to(DATA_DIR).with_suffix(''))
+        datasets.append((name,
+                         [str(folder / filename) for filename in known],
+                         np.array(list(known.values()), dtype=float),
+                         content.get('refractive_index'),
+                         str(void) if void.exists() else None))
+    return datasets
+
+
+def evaluate(config_name, dataset):
+    """
+    Run a configuration on a dataset and return the thicknesses and times.
+    """
+    method, kwargs, wavelength_min, smooth, _ = CONFIGURATIONS[config_name]
+    name, paths, expected, refractive_index, void = dataset
+
+    kwargs = dict(kwargs)
+    if kwargs.get('interference_order') == 0:
+        _, kwargs['intensities_void'] = load_spectrum(void, wavelength_min=wavelength_min)
+
+    thicknesses = np.full(len(paths), np.nan)
+    wall_times = np.zeros(len(paths))
+    cpu_times = np.zeros(len(paths))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for i, path in enumerate(paths):
+            lambdas, intensities = load_spectrum(path, wavelength_min=wavelength_min)
+            if smooth:
+                intensities = smooth_intensities(intensities)
+            r_index = n_lambda(lambdas) if refractive_index is None else refractive_index
+
+            start_wall, start_cpu = time.perf_counter(), time.process_time()
+            try:
+                thicknesses[i] = analyse_spectrum(method, lambdas, intensities, r_index,
+                                                  **kwargs).thickness
+            except (RuntimeError, ValueError, IndexError):
+                pass
+            wall_times[i] = time.perf_counter() - start_wall
+            cpu_times[i] = time.process_time() - start_cpu
+
+    return {'name': config_name,
+            'dataset': name,
+            'expected': expected,
+            'thickness': thicknesses,
+            'wall_times': wall_times,
+            'cpu_times': cpu_times}
+
+
+def statistics(evaluation, tolerance):
+    """
+    Summarize the errors and times of an evaluation.
+    """
+    errors = np.abs(evaluation['thickness'] - evaluation['expected']) / evaluation['expected']
+    succeeded = np.isfinite(errors)
+    valid = errors[succeeded]
+    stats = {'name': evaluation['name'],
+             'dataset': evaluation['dataset'],
+             'num_spectra': len(errors),
+             'num_failed': int(np.sum(~succeeded)),
+             'fraction_within_tolerance': float(np.mean(errors <= tolerance)),
+             'seconds_per_spectrum': float(np.mean(evaluation['wall_times'])),
+             'cpu_seconds_per_spectrum': float(np.mean(evaluation['cpu_times']))}
+    for key, func in (('relative_error_median', np.median),
+                      ('relative_error_mean', np.mean),
+                      ('relative_error_p90', lambda x: np.percentile(x, 90)),
+                      ('relative_error_max', np.max)):
+        stats[key] = float(func(valid)) if len(valid) else float('nan')
+    return stats
+
+
+def merge(evaluations):
+    """
+    Concatenate the evaluations of a configuration over several datasets.
+    """
+    return {'name': evaluations[0]['name'],
+            'dataset': 'all',
+            **{key: np.concatenate([item[key] for item in evaluations])
+               for key in ('expected', 'thickness', 'wall_times', 'cpu_times')}}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-o', '--output', default='accuracy.json', help='JSON output file')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Relative error accepted on a spectrum. The default is 0.1.')
+    parser.add_argument('--required', type=float, default=0.9,
+                        help='Fraction of spectra within the tolerance required to select '
+                             'a configuration. The default is 0.9.')
+    parser.add_argument('--filter', default='',
+                        help='Only run configurations containing this string')
+    parser.add_argument('--dataset', default='',
+                        help='Only run datasets containing this string')
+    parser.add_argument('--max-workers', type=int, default=None,
+                        help='Number of processes. The default is the number of CPUs.')
+    args = parser.parse_args(argv)
+
+    datasets = [dataset for dataset in known_value_datasets() if args.dataset in dataset[0]]
+    tasks = [(config_name, dataset)
+             for config_name, config in CONFIGURATIONS.items() if args.filter in config_name
+             for dataset in datasets if not config[4] or dataset[4] is not None]
+
+    with ProcessPoolExecutor(max_workers=args.max_workers or os.cpu_count()) as executor:
+        evaluations = list(executor.map(evaluate, *zip(*tasks)))
+
+    # The spectra known to fail are reported per dataset only
+    per_config = {}
+    for evaluation in evaluations:
+        if 'known_to_fail' in evaluation['dataset']:
+            continue
+        per_config.setdefault(evaluation['name'], []).append(evaluation)
+    evaluations += [merge(items) for items in per_config.values()]
+
+    results = [statistics(evaluation, args.tolerance) for evaluation in evaluations]
+    results.sort(key=lambda item: (item['dataset'], item['cpu_seconds_per_spectrum']))
+
+    print(f"{'configuration':26s} {'dataset':40s} {'n':>4s} {'fail':>4s} "
+          f"{'within':>7s} {'median':>8s} {'p90':>8s} {'ms':>8s}")
+    for stats in results:
+        print(f"{stats['name']:26s} {stats['dataset']:40s} {stats['num_spectra']:4d} "
+              f"{stats['num_failed']:4d} {stats['fraction_within_tolerance']:7.1%} "
+              f"{stats['relative_error_median']:8.2%} {stats['relative_error_p90']:8.2%} "
+              f"{stats['cpu_seconds_per_spectrum'] * 1e3:8.3f}")
+
+    print(f'\nFastest configuration with {args.required:.0%} of the spectra '
+          f'within {args.tolerance:.0%}:')
+    best = {}
+    for stats in results:
+        if stats['fraction_within_tolerance'] >= args.required:
+            best.setdefault(stats['dataset'], stats['name'])
+    for dataset in sorted({stats['dataset'] for stats in results}):
+        print(f"{dataset:40s} {best.get(dataset, '-')}")
+
+    write_json(args.output, {'metadata': metadata(),
+                             'tolerance': args.tolerance,
+                             'results': results,
+                             'best': best})
+
+
+if __name__ == '__main__':
+    main()
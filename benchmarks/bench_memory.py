@@ -0,0 +1,190 @@
+"""
+Memory benchmarks of the analysis functions.
+
+For each method, the peak of traced memory (tracemalloc, including the
+NumPy buffers) and the number of allocated blocks are recorded per call,
+and the peak resident set size (RSS) is sampled over batches of
+increasing size.
+
+Run from the root of the repository::
+
+    python benchmarks/bench_memory.py -o memory.json
+
+The peaks per call are compared with the thresholds of
+`memory_thresholds.json`; the exit code is 1 if one is exceeded.
+Two runs can also be compared with::
+
+    python benchmarks/compare.py --key peak_bytes --lower-is-better before.json after.json
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import warnings
+from pathlib import Path
+
+import numpy as np
+
+from optifik.fft import thickness_from_fft
+from optifik.minmax import thickness_from_minmax
+from optifik.scheludko import thickness_from_scheludko
+from optifik.scheludko import get_default_start_stop_wavelengths
+from optifik.batch import thickness_batch
+
+from common import synthetic_stack, metadata, write_json
+
+
+THRESHOLDS_FILE = Path(__file__).parent / 'memory_thresholds.json'
+
+
+def current_rss():
+    """
+    Return the resident set size of the process in bytes (Linux only).
+    """
+    try:
+        with open('/proc/self/statm') as fh:
+            return int(fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return None
+
+
+class RSSSampler:
+    """
+    Sample the RSS in a background thread and keep its maximum.
+    """
+    def __init__(self, interval=1e-3):
+        self.interval = interval
+        self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = current_rss()
+            if rss is not None:
+                self.peak = max(self.peak, rss)
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+
+
+def per_call(func):
+    """
+    Return the peak traced memory and the allocated blocks of one call.
+    """
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        start_memory = tracemalloc.get_traced_memory()[0]
+        start_blocks = sys.getallocatedblocks()
+        func()
+        peak = tracemalloc.get_traced_memory()[1] - start_memory
+        blocks = sys.getallocatedblocks() - start_blocks
+        num_traces = len(tracemalloc.take_snapshot().traces)
+    finally:
+        tracemalloc.stop()
+    return {'peak_bytes': peak, 'allocated_blocks': blocks, 'live_traces': num_traces}
+
+
+def methods(num_points):
+    """
+    Return {name: (func(lambdas, intensities, n_values), h_values)}.
+    """
+    def scheludko(lambdas, intensities, n_values, order=None):
+        w_start, w_stop = get_default_start_stop_wavelengths(lambdas, intensities, n_values,
+                                                             min_peak_prominence=0.02)
+        return thickness_from_scheludko(lambdas, intensities, n_values,
+                                        wavelength_start=w_start, wavelength_stop=w_stop,
+                                        interference_order=order)
+
+    cases = {}
+    for N_padding in (1, 4, 16):
+        cases[f'thickness_from_fft[N_padding={N_padding}]'] = (
+            lambda l, i, n, N_padding=N_padding: thickness_from_fft(l, i, n, N_padding=N_padding),
+            'fft', {'N_padding': N_padding}, (2_000, 10_000))
+    for method in ('linreg', 'ransac'):
+        cases[f'thickness_from_minmax[{method}]'] = (
+            lambda l, i, n, method=method: thickness_from_minmax(l, i, n, min_peak_prominence=0.02,
+                                                                 method=method),
+            'minmax', {'min_peak_prominence': 0.02, 'method': method}, (800, 5_000))
+    cases['thickness_from_scheludko[order_search]'] = (
+        scheludko, 'scheludko', {'min_peak_prominence': 0.02}, (450, 900))
+    return cases
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-o', '--output', default='memory.json', help='JSON output file')
+    parser.add_argument('--num-points', type=int, default=1_000,
+                        help='Number of wavelengths of the synthetic spectra')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[10, 100, 1_000],
+                        help='Sizes of the batches')
+    parser.add_argument('--thresholds', default=str(THRESHOLDS_FILE),
+                        help='JSON file of maximum peak bytes per call')
+    parser.add_argument('--update-thresholds', action='store_true',
+                        help='Write the thresholds from this run (with a 20%% margin)')
+    args = parser.parse_args(argv)
+
+    dataset = f'synthetic-{args.num_points}'
+    results = []
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for name, (func, method, kwargs, h_range) in methods(args.num_points).items():
+            lambdas, intensities, n_values = synthetic_stack([np.mean(h_range)],
+                                                             num_points=args.num_points)
+            # Warm up caches and imports
+            func(lambdas, intensities[0], n_values)
+            stats = per_call(lambda: func(lambdas, intensities[0], n_values))
+            stats.update(name=name, dataset=dataset)
+            results.append(stats)
+            print(f"{name:45s} peak {stats['peak_bytes'] / 2**20:9.2f} MiB, "
+                  f"{stats['allocated_blocks']:6d} blocks")
+
+            for batch_size in args.batch_sizes:
+                lambdas, stack, n_values = synthetic_stack(np.linspace(*h_range, batch_size),
+                                                           num_points=args.num_points)
+                rss_before = current_rss()
+                with RSSSampler() as sampler:
+                    thickness_batch(method, lambdas, stack, n_values, **kwargs)
+                stats = {'name': f'{name}[batch]', 'dataset': f'{dataset}x{batch_size}',
+                         'batch_size': batch_size,
+                         'peak_rss_bytes': sampler.peak,
+                         'rss_increase_bytes': (sampler.peak - rss_before
+                                                if rss_before is not None else None)}
+                results.append(stats)
+                print(f"{name + '[batch]':45s} {batch_size:6d} spectra, peak RSS "
+                      f"{sampler.peak / 2**20:9.2f} MiB")
+
+    write_json(args.output, {'metadata': metadata(), 'results': results})
+
+    per_call_peaks = {item['name']: item['peak_bytes'] for item in results
+                      if 'peak_bytes' in item}
+    if args.update_thresholds:
+        write_json(args.thresholds, {name: int(peak * 1.2)
+                                     for name, peak in per_call_peaks.items()})
+        return 0
+
+    try:
+        with open(args.thresholds) as fh:
+            thresholds = json.load(fh)
+    except FileNotFoundError:
+        return 0
+    exceeded = [name for name, peak in per_call_peaks.items()
+                if name in thresholds and peak > thresholds[name]]
+    for name in exceeded:
+        print(f'REGRESSION: {name} peak {per_call_peaks[name]} B > {thresholds[name]} B')
+    return 1 if exceeded else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
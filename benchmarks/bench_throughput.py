@@ -0,0 +1,141 @@
+"""
+Throughput benchmarks of the main functions.
+
+Run from the root of the repository::
+
+    python benchmarks/bench_throughput.py -o throughput.json
+
+and compare two runs with `benchmarks/compare.py`.
+"""
+import argparse
+import warnings
+
+import numpy as np
+
+from optifik.io import load_spectrum
+from optifik.analysis import smooth_intensities
+from optifik.fft import thickness_from_fft
+from optifik.minmax import thickness_from_minmax
+from optifik.scheludko import thickness_from_scheludko
+from optifik.scheludko import get_default_start_stop_wavelengths
+
+from common import (n_lambda, synthetic_stack, dataset_files, measure,
+                    metadata, write_json)
+
+
+def load_dataset(name, wavelength_min=450, smooth=True):
+    spectra = []
+    for path in dataset_files(name):
+        lambdas, intensities = load_spectrum(path, wavelength_min=wavelength_min)
+        if smooth:
+            intensities = smooth_intensities(intensities)
+        spectra.append((lambdas, intensities, n_lambda(lambdas)))
+    return spectra
+
+
+def synthetic(h_values, num_points):
+    lambdas, intensities, n_values = synthetic_stack(h_values, num_points=num_points)
+    return [(lambdas, spectrum, n_values) for spectrum in intensities]
+
+
+def with_start_stop(spectra, prominence=0.02):
+    """
+    Add the start and stop wavelengths and the order to each spectrum.
+    """
+    prepared = []
+    for lambdas, intensities, n_values in spectra:
+        try:
+            w_start, w_stop = get_default_start_stop_wavelengths(lambdas, intensities, n_values,
+                                                                 min_peak_prominence=prominence)
+            order = thickness_from_scheludko(lambdas, intensities, n_values,
+                                             wavelength_start=w_start,
+                                             wavelength_stop=w_stop).interference_order
+        except (RuntimeError, ValueError):
+            continue
+        prepared.append((lambdas, intensities, n_values, w_start, w_stop, order))
+    return prepared
+
+
+def cases(scale, num_points):
+    """
+    Yield (name, dataset, func, items).
+    """
+    # I/O
+    files = dataset_files('spectraLorene/sample1')
+    yield 'load_spectrum', 'spectraLorene/sample1', \
+        lambda path: load_spectrum(path, wavelength_min=450), files
+
+    fft_sets = {'spectraLorene/sample1': load_dataset('spectraLorene/sample1', smooth=False),
+                f'synthetic-{scale}x{num_points}': synthetic(np.linspace(2_000, 10_000, scale),
+                                                             num_points)}
+    minmax_sets = {'spectraVictor1': load_dataset('spectraVictor1'),
+                   f'synthetic-{scale}x{num_points}': synthetic(np.linspace(800, 5_000, scale),
+                                                                num_points)}
+    scheludko_sets = {'spectraVictor2/order1-5': sum((load_dataset(f'spectraVictor2/order{order}')
+                                                      for order in range(1, 6)), []),
+                      f'synthetic-{scale}x{num_points}': synthetic(np.linspace(350, 900, scale),
+                                                                   num_points)}
+
+    for dataset, spectra in fft_sets.items():
+        yield 'smooth_intensities', dataset, \
+            lambda item: smooth_intensities(item[1]), spectra
+
+    for N_padding in (1, 4, 16):
+        for dataset, spectra in fft_sets.items():
+            yield f'thickness_from_fft[N_padding={N_padding}]', dataset, \
+                lambda item, N_padding=N_padding: thickness_from_fft(item[0], item[1], item[2],
+                                                                     N_padding=N_padding), \
+                spectra
+
+    for method in ('linreg', 'ransac'):
+        for dataset, spectra in minmax_sets.items():
+            yield f'thickness_from_minmax[{method}]', dataset, \
+                lambda item, method=method: thickness_from_minmax(item[0], item[1], item[2],
+                                                                  min_peak_prominence=0.02,
+                                                                  method=method), \
+                spectra
+
+    for dataset, spectra in scheludko_sets.items():
+        prepared = with_start_stop(spectra)
+        yield 'thickness_from_scheludko[order_search]', dataset, \
+            lambda item: thickness_from_scheludko(item[0], item[1], item[2],
+                                                  wavelength_start=item[3],
+                                                  wavelength_stop=item[4]), \
+            prepared
+        yield 'thickness_from_scheludko[fixed_order]', dataset, \
+            lambda item: thickness_from_scheludko(item[0], item[1], item[2],
+                                                  wavelength_start=item[3],
+                                                  wavelength_stop=item[4],
+                                                  interference_order=item[5]), \
+            prepared
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-o', '--output', default='throughput.json', help='JSON output file')
+    parser.add_argument('--scale', type=int, default=200,
+                        help='Number of spectra of the synthetic stacks')
+    parser.add_argument('--num-points', type=int, default=1_000,
+                        help='Number of wavelengths of the synthetic spectra')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs per case')
+    parser.add_argument('--filter', default='', help='Only run cases containing this string')
+    args = parser.parse_args(argv)
+
+    results = []
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for name, dataset, func, items in cases(args.scale, args.num_points):
+            if args.filter not in name:
+                continue
+            stats = measure(func, items, repeat=args.repeat)
+            stats.update(name=name, dataset=dataset)
+            results.append(stats)
+            print(f"{name:45s} {dataset:35s} {stats['items_per_second']:10.1f} spectra/s "
+                  f"{stats['latency_median'] * 1e3:8.3f} ms")
+
+    write_json(args.output, {'metadata': metadata(), 'results': results})
+
+
+if __name__ == '__main__':
+    main()
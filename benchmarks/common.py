@@ -0,0 +1,101 @@
+"""
+Helpers shared by the benchmarks.
+"""
+import datetime
+import json
+import platform
+import subprocess
+import time
+from pathlib import Path
+
+import numpy as np
+import scipy
+
+import optifik
+from optifik.synthetic import reflectance, wavelength_grid
+
+
+DATA_DIR = Path(__file__).parent.parent / 'data'
+
+
+def n_lambda(lmbda):
+    """
+    For water + TTAB 1 CMC
+    """
+    return 1.324188 + 3102.060378 / (lmbda**2)
+
+
+def synthetic_stack(h_values, num_points=1_000, lambda_min=450, lambda_max=800):
+    """
+    Return (lambdas, intensities, n_values) for the thicknesses `h_values`.
+    """
+    lambdas = wavelength_grid(num_points, lambda_min, lambda_max)
+    n_values = n_lambda(lambdas)
+    intensities = reflectance(np.asarray(h_values), lambdas, n_values)
+    return lambdas, intensities, n_values
+
+
+def dataset_files(name):
+    """
+    Return the spectrum files of a bundled dataset.
+    """
+    return sorted((DATA_DIR / name).glob('*.xy'))
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+                              cwd=Path(__file__).parent,
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata():
+    return {'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'optifik': optifik.__version__,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor()}
+
+
+def measure(func, items, repeat=3, min_time=0.):
+    """
+    Call `func` on each item and measure the latencies.
+
+    The whole set is run `repeat` times (and at least during `min_time`
+    seconds); the best run gives the throughput.
+
+    Returns
+    -------
+    stats : dict
+    """
+    latencies = []
+    best = np.inf
+    runs = 0
+    start_all = time.perf_counter()
+    while runs < repeat or time.perf_counter() - start_all < min_time:
+        start_run = time.perf_counter()
+        for item in items:
+            start = time.perf_counter()
+            func(item)
+            latencies.append(time.perf_counter() - start)
+        best = min(best, time.perf_counter() - start_run)
+        runs += 1
+    latencies = np.array(latencies)
+    return {'num_items': len(items),
+            'runs': runs,
+            'items_per_second': len(items) / best,
+            'latency_mean': latencies.mean(),
+            'latency_median': np.median(latencies),
+            'latency_p95': np.percentile(latencies, 95),
+            'latency_min': latencies.min()}
+
+
+def write_json(path, content):
+    with open(path, 'w') as fh:
+        json.dump(content, fh, indent=2)
@@ -0,0 +1,49 @@
+"""
+Compare two benchmark JSON files.
+
+    python benchmarks/compare.py before.json after.json
+
+The exit code is 1 if a case is slower (or uses more memory) than the
+threshold.
+"""
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path) as fh:
+        content = json.load(fh)
+    return {(item['name'], item['dataset']): item for item in content['results']}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--key', default='items_per_second',
+                        help='Compared quantity. The default is items_per_second.')
+    parser.add_argument('--lower-is-better', action='store_true',
+                        help='Set for quantities such as latencies or memory')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Relative change flagged as regression. The default is 0.1.')
+    args = parser.parse_args(argv)
+
+    before, after = load(args.before), load(args.after)
+    regressions = 0
+    for key in sorted(set(before) & set(after)):
+        old, new = before[key][args.key], after[key][args.key]
+        ratio = new / old if old else float('inf')
+        worse = ratio > 1 + args.threshold if args.lower_is_better \
+            else ratio < 1 - args.threshold
+        regressions += worse
+        flag = 'REGRESSION' if worse else ''
+        print(f'{key[0]:45s} {key[1]:35s} {old:12.4g} {new:12.4g} {ratio:7.2f} {flag}')
+    for key in sorted(set(before) ^ set(after)):
+        print(f'{key[0]:45s} {key[1]:35s} only in one file')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,9 @@
-from scipy.signal import savgol_filter
-from scipy.signal import find_peaks
+import functools
 
-import inspect
-import matplotlib.pyplot as plt
+import numpy as np
+from scipy.ndimage import convolve1d
+from scipy.signal import savgol_filter, savgol_coeffs
+from scipy.signal import find_peaks
 
 from .utils import setup_matplotlib
 
@@ -20,6 +21,8 @@ def plot_spectrum(wavelengths, intensities, title=''):
     title : string
         Plot title.
     """
+    import matplotlib.pyplot as plt
+
     setup_matplotlib()
     plt.figure()
     plt.plot(wavelengths, intensities, 'o-', markersize=2)
@@ -30,6 +33,38 @@ def plot_spectrum(wavelengths, intensities, title=''):
     plt.show()
 
 
+def _find_extrema(intensities, min_peak_prominence, min_peak_distance=10):
+    """
+    Detect minima and maxima without any side effect.
+
+    Returns
+    -------
+    (peaks_min, peaks_max)
+    """
+    peaks_max, _ = find_peaks(intensities, prominence=min_peak_prominence, distance=min_peak_distance)
+    peaks_min, _ = find_peaks(-intensities, prominence=min_peak_prominence, distance=min_peak_distance)
+    return peaks_min, peaks_max
+
+
+def _plot_extrema(wavelengths, intensities, peaks_min, peaks_max):
+    """
+    Plot the extrema detected by `finds_peak`.
+    """
+    import matplotlib.pyplot as plt
+
+    setup_matplotlib()
+    plt.figure()
+    plt.plot(wavelengths, intensities, 'o-', markersize=2, label="Smoothed data")
+    plt.plot(wavelengths[peaks_max], intensities[peaks_max], 'ro')
+    plt.plot(wavelengths[peaks_min], intensities[peaks_min], 'ro')
+    plt.xlabel(r'$\lambda$ $[\mathrm{{nm}}]$')
+    plt.ylabel(r'$I^\star$')
+    plt.legend()
+    plt.title('Func Call: finds_peak()')
+    plt.tight_layout()
+    plt.show()
+
+
 def finds_peak(wavelengths, intensities, min_peak_prominence,
                min_peak_distance=10, plot=None):
     """
@@ -53,23 +88,12 @@ def finds_peak(wavelengths, intensities, min_peak_prominence,
     (peaks_min, peaks_max)
 
     """
-    if plot:
-        setup_matplotlib()
-
-    peaks_max, _ = find_peaks(intensities, prominence=min_peak_prominence, distance=min_peak_distance)
-    peaks_min, _ = find_peaks(-intensities, prominence=min_peak_prominence, distance=min_peak_distance)
+    peaks_min, peaks_max = _find_extrema(intensities,
+                                         min_peak_prominence,
+                                         min_peak_distance=min_peak_distance)
 
     if plot:
-        plt.figure()
-        plt.plot(wavelengths, intensities, 'o-', markersize=2, label="Smoothed data")
-        plt.plot(wavelengths[peaks_max], intensities[peaks_max], 'ro')
-        plt.plot(wavelengths[peaks_min], intensities[peaks_min], 'ro')
-        plt.xlabel(r'$\lambda$ $[\mathrm{{nm}}]$')
-        plt.ylabel(r'$I^\star$')
-        plt.legend()
-        plt.title(f'Func Call: {inspect.currentframe().f_code.co_name}()')
-        plt.tight_layout()
-        plt.show()
+        _plot_extrema(wavelengths, intensities, peaks_min, peaks_max)
 
     return peaks_min, peaks_max
 
@@ -92,6 +116,143 @@ def smooth_intensities(intensities, window_size=11, polynom_order=3):
     -------
     smoothed_intensities
 
+    See Also
+    --------
+    smooth_stack : same filter for stacks of spectra.
     """
     smoothed_intensities = savgol_filter(intensities, window_size, polynom_order)
     return smoothed_intensities
+
+
+@functools.lru_cache(maxsize=None)
+def _savgol_operators(window_size, polynom_order, deriv, delta):
+    """
+    Return the convolution kernel of a Savitzky-Golay filter and the
+    matrices giving its values at the edges, as with `mode='interp'`
+    of `scipy.signal.savgol_filter`.
+    """
+    kernel = savgol_coeffs(window_size, polynom_order, deriv=deriv, delta=delta)
+    half = window_size // 2
+    # Polynomial fitted on the first window, evaluated on its first half
+    # Positions centred and scaled to [-1, 1] for the conditioning
+    scale = max(half, 1)
+    positions = (np.arange(window_size) - half) / scale
+    vandermonde = np.vander(positions, polynom_order + 1, increasing=True)
+    fit = np.linalg.pinv(vandermonde)
+    powers = np.arange(polynom_order + 1)
+    # Derivative of the monomials, with respect to the wavelength
+    factors = np.ones(polynom_order + 1)
+    for order in range(deriv):
+        factors *= powers - order
+    exponents = np.maximum(powers - deriv, 0)
+
+    def evaluate(points):
+        return (factors * points[:, None] ** exponents) @ fit / (delta * scale) ** deriv
+
+    left = evaluate(positions[:half])
+    right = evaluate(positions[window_size - half:])
+    for array in (kernel, left, right):
+        array.flags.writeable = False
+    return kernel, left, right
+
+
+def _savgol(intensities, window_size, polynom_order, deriv, delta, out):
+    kernel, left, right = _savgol_operators(window_size, polynom_order, deriv, float(delta))
+    half = window_size // 2
+    # Edges first: `out` may be `intensities`
+    left_values = intensities[..., :window_size] @ left.T
+    right_values = intensities[..., -window_size:] @ right.T
+    convolve1d(intensities, kernel, axis=-1, output=out, mode='constant')
+    out[..., :half] = left_values
+    out[..., out.shape[-1] - half:] = right_values
+    return out
+
+
+def smooth_stack(intensities, window_size=11, polynom_order=3, out=None,
+                 derivative=False, wavelength_step=1.):
+    """
+    Smooth a stack of spectra with a Savitzky-Golay filter.
+
+    Gives the same values as `smooth_intensities` for each spectrum, with
+    the filter coefficients computed once per `window_size` and
+    `polynom_order` and all spectra filtered at once.
+
+    Parameters
+    ----------
+    intensities : ndarray
+        Intensity values, the last axis being the wavelengths.
+    window_size : int, optional
+        The length of the filter window. The default is 11.
+    polynom_order : int, optional
+        Polynom order used for the local fits. The default is 3.
+    out : ndarray, optional
+        Array receiving the smoothed intensities, with the shape of
+        `intensities`. It can be `intensities` itself.
+    derivative : bool, optional
+        Also return the first derivative of the smoothed intensities.
+    wavelength_step : scalar, optional
+        Wavelength step between two samples, for the derivative.
+        The default is 1 (derivative with respect to the sample index).
+
+    Returns
+    -------
+    smoothed_intensities : ndarray
+    derivative : ndarray
+        Only if `derivative` is True.
+    """
+    intensities = np.asarray(intensities)
+    if intensities.shape[-1] < window_size:
+        raise ValueError('window_size must not exceed the number of wavelengths.')
+    if polynom_order >= window_size:
+        raise ValueError('polynom_order must be less than window_size.')
+    if not np.issubdtype(intensities.dtype, np.floating):
+        intensities = intensities.astype(float)
+    # The derivative is computed before `out` may overwrite the intensities
+    slope = None
+    if derivative:
+        slope = _savgol(intensities, window_size, polynom_order, 1, wavelength_step,
+                        np.empty_like(intensities))
+    if out is None:
+        out = np.empty_like(intensities)
+    _savgol(intensities, window_size, polynom_order, 0, 1., out)
+    if derivative:
+        return out, slope
+    return out
+
+
+def derivative_extrema(derivative):
+    """
+    Locate the extrema of spectra from the sign changes of their derivative.
+
+    Parameters
+    ----------
+    derivative : ndarray
+        Derivative of the intensities, as returned by `smooth_stack`,
+        the last axis being the wavelengths.
+
+    Returns
+    -------
+    (minima, maxima) : boolean arrays of the shape of `derivative`.
+        True at the sample closest to each zero crossing. Where the
+        derivative is zero over several samples, an extremum is only
+        reported if its sign differs on both sides, at the first zero.
+    """
+    sign = np.sign(derivative)
+    # Sign of the first non-zero derivative from each sample on, 0 if none
+    num = sign.shape[-1]
+    index = np.where(sign != 0, np.arange(num), num)
+    index = np.minimum.accumulate(index[..., ::-1], axis=-1)[..., ::-1]
+    padded = np.concatenate([sign, np.zeros(sign.shape[:-1] + (1,))], axis=-1)
+    next_sign = np.take_along_axis(padded, index, axis=-1)
+    before, after = sign[..., :-1], next_sign[..., 1:]
+    falling = (before > 0) & (after < 0)
+    rising = (before < 0) & (after > 0)
+    # Closest sample to the crossing
+    shift = np.abs(derivative[..., 1:]) < np.abs(derivative[..., :-1])
+    minima = np.zeros(derivative.shape, dtype=bool)
+    maxima = np.zeros(derivative.shape, dtype=bool)
+    minima[..., :-1] |= rising & ~shift
+    minima[..., 1:] |= rising & shift
+    maxima[..., :-1] |= falling & ~shift
+    maxima[..., 1:] |= falling & shift
+    return minima, maxima
@@ -0,0 +1,606 @@
+import collections
+import inspect
+import mmap
+import os
+import shutil
+import tempfile
+import warnings
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+
+from .results import BatchResult, FIELDS, STATUS_OK, FAILURE_REASONS, failed_result
+from .results import Diagnostics
+from .metrics import REGISTRY
+from .io import load_spectrum
+from .reference import ReferenceSpectrum
+from .analysis import _find_extrema, smooth_intensities
+from .fft import _fft_core
+from .minmax import _minmax_core
+from .scheludko import _scheludko_core
+
+
+# Each method returns the result and the data of the diagnostic plots
+
+def _fft(wavelengths, intensities, refractive_index, **kwargs):
+    return _fft_core(wavelengths, intensities, refractive_index, **kwargs)
+
+
+def _minmax(wavelengths, intensities, refractive_index, **kwargs):
+    return _minmax_core(wavelengths, intensities, refractive_index, **kwargs)
+
+
+def _scheludko(wavelengths, intensities, refractive_index,
+               min_peak_prominence=0.02, **kwargs):
+    order = kwargs.get('interference_order')
+    if order != 0 and (kwargs.get('wavelength_start') is None
+                       or kwargs.get('wavelength_stop') is None):
+        # Default range computed by the core, where failures are counted
+        kwargs['extrema'] = _find_extrema(intensities, min_peak_prominence)
+    return _scheludko_core(wavelengths, intensities, refractive_index, **kwargs)
+
+
+METHODS = {
+    'fft': _fft,
+    'minmax': _minmax,
+    'scheludko': _scheludko,
+}
+
+
+def _keywords(func):
+    # Parameters of a method core after the spectrum and the refractive index
+    return frozenset(list(inspect.signature(func).parameters)[3:])
+
+
+# Parameters accepted by each method, checked before the analysis so
+# that a misspelt parameter raises even with errors='coerce'
+KEYWORDS = {
+    'fft': _keywords(_fft_core),
+    'minmax': _keywords(_minmax_core),
+    'scheludko': (_keywords(_scheludko_core) - {'extrema'}) | {'min_peak_prominence'},
+}
+
+
+def _analyse(method, wavelengths, intensities, refractive_index, /,
+             errors='raise', **kwargs):
+    """
+    Return the result of `analyse_spectrum` and the data of its plots,
+    partial or None if the analysis failed.
+    """
+    try:
+        func = METHODS[method.lower()]
+    except KeyError:
+        raise ValueError(f'Unknown method: {method}')
+    unknown = set(kwargs) - KEYWORDS[method.lower()]
+    if unknown:
+        raise TypeError(f'Unexpected parameters of the {method} method: '
+                        f'{", ".join(sorted(unknown))}')
+    if errors == 'raise':
+        return func(wavelengths, intensities, refractive_index, **kwargs)
+    elif errors != 'coerce':
+        raise ValueError(f'Wrong value for `errors`: {errors}')
+    try:
+        return func(wavelengths, intensities, refractive_index, errors=errors, **kwargs)
+    except TypeError as err:
+        # Missing or wrong type of input, e.g. intensities_void=None at order 0
+        return failed_result('invalid_input', f'{type(err).__name__}: {err}'), None
+    except (RuntimeError, ValueError, IndexError, np.linalg.LinAlgError) as err:
+        # Unexpected failures, already counted by the metrics
+        return failed_result(getattr(err, 'optifik_reason', 'failed'),
+                             f'{type(err).__name__}: {err}'), None
+
+
+def analyse_spectrum(method, wavelengths, intensities, refractive_index, /,
+                     errors='raise', diagnostics=False, **kwargs):
+    """
+    Compute the thickness of a single spectrum without plotting.
+
+    This function has no side effect on global states (matplotlib
+    in particular) and can safely be called from several threads.
+
+    Parameters
+    ----------
+    method : string
+        Either 'fft', 'minmax' or 'scheludko'.
+    wavelengths : array
+        Wavelength values in nm.
+    intensities : array
+        Intensity values.
+    refractive_index : scalar, array or `optifik.dispersion.RefractiveIndex`
+        Value of the refractive index of the medium, or its model.
+    errors : string, optional
+        With 'raise' (default), failures raise an exception (or emit a
+        warning, as in `thickness_from_minmax`). With 'coerce', failures
+        are only reported in the results, without exception nor warning
+        for the usual failures of the methods.
+    diagnostics : bool, optional
+        Store the intermediate data of the analysis in the attribute
+        `diagnostics` of the results, see `optifik.results.Diagnostics`.
+    **kwargs :
+        Extra parameters passed to the method, as for
+        `thickness_from_fft`, `thickness_from_minmax` or
+        `thickness_from_scheludko` (except `plot`).
+
+    Returns
+    -------
+    results : Instance of `OptimizeResult` class.
+        The attribute `thickness` gives the thickness value in nm.
+        If the analysis failed, the thickness is NaN and the attributes
+        `status` and `message` describe the failure
+        (see `optifik.results`).
+
+    Notes
+    -----
+    For the 'scheludko' method, if `wavelength_start` and `wavelength_stop`
+    are not given and the interference order is not 0, they are computed
+    as in `get_default_start_stop_wavelengths` with `min_peak_prominence`
+    (default: 0.02).
+
+    The first parameters are positional-only, so that the `method`
+    parameter of `thickness_from_minmax` can be passed in `kwargs`.
+    """
+    result, plot_data = _analyse(method, wavelengths, intensities, refractive_index,
+                                 errors=errors, **kwargs)
+    if diagnostics:
+        result.diagnostics = Diagnostics.capture(method, wavelengths, intensities,
+                                                 result, plot_data)
+    return result
+
+
+def analyse_file(method, path, refractive_index, /,
+                 wavelength_min=0, wavelength_max=np.inf, smooth=False,
+                 **kwargs):
+    """
+    Load a spectrum file and compute its thickness without plotting.
+
+    Parameters
+    ----------
+    method : string
+        Either 'fft', 'minmax' or 'scheludko'.
+    path : string
+        File path.
+    refractive_index : scalar, array or `optifik.dispersion.RefractiveIndex`
+        Value of the refractive index of the medium, or its model.
+    wavelength_min : scalar, optional
+        Cut the data at this minimum wavelength (included).
+    wavelength_max : scalar, optional
+        Cut the data at this maximum wavelength (included).
+    smooth : bool, optional
+        Smooth the intensities with `smooth_intensities` before analysis.
+    **kwargs :
+        Extra parameters passed to the method, see `analyse_spectrum`.
+
+    Returns
+    -------
+    results : Instance of `OptimizeResult` class.
+        The attribute `thickness` gives the thickness value in nm.
+    """
+    lambdas, intensities = load_spectrum(path,
+                                         wavelength_min=wavelength_min,
+                                         wavelength_max=wavelength_max)
+    if smooth:
+        intensities = smooth_intensities(intensities)
+    return analyse_spectrum(method, lambdas, intensities, refractive_index,
+                            **kwargs)
+
+
+def aggregate_timings(results):
+    """
+    Sum the per-stage timings of several results.
+
+    Parameters
+    ----------
+    results : iterable
+        Results computed with `timings=True`, or aggregated timings
+        returned by this function. Results without timings are ignored.
+
+    Returns
+    -------
+    timings : dict
+        For each stage, the number of calls `count` and the sums of the
+        recorded quantities (see `optifik.utils.StageTimer.results`).
+    """
+    aggregated = {}
+    for result in results:
+        if 'timings' in result:
+            # A result, otherwise already aggregated timings
+            stages, count = result['timings'], 1
+        else:
+            stages, count = result, None
+        for stage, record in stages.items():
+            total = aggregated.setdefault(stage, {'count': 0})
+            total['count'] += record['count'] if count is None else count
+            for key, value in record.items():
+                if key != 'count':
+                    total[key] = total.get(key, 0) + value
+    return aggregated
+
+
+def _chunks(num_spectra, chunk_size):
+    """
+    Return (start, stop) tuples covering `num_spectra` items.
+    """
+    return [(start, min(start + chunk_size, num_spectra))
+            for start in range(0, num_spectra, chunk_size)]
+
+
+def _default_chunk_size(num_spectra, max_workers):
+    # A few tasks per worker to balance the load
+    return max(1, -(-num_spectra // (4 * max_workers)))
+
+
+def _collect_warnings(func, *args):
+    """
+    Call `func(*args)` and return its value and the warnings it emitted.
+
+    Warnings are counted by category and message.
+    """
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        value = func(*args)
+    return value, collections.Counter((item.category, str(item.message)) for item in caught)
+
+
+def _warn_summary(caught, status, stacklevel=3):
+    """
+    Emit once each distinct warning of a batch and a summary of the failures.
+    """
+    num_spectra = len(status)
+    for (category, message), count in caught.items():
+        warnings.warn(f'{message} ({count} of {num_spectra} spectra)', category,
+                      stacklevel=stacklevel)
+    failed = status[status != STATUS_OK]
+    if len(failed):
+        codes, counts = np.unique(failed, return_counts=True)
+        details = ', '.join(f'{FAILURE_REASONS.get(code, "failed")}: {count}'
+                            for code, count in zip(codes.tolist(), counts.tolist()))
+        warnings.warn(f'{len(failed)} of {num_spectra} spectra failed ({details}).',
+                      RuntimeWarning, stacklevel=stacklevel)
+
+
+def _diagnostics_kwargs(diagnostics):
+    if diagnostics is None:
+        return {}
+    if not (diagnostics in ('failed', 'all')
+            or (isinstance(diagnostics, float) and 0 < diagnostics <= 1)):
+        raise ValueError(f'Wrong value for `diagnostics`: {diagnostics}')
+    return {'diagnostics': True}
+
+
+def _keep_diagnostics(results, start, diagnostics):
+    """
+    Remove the diagnostics from `results` and return those to keep,
+    by index of spectrum.
+    """
+    kept = {}
+    for idx, result in enumerate(results, start):
+        captured = result.pop('diagnostics', None)
+        if captured is None:
+            continue
+        if diagnostics == 'all' or result.get('status', STATUS_OK) != STATUS_OK \
+                or (isinstance(diagnostics, float)
+                    and (idx * diagnostics) // 1 != ((idx - 1) * diagnostics) // 1):
+            captured.index = idx
+            kept[idx] = captured
+    return kept
+
+
+def thickness_batch(method, wavelengths, intensities, refractive_index, /,
+                    max_workers=None, chunk_size=None, cache=None, errors='raise',
+                    diagnostics=None, **kwargs):
+    """
+    Compute the thicknesses of a stack of spectra with a pool of threads.
+
+    NumPy and SciPy release the GIL in their heavy computations, so that
+    spectra are processed in parallel in one process, without the
+    start-up and pickling costs of a process pool.
+
+    Parameters
+    ----------
+    method : string
+        Either 'fft', 'minmax' or 'scheludko'.
+    wavelengths : array
+        Wavelength values in nm, shared by all spectra.
+    intensities : 2D array
+        Intensity values, one spectrum per row.
+    refractive_index : scalar, array or `optifik.dispersion.RefractiveIndex`
+        Value of the refractive index of the medium, or its model.
+    max_workers : int, optional
+        Number of threads. If `None`, use the number of CPUs.
+    chunk_size : int, optional
+        Number of spectra processed by each task.
+        If `None`, a value is chosen to give a few tasks per thread.
+    cache : Instance of `optifik.cache.ResultCache` class, optional
+        If given, the results of unchanged spectra and parameters are
+        read from this cache, and new results are stored in it.
+    errors : string, optional
+        With 'raise' (default), the first failure raises an exception.
+        With 'coerce', failures are reported in the attributes `status`
+        and `message` of the results. The warnings of the spectra are
+        then emitted once per distinct message with their count,
+        followed by a summary of the failures.
+    diagnostics : string or float, optional
+        Keep the intermediate data of the analyses in the attribute
+        `diagnostics` of the results (see `optifik.results.Diagnostics`):
+        'failed' for the failed spectra, 'all' for all spectra, or a
+        fraction of the spectra, evenly spaced, in addition to the
+        failed ones.
+    **kwargs :
+        Extra parameters passed to the method, see `analyse_spectrum`.
+
+    Returns
+    -------
+    results : Instance of `BatchResult` class.
+        The results, in the order of `intensities`. Indexing gives the
+        `OptimizeResult` of a spectrum.
+        With `timings=True`, the attribute `timings` gives the
+        timings aggregated over all spectra, see `aggregate_timings`.
+    """
+    intensities = np.asarray(intensities)
+    if intensities.ndim != 2:
+        raise ValueError('intensities must be a 2D array.')
+    num_spectra = len(intensities)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = _default_chunk_size(num_spectra, max_workers)
+
+    if errors not in ('raise', 'coerce'):
+        raise ValueError(f'Wrong value for `errors`: {errors}')
+    kwargs.update(_diagnostics_kwargs(diagnostics))
+    analyse = analyse_spectrum if cache is None else cache.analyse
+
+    def work(bounds):
+        start, stop = bounds
+        # Only the results of a chunk are held as dicts
+        results = [analyse(method, wavelengths, intensities[idx],
+                           refractive_index, errors=errors, **kwargs)
+                   for idx in range(start, stop)]
+        kept = _keep_diagnostics(results, start, diagnostics) if diagnostics else None
+        batch = BatchResult.from_results(results)
+        if kept is not None:
+            # Indices in the chunk, shifted by `concatenate`
+            batch.diagnostics = {idx - start: captured for idx, captured in kept.items()}
+        return batch
+
+    def run():
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return BatchResult.concatenate(list(executor.map(work,
+                                                             _chunks(num_spectra, chunk_size))))
+
+    if errors == 'raise':
+        results = run()
+    else:
+        results, caught = _collect_warnings(run)
+        _warn_summary(caught, results.status)
+    if kwargs.get('timings'):
+        results.timings = aggregate_timings(results)
+    return results
+
+
+#
+# Multiprocess batch with memory-mapped inputs and outputs
+#
+
+# Arrays attached by each worker process, filled by `_init_shared_worker`
+_SHARED = {}
+
+
+def _default_shared_dir():
+    # Prefer a RAM-backed filesystem when available
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm'
+    return None
+
+
+def _memmap_spec(array, directory, name):
+    """
+    Return a description of a file-backed copy of `array`.
+
+    If `array` is already a `numpy.memmap`, its file is reused.
+    """
+    # Slices of a memmap share its attributes but not its offset
+    if isinstance(array, np.memmap) and isinstance(array.base, mmap.mmap):
+        return (array.filename, array.dtype.str, array.shape, array.offset)
+
+    path = os.path.join(directory, name)
+    out = np.memmap(path, dtype=array.dtype, mode='w+', shape=array.shape)
+    out[...] = array
+    out.flush()
+    return (path, array.dtype.str, array.shape, 0)
+
+
+def _open_spec(spec, mode):
+    path, dtype, shape, offset = spec
+    return np.memmap(path, dtype=dtype, mode=mode, shape=shape, offset=offset)
+
+
+def _init_shared_worker(specs, method, kwargs, cache):
+    _SHARED.clear()
+    for key, spec in specs.items():
+        mode = 'r+' if key.startswith('out_') else 'r'
+        _SHARED[key] = _open_spec(spec, mode)
+    _SHARED['method'] = method
+    _SHARED['kwargs'] = kwargs
+    _SHARED['analyse'] = analyse_spectrum if cache is None else cache.analyse
+    # Inherited from the parent process with fork
+    REGISTRY.reset()
+
+
+def _shared_task(start, stop):
+    """
+    Process the spectra `start:stop` of the shared stack in a worker.
+    """
+    kwargs = dict(_SHARED['kwargs'])
+    if 'refractive_index' in _SHARED:
+        refractive_index = _SHARED['refractive_index']
+    else:
+        refractive_index = kwargs.pop('refractive_index')
+    if 'intensities_void' in _SHARED:
+        kwargs['intensities_void'] = _SHARED['intensities_void']
+
+    wavelengths = _SHARED['wavelengths']
+    intensities = _SHARED['intensities']
+    diagnostics = kwargs.pop('keep_diagnostics', None)
+
+    def run():
+        return [_SHARED['analyse'](_SHARED['method'], wavelengths,
+                                   intensities[idx], refractive_index, **kwargs)
+                for idx in range(start, stop)]
+
+    if kwargs.get('errors', 'raise') == 'raise':
+        results, caught = run(), collections.Counter()
+    else:
+        results, caught = _collect_warnings(run)
+    timings = aggregate_timings([result for result in results if 'timings' in result])
+    kept = _keep_diagnostics(results, start, diagnostics) if diagnostics else {}
+    batch = BatchResult.from_results(results)
+    for name in FIELDS:
+        _SHARED[f'out_{name}'][start:stop] = getattr(batch, name)
+    messages = {} if batch.message is None else \
+        {start + idx: message for idx, message in enumerate(batch.message)
+         if message is not None}
+    # Only a few numbers, the failure messages and the kept diagnostics
+    # go back to the parent process
+    return timings, REGISTRY.snapshot(reset=True), messages, caught, kept
+
+
+def thickness_batch_shared(method, wavelengths, intensities, refractive_index, /,
+                           max_workers=None, chunk_size=None,
+                           shared_dir=None, mp_context=None, cache=None,
+                           errors='raise', diagnostics=None, **kwargs):
+    """
+    Compute the thicknesses of a stack of spectra with a pool of processes.
+
+    Inputs and outputs are placed once in memory-mapped files, shared by
+    all the workers. Each task only carries the bounds of a range of
+    spectra, so that no array is pickled between processes.
+
+    Parameters
+    ----------
+    method : string
+        Either 'fft', 'minmax' or 'scheludko'.
+    wavelengths : array
+        Wavelength values in nm, shared by all spectra.
+    intensities : 2D array
+        Intensity values, one spectrum per row.
+        If it is a `numpy.memmap`, its file is used directly.
+    refractive_index : scalar, array or `optifik.dispersion.RefractiveIndex`
+        Value of the refractive index of the medium, or its model.
+    max_workers : int, optional
+        Number of processes. If `None`, use the number of CPUs.
+    chunk_size : int, optional
+        Number of spectra processed by each task.
+        If `None`, a value is chosen to give a few tasks per process.
+    shared_dir : string, optional
+        Directory for the temporary memory-mapped files.
+        By default, `/dev/shm` if available, otherwise the system
+        temporary directory.
+    mp_context : multiprocessing context, optional
+        Context used to start the processes.
+    cache : Instance of `optifik.cache.ResultCache` class, optional
+        If given, the results of unchanged spectra and parameters are
+        read from this cache, and new results are stored in it.
+    errors : string, optional
+        With 'raise' (default), the first failure raises an exception.
+        With 'coerce', failures are reported in the attributes `status`
+        and `message` of the results. The warnings of the spectra are
+        then emitted once per distinct message with their count,
+        followed by a summary of the failures.
+    diagnostics : string or float, optional
+        Keep the intermediate data of the analyses in the attribute
+        `diagnostics` of the results (see `optifik.results.Diagnostics`):
+        'failed' for the failed spectra, 'all' for all spectra, or a
+        fraction of the spectra, evenly spaced, in addition to the
+        failed ones.
+    **kwargs :
+        Extra parameters passed to the method, see `analyse_spectrum`.
+
+    Returns
+    -------
+    results : Instance of `BatchResult` class.
+        The results, in the order of `intensities`.
+        With `timings=True`, the attribute `timings` gives the
+        timings aggregated over all spectra, see `aggregate_timings`.
+
+    Notes
+    -----
+    The metrics of the workers are merged in `optifik.metrics.REGISTRY`.
+
+    The peak indices of `thickness_from_minmax` are not collected,
+    only the scalar fields of `BatchResult` are shared by the workers.
+    """
+    intensities = np.asanyarray(intensities)
+    if intensities.ndim != 2:
+        raise ValueError('intensities must be a 2D array.')
+    num_spectra = len(intensities)
+    if num_spectra == 0:
+        return BatchResult(0)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = _default_chunk_size(num_spectra, max_workers)
+    if shared_dir is None:
+        shared_dir = _default_shared_dir()
+    if errors not in ('raise', 'coerce'):
+        raise ValueError(f'Wrong value for `errors`: {errors}')
+    kwargs['errors'] = errors
+    kwargs.update(_diagnostics_kwargs(diagnostics))
+    if diagnostics is not None:
+        kwargs['keep_diagnostics'] = diagnostics
+
+    tmp_dir = tempfile.mkdtemp(prefix='optifik-', dir=shared_dir)
+    try:
+        arrays = {'wavelengths': np.ascontiguousarray(wavelengths, dtype=float),
+                  'intensities': intensities if isinstance(intensities, np.memmap)
+                  else np.ascontiguousarray(intensities),
+                  }
+        for name, (dtype, missing) in FIELDS.items():
+            arrays[f'out_{name}'] = np.full(num_spectra, missing, dtype=dtype)
+        if np.ndim(refractive_index) > 0:
+            arrays['refractive_index'] = np.ascontiguousarray(refractive_index, dtype=float)
+        else:
+            kwargs['refractive_index'] = refractive_index
+        if kwargs.get('intensities_void') is not None and \
+                not isinstance(kwargs['intensities_void'], ReferenceSpectrum):
+            # A reference spectrum is sent with the parameters
+            arrays['intensities_void'] = np.ascontiguousarray(kwargs.pop('intensities_void'),
+                                                              dtype=float)
+
+        specs = {key: _memmap_spec(array, tmp_dir, key)
+                 for key, array in arrays.items()}
+
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 mp_context=mp_context,
+                                 initializer=_init_shared_worker,
+                                 initargs=(specs, method, kwargs, cache)) as executor:
+            futures = [executor.submit(_shared_task, start, stop)
+                       for start, stop in _chunks(num_spectra, chunk_size)]
+            timings = {}
+            messages = {}
+            caught = collections.Counter()
+            kept = {}
+            for future in futures:
+                task_timings, metrics, task_messages, task_caught, task_kept = future.result()
+                timings = aggregate_timings([timings, task_timings])
+                REGISTRY.merge(metrics)
+                messages.update(task_messages)
+                caught.update(task_caught)
+                kept.update(task_kept)
+
+        result = BatchResult(num_spectra,
+                             **{name: np.array(_open_spec(specs[f'out_{name}'], 'r'))
+                                for name in FIELDS})
+        if messages:
+            result.message = np.full(num_spectra, None, dtype=object)
+            for idx, message in messages.items():
+                result.message[idx] = message
+        if timings:
+            result.timings = timings
+        if diagnostics is not None:
+            result.diagnostics = kept
+        if errors == 'coerce':
+            _warn_summary(caught, result.status)
+        return result
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
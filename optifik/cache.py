@@ -0,0 +1,247 @@
+"""
+On-disk cache of thickness results, addressed by the content of the inputs.
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+
+import numpy as np
+
+from . import __version__
+from .metrics import REGISTRY
+from .batch import analyse_spectrum
+from .reference import ReferenceSpectrum
+
+
+# Version of the layout of the stored results, part of the keys with
+# the version of optifik: increment it when the layout changes
+CACHE_FORMAT = 1
+
+
+def _update(digest, value):
+    """
+    Feed `value` to the hash object `digest`.
+    """
+    if isinstance(value, np.ndarray):
+        digest.update(f'array:{value.dtype.str}:{value.shape}:'.encode())
+        digest.update(np.ascontiguousarray(value).view(np.uint8))
+    elif isinstance(value, dict):
+        digest.update(b'dict:')
+        for key in sorted(value):
+            digest.update(f'{key}='.encode())
+            _update(digest, value[key])
+    elif isinstance(value, ReferenceSpectrum):
+        digest.update(b'reference:')
+        _update(digest, (value.wavelengths, value.intensities))
+    elif isinstance(value, (list, tuple)):
+        digest.update(f'seq:{len(value)}:'.encode())
+        for item in value:
+            _update(digest, item)
+    else:
+        # Scalars (Python or NumPy), strings and None
+        digest.update(f'{type(value).__name__}:{value!r};'.encode())
+
+
+class ResultCache:
+    """ Cache of thickness results stored as files in a directory.
+
+    A result is addressed by a hash of the method name, the wavelengths,
+    the intensities, the refractive index and the parameters, so that a
+    new analysis of unchanged spectra with unchanged parameters reads the
+    stored result instead of computing it. The hash also includes the
+    version of optifik and `CACHE_FORMAT`: results computed by another
+    version are not reused.
+    When the total size exceeds `max_bytes`, the least recently used
+    results are removed.
+
+    The cache can be shared by several threads and processes.
+
+    Parameters
+    ----------
+    directory : string
+        Directory of the cache, created if needed.
+    max_bytes : int, optional
+        Maximum size of the cache in bytes. The default is 1 GiB.
+
+    Attributes
+    ----------
+    hits : int
+        Number of results read from the cache by this instance.
+    misses : int
+        Number of results computed by this instance.
+    """
+    def __init__(self, directory, max_bytes=2**30):
+        self.directory = os.fspath(directory)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._size = None
+
+    def __getstate__(self):
+        # Sent to worker processes: the lock is recreated there
+        return {'directory': self.directory, 'max_bytes': self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state['directory'], state['max_bytes'])
+
+    def key(self, method, wavelengths, intensities, refractive_index, /, **kwargs):
+        """
+        Return the key of an analysis.
+
+        Parameters
+        ----------
+        method : string
+            Either 'fft', 'minmax' or 'scheludko'.
+        wavelengths : array
+            Wavelength values in nm.
+        intensities : array
+            Intensity values.
+        refractive_index : scalar, array or callable
+            Value of the refractive index of the medium, or function
+            of the wavelengths.
+        **kwargs :
+            Parameters of the method.
+
+        Returns
+        -------
+        key : string
+        """
+        wavelengths = np.asarray(wavelengths)
+        if callable(refractive_index):
+            refractive_index = np.asarray(refractive_index(wavelengths))
+        digest = hashlib.blake2b(digest_size=20)
+        for value in (__version__, CACHE_FORMAT, method.lower(), wavelengths,
+                      np.asarray(intensities), refractive_index, kwargs):
+            _update(digest, value)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """
+        Return the stored result of `key`, or None.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fh:
+                result = pickle.load(fh)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        try:
+            # Recently used
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return result
+
+    def put(self, key, result):
+        """
+        Store the result of `key`.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as fh:
+            pickle.dump(result, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            size = fh.tell()
+
+        with self._lock:
+            try:
+                # Size of the replaced result
+                size -= os.stat(path).st_size
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_path, path)
+            if self._size is None:
+                self._size = sum(size for _, _, size in self._entries())
+            else:
+                self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        """
+        Return (mtime, path, size) of all the stored results.
+        """
+        entries = []
+        with os.scandir(self.directory) as subdirs:
+            for subdir in subdirs:
+                if not subdir.is_dir():
+                    continue
+                with os.scandir(subdir.path) as files:
+                    for entry in files:
+                        if entry.name.startswith('.tmp-'):
+                            continue
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        entries.append((stat.st_mtime_ns, entry.path, stat.st_size))
+        return entries
+
+    def _evict(self):
+        # Remove the oldest results down to 90% of the limit, so that
+        # the directory is not scanned at each insertion
+        entries = sorted(self._entries())
+        size = sum(entry[2] for entry in entries)
+        for _, path, entry_size in entries:
+            if size <= 0.9 * self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+        self._size = size
+
+    def analyse(self, method, wavelengths, intensities, refractive_index, /, **kwargs):
+        """
+        Return the cached result of an analysis, computing it if needed.
+
+        Parameters are those of `optifik.batch.analyse_spectrum`.
+        Results computed with `timings=True` are neither read from
+        nor written to the cache.
+        """
+        if kwargs.get('timings'):
+            return analyse_spectrum(method, wavelengths, intensities, refractive_index,
+                                    **kwargs)
+        key = self.key(method, wavelengths, intensities, refractive_index, **kwargs)
+        result = self.get(key)
+        if result is not None:
+            with self._lock:
+                self.hits += 1
+            if REGISTRY.enabled:
+                REGISTRY.inc('optifik_cache_requests_total', result='hit')
+            return result
+        with self._lock:
+            self.misses += 1
+        if REGISTRY.enabled:
+            REGISTRY.inc('optifik_cache_requests_total', result='miss')
+        result = analyse_spectrum(method, wavelengths, intensities, refractive_index, **kwargs)
+        self.put(key, result)
+        return result
+
+    def __len__(self):
+        return len(self._entries())
+
+    @property
+    def size(self):
+        """Total size of the stored results in bytes."""
+        return sum(entry[2] for entry in self._entries())
+
+    def clear(self):
+        """
+        Remove all the stored results.
+        """
+        with self._lock:
+            for _, path, _ in self._entries():
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self._size = 0
@@ -0,0 +1,226 @@
+"""
+Radiometric calibration of raw spectra.
+
+Raw counts are converted to normalised intensities
+
+.. math::
+
+    I^\\star = \\frac{I - I_\\mathrm{dark}}{I_\\mathrm{ref} - I_\\mathrm{dark}}
+
+before any thickness method is applied. The reciprocal of the
+denominator is computed once, and the correction is applied in place,
+by blocks of spectra, on whole stacks or on streamed chunks.
+"""
+import numpy as np
+
+from .io import load_spectrum
+
+
+def _average(frames, name):
+    frames = np.asarray(frames, dtype=float)
+    if frames.ndim == 1:
+        return frames, 1
+    if frames.ndim == 2 and len(frames):
+        return frames.mean(axis=0), len(frames)
+    raise ValueError(f'{name} must be one spectrum or a non-empty 2D array of spectra.')
+
+
+class Calibration:
+    """ Dark and reference correction of raw counts.
+
+    Parameters
+    ----------
+    dark : array
+        Dark spectrum, or several dark spectra (one per row) averaged.
+    reference : array
+        Reference spectrum, or several reference spectra (one per row)
+        averaged.
+    wavelengths : array, optional
+        Wavelength values in nm of the spectra.
+    saturation : scalar, optional
+        Counts greater than or equal to this level are saturated.
+        Saturated values are replaced by `fill_value`, and wavelengths
+        where the reference is saturated are invalid.
+    min_denominator : scalar, optional
+        Wavelengths where `reference - dark` is lower than or equal to
+        this value are invalid. The default is 0.
+    fill_value : scalar, optional
+        Calibrated value of saturated counts. The default is NaN.
+
+    Attributes
+    ----------
+    valid : array
+        Mask of the valid wavelengths. Calibrated values are NaN
+        elsewhere.
+    num_dark_frames : int
+        Number of dark spectra averaged in `dark`.
+    """
+    def __init__(self, dark, reference, wavelengths=None, saturation=None,
+                 min_denominator=0., fill_value=np.nan):
+        self.dark, self.num_dark_frames = _average(dark, 'dark')
+        self.reference, _ = _average(reference, 'reference')
+        if self.dark.shape != self.reference.shape:
+            raise ValueError('dark and reference must have the same length.')
+        if wavelengths is not None:
+            wavelengths = np.asarray(wavelengths, dtype=float)
+            if wavelengths.shape != self.dark.shape:
+                raise ValueError('wavelengths and dark must have the same length.')
+        self.wavelengths = wavelengths
+        self.saturation = saturation
+        self.min_denominator = min_denominator
+        self.fill_value = fill_value
+        self._update()
+
+    def _update(self):
+        # Reciprocal of the denominator, computed once
+        denominator = self.reference - self.dark
+        self.valid = denominator > self.min_denominator
+        if self.saturation is not None:
+            self.valid &= self.reference < self.saturation
+        self._reciprocal = np.full_like(denominator, np.nan)
+        np.divide(1., denominator, out=self._reciprocal, where=self.valid)
+        self._constants = {}
+
+    def _constants_as(self, dtype):
+        # Dark and reciprocal in the precision of the output
+        if dtype not in self._constants:
+            self._constants[dtype] = (self.dark.astype(dtype), self._reciprocal.astype(dtype))
+        return self._constants[dtype]
+
+    @classmethod
+    def from_files(cls, dark_paths, reference_paths, wavelength_min=0,
+                   wavelength_max=np.inf, delimiter=',', **kwargs):
+        """
+        Load the dark and reference spectra from files.
+
+        Parameters
+        ----------
+        dark_paths : string or list of strings
+            Paths of the dark spectra, averaged.
+        reference_paths : string or list of strings
+            Paths of the reference spectra, averaged.
+        wavelength_min : scalar, optional
+            Cut the data at this minimum wavelength (included).
+        wavelength_max : scalar, optional
+            Cut the data at this maximum wavelength (included).
+        delimiter : string, optional
+            Delimiter between columns in the datafiles.
+        **kwargs :
+            Extra parameters of the constructor.
+
+        Raises
+        ------
+        ValueError
+            if the files do not share the same wavelengths.
+
+        Returns
+        -------
+        calibration : Instance of `Calibration` class.
+        """
+        spectra = {}
+        wavelengths = None
+        for name, paths in (('dark', dark_paths), ('reference', reference_paths)):
+            if isinstance(paths, (str, bytes)) or not hasattr(paths, '__iter__'):
+                paths = [paths]
+            frames = []
+            for path in paths:
+                lambdas, intensities = load_spectrum(path, wavelength_min=wavelength_min,
+                                                     wavelength_max=wavelength_max,
+                                                     delimiter=delimiter)
+                if wavelengths is None:
+                    wavelengths = lambdas
+                elif not np.array_equal(lambdas, wavelengths):
+                    raise ValueError(f'{path} does not share the wavelengths of the other files.')
+                frames.append(intensities)
+            spectra[name] = np.array(frames)
+        return cls(spectra['dark'], spectra['reference'], wavelengths=wavelengths, **kwargs)
+
+    def add_dark(self, dark):
+        """
+        Add dark spectra to the running average of the dark.
+
+        Parameters
+        ----------
+        dark : array
+            One dark spectrum, or several (one per row).
+        """
+        mean, count = _average(dark, 'dark')
+        if mean.shape != self.dark.shape:
+            raise ValueError('dark must have the length of the calibration.')
+        total = self.num_dark_frames + count
+        self.dark = self.dark + (mean - self.dark) * (count / total)
+        self.num_dark_frames = total
+        self._update()
+
+    def apply(self, counts, out=None, chunk_size=4096):
+        """
+        Return the calibrated intensities of raw counts.
+
+        Parameters
+        ----------
+        counts : array
+            One spectrum, or a 2D array of spectra (one per row),
+            possibly memory-mapped.
+        out : array, optional
+            Array of floats of the shape of `counts` receiving the
+            result. It can be `counts` itself, for a calibration in place.
+        chunk_size : int, optional
+            Number of spectra processed at once, which bounds the size
+            of the temporary arrays.
+
+        Returns
+        -------
+        intensities : array
+            Calibrated intensities, in float32 for float32 or 16-bit
+            counts, in float64 otherwise. NaN at invalid wavelengths.
+        """
+        counts = np.asarray(counts)
+        if counts.shape[-1:] != self.dark.shape:
+            raise ValueError('counts must have the length of the calibration.')
+        if out is None:
+            out = np.empty(counts.shape, dtype=np.result_type(counts.dtype, np.float32))
+        elif out.shape != counts.shape:
+            raise ValueError('out must have the shape of counts.')
+        elif not np.issubdtype(out.dtype, np.floating):
+            raise ValueError('out must be an array of floats.')
+        dark, reciprocal = self._constants_as(out.dtype)
+
+        counts_2d = np.atleast_2d(counts)
+        out_2d = np.atleast_2d(out)
+        for start in range(0, len(counts_2d), chunk_size):
+            block_counts = counts_2d[start:start + chunk_size]
+            block = out_2d[start:start + chunk_size]
+            # Before the counts are overwritten by an in-place calibration
+            saturated = None
+            if self.saturation is not None:
+                saturated = block_counts >= self.saturation
+                saturated &= self.valid
+            np.subtract(block_counts, dark, out=block)
+            block *= reciprocal
+            if saturated is not None and saturated.any():
+                block[saturated] = self.fill_value
+        return out
+
+    def apply_chunks(self, chunks, chunk_size=4096):
+        """
+        Calibrate streamed chunks of spectra.
+
+        Chunks of floats are calibrated in place, others are converted.
+
+        Parameters
+        ----------
+        chunks : iterable of arrays
+            Chunks of spectra (one per row), as yielded by
+            `optifik.synthetic.generate_spectra`.
+        chunk_size : int, optional
+            See `apply`.
+
+        Yields
+        ------
+        intensities : 2D array
+            Calibrated chunk.
+        """
+        for chunk in chunks:
+            in_place = isinstance(chunk, np.ndarray) and chunk.flags.writeable \
+                and np.issubdtype(chunk.dtype, np.floating)
+            yield self.apply(chunk, out=chunk if in_place else None, chunk_size=chunk_size)
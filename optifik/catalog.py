@@ -0,0 +1,326 @@
+"""
+SQLite catalog of thickness results.
+
+Results are keyed by the identity of the spectrum (for instance its
+path), the method and a hash of the parameters, so that the results of
+several analyses of the same spectra can be stored side by side and
+compared without recomputing anything. Analysing again a spectrum with
+the same method and parameters replaces the previous result.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+from .results import STATUS_OK, STATUS_FAILED
+from .dispersion import RefractiveIndex
+from .reference import ReferenceSpectrum
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS parameters (
+    hash TEXT PRIMARY KEY,
+    method TEXT NOT NULL,
+    parameters TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    spectrum TEXT NOT NULL,
+    sample TEXT,
+    timestamp REAL,
+    method TEXT NOT NULL,
+    parameters TEXT NOT NULL REFERENCES parameters(hash),
+    thickness REAL,
+    thickness_uncertainty REAL,
+    interference_order INTEGER,
+    status INTEGER NOT NULL,
+    message TEXT,
+    created REAL NOT NULL,
+    PRIMARY KEY (spectrum, method, parameters)
+);
+CREATE INDEX IF NOT EXISTS results_timestamp ON results (timestamp);
+CREATE INDEX IF NOT EXISTS results_sample ON results (sample, timestamp);
+CREATE INDEX IF NOT EXISTS results_method ON results (method, timestamp);
+CREATE INDEX IF NOT EXISTS results_parameters ON results (parameters, timestamp);
+"""
+
+_COLUMNS = ('spectrum', 'sample', 'timestamp', 'method', 'parameters',
+            'thickness', 'thickness_uncertainty', 'interference_order',
+            'status', 'message', 'created')
+
+
+def _jsonable(value):
+    if isinstance(value, np.ndarray):
+        # Large arrays (refractive index, void spectrum) by their content
+        digest = hashlib.sha1(np.ascontiguousarray(value).view(np.uint8)).hexdigest()
+        return {'array_sha1': digest, 'shape': list(value.shape), 'dtype': value.dtype.str}
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, RefractiveIndex):
+        return {'model': type(value).__name__, **value.parameters}
+    if isinstance(value, ReferenceSpectrum):
+        return {'reference': {'wavelengths': value.wavelengths,
+                              'intensities': value.intensities}}
+    if callable(value):
+        # Lambdas and closures of the same name can differ
+        raise TypeError(f'Cannot identify the function {value!r}: pass its values, '
+                        f'or a model of `optifik.dispersion` for a refractive index')
+    raise TypeError(f'Cannot serialise {type(value).__name__}')
+
+
+def parameter_hash(method, parameters):
+    """
+    Return the hash identifying a method and its parameters.
+
+    Parameters
+    ----------
+    method : string
+        Name of the method.
+    parameters : dict
+        Parameters of the analysis. Arrays are identified by their
+        content and refractive index models by their parameters.
+
+    Raises
+    ------
+    TypeError
+        if a parameter cannot be identified, for instance a function.
+
+    Returns
+    -------
+    hash : string
+    """
+    return hashlib.sha1(_serialise(method, parameters).encode()).hexdigest()
+
+
+def _serialise(method, parameters):
+    return json.dumps({'method': method, 'parameters': parameters},
+                      sort_keys=True, default=_jsonable)
+
+
+class ResultCatalog:
+    """ Catalog of thickness results stored in a SQLite database.
+
+    Results are buffered and inserted by batches, each batch in one
+    transaction.
+
+    Parameters
+    ----------
+    path : string
+        Path of the database, created if needed.
+    batch_size : int, optional
+        Number of buffered results triggering an insertion.
+        The default is 10 000.
+    """
+    def __init__(self, path, batch_size=10_000):
+        self.path = path
+        self.batch_size = batch_size
+        self._connection = sqlite3.connect(path)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(_SCHEMA)
+        self._rows = []
+        self._parameters = {}
+
+    def _register(self, method, parameters):
+        key = _serialise(method, parameters)
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        self._parameters[digest] = (digest, method, key)
+        return digest
+
+    def add(self, spectrum, method, parameters, result, sample=None, timestamp=None):
+        """
+        Add the result of one spectrum.
+
+        Parameters
+        ----------
+        spectrum : string
+            Identity of the spectrum, for instance its path.
+        method : string
+            Name of the method.
+        parameters : dict
+            Parameters of the analysis, see `parameter_hash`.
+        result : Instance of `OptimizeResult` class.
+            Result of the analysis.
+        sample : string, optional
+            Name of the sample. The default is the name of the
+            directory of `spectrum`.
+        timestamp : scalar, optional
+            Acquisition time of the spectrum in seconds since the epoch.
+        """
+        digest = self._register(method, parameters)
+        thickness = float(result.thickness)
+        status = result.get('status', STATUS_OK if np.isfinite(thickness) else STATUS_FAILED)
+        if sample is None:
+            sample = os.path.basename(os.path.dirname(str(spectrum)))
+        order = result.get('interference_order', -1)
+        self._rows.append((str(spectrum), sample, timestamp, method, digest,
+                           thickness,
+                           float(result.get('thickness_uncertainty', np.nan)),
+                           int(order) if order >= 0 else None,
+                           int(status),
+                           result.get('message'),
+                           time.time()))
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def add_batch(self, spectra, method, parameters, results, samples=None, timestamps=None):
+        """
+        Add the results of several spectra analysed with the same parameters.
+
+        Parameters
+        ----------
+        spectra : list of string
+            Identities of the spectra.
+        method : string
+            Name of the method.
+        parameters : dict
+            Parameters of the analysis, see `parameter_hash`.
+        results : Instance of `optifik.results.BatchResult` class.
+            Results of the analysis, in the order of `spectra`.
+        samples : string or list of string, optional
+            Names of the samples. The default is the name of the
+            directory of each spectrum.
+        timestamps : array, optional
+            Acquisition times in seconds since the epoch.
+        """
+        if len(spectra) != len(results):
+            raise ValueError('spectra and results must have the same length.')
+        digest = self._register(method, parameters)
+        spectra = [str(spectrum) for spectrum in spectra]
+        if samples is None:
+            samples = [os.path.basename(os.path.dirname(spectrum)) for spectrum in spectra]
+        elif isinstance(samples, str):
+            samples = [samples] * len(spectra)
+        if timestamps is None:
+            timestamps = [None] * len(spectra)
+        else:
+            timestamps = np.broadcast_to(timestamps, (len(spectra),)).tolist()
+        orders = [order if order >= 0 else None
+                  for order in results.interference_order.tolist()]
+        messages = getattr(results, 'message', None)
+        if messages is None:
+            messages = [None] * len(spectra)
+        now = time.time()
+        self._rows.extend(zip(spectra, samples, timestamps,
+                              [method] * len(spectra), [digest] * len(spectra),
+                              results.thickness.tolist(),
+                              results.thickness_uncertainty.tolist(),
+                              orders, results.status.tolist(), messages,
+                              [now] * len(spectra)))
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Insert the buffered results, in one transaction.
+        """
+        if not self._rows and not self._parameters:
+            return
+        placeholders = ', '.join('?' * len(_COLUMNS))
+        with self._connection:
+            self._connection.executemany('INSERT OR IGNORE INTO parameters VALUES (?, ?, ?)',
+                                         self._parameters.values())
+            self._connection.executemany(f'INSERT OR REPLACE INTO results ({", ".join(_COLUMNS)}) '
+                                         f'VALUES ({placeholders})', self._rows)
+        self._rows = []
+        self._parameters = {}
+
+    def query(self, method=None, parameters=None, sample=None, spectrum=None,
+              time_start=None, time_stop=None):
+        """
+        Return the results matching all the given criteria.
+
+        Parameters
+        ----------
+        method : string, optional
+            Name of the method.
+        parameters : dict or string, optional
+            Parameters of the analysis, or their hash.
+            Requires `method` if a dict is given.
+        sample : string, optional
+            Name of the sample.
+        spectrum : string, optional
+            Identity of the spectrum.
+        time_start : scalar, optional
+            Minimum acquisition time (included).
+        time_stop : scalar, optional
+            Maximum acquisition time (excluded).
+
+        Returns
+        -------
+        results : dict
+            One array per column, sorted by acquisition time and spectrum.
+            Missing values are NaN, -1 for the interference order and
+            None for strings.
+        """
+        self.flush()
+        if isinstance(parameters, dict):
+            if method is None:
+                raise ValueError('method is required to hash the parameters.')
+            parameters = parameter_hash(method, parameters)
+        clauses, values = [], []
+        for column, value in (('method', method), ('parameters', parameters),
+                              ('sample', sample), ('spectrum', spectrum)):
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                values.append(str(value))
+        if time_start is not None:
+            clauses.append('timestamp >= ?')
+            values.append(time_start)
+        if time_stop is not None:
+            clauses.append('timestamp < ?')
+            values.append(time_stop)
+        where = f'WHERE {" AND ".join(clauses)}' if clauses else ''
+        rows = self._connection.execute(f'SELECT {", ".join(_COLUMNS)} FROM results {where} '
+                                        'ORDER BY timestamp, spectrum', values).fetchall()
+
+        columns = dict(zip(_COLUMNS, zip(*rows))) if rows \
+            else {column: () for column in _COLUMNS}
+        results = {}
+        for column, values in columns.items():
+            if column in ('timestamp', 'thickness', 'thickness_uncertainty', 'created'):
+                results[column] = np.array(values, dtype=float)
+            elif column == 'interference_order':
+                results[column] = np.array([-1 if value is None else value for value in values],
+                                           dtype=np.int64)
+            elif column == 'status':
+                results[column] = np.array(values, dtype=np.int8)
+            else:
+                results[column] = np.array(values, dtype=object)
+        return results
+
+    def parameter_sets(self, method=None):
+        """
+        Return the parameter sets stored in the catalog.
+
+        Parameters
+        ----------
+        method : string, optional
+            Only return the parameters of this method.
+
+        Returns
+        -------
+        parameter_sets : dict
+            Parameters (as stored, arrays being replaced by their hash)
+            for each hash.
+        """
+        self.flush()
+        rows = self._connection.execute('SELECT hash, parameters FROM parameters'
+                                        + (' WHERE method = ?' if method else ''),
+                                        (method,) if method else ()).fetchall()
+        return {digest: json.loads(content)['parameters'] for digest, content in rows}
+
+    def close(self):
+        """
+        Insert the buffered results and close the database.
+        """
+        self.flush()
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
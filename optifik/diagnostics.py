@@ -0,0 +1,439 @@
+"""
+Diagnostic plots of batches, rendered without display.
+
+Plots are rendered by a pool of processes with the Agg backend. Each
+worker configures matplotlib once and reuses a single figure, whose
+artists are updated for each spectrum, instead of creating new figures
+as the `plot=True` option of the methods does.
+"""
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .batch import _analyse, _memmap_spec, _open_spec, _chunks, _default_shared_dir
+from .reference import ReferenceSpectrum
+from .results import STATUS_OK
+from .scheludko import _Delta
+from .utils import PLOT_STYLE, round_to_uncertainty
+
+
+def select_spectra(num_spectra, max_plots=None, priority=None):
+    """
+    Return the indices of the spectra to plot in a run.
+
+    Parameters
+    ----------
+    num_spectra : int
+        Number of spectra of the run.
+    max_plots : int, optional
+        Maximum number of spectra. If `None`, all spectra are selected.
+    priority : array of bool, optional
+        Spectra selected first, for instance the failed ones.
+
+    Returns
+    -------
+    indices : array
+        Sorted indices. Spectra are evenly spaced over the run, among
+        the priority spectra first, then among the others.
+    """
+    if max_plots is None or max_plots >= num_spectra:
+        return np.arange(num_spectra)
+
+    def decimate(candidates, count):
+        if count >= len(candidates):
+            return candidates
+        return candidates[np.linspace(0, len(candidates) - 1, count).round().astype(int)]
+
+    if priority is None:
+        return decimate(np.arange(num_spectra), max_plots)
+    priority = np.asarray(priority, dtype=bool)
+    first = decimate(np.flatnonzero(priority), max_plots)
+    others = decimate(np.flatnonzero(~priority), max_plots - len(first))
+    return np.sort(np.concatenate([first, others]))
+
+
+class DiagnosticFigure:
+    """ Figure showing the analysis of one spectrum.
+
+    The figure and its artists are created once, then updated for each
+    spectrum by `draw`. The figure is not attached to pyplot. For the
+    'scheludko' method, a third axes shows the thicknesses of the tested
+    orders when the order was scanned.
+
+    Parameters
+    ----------
+    method : string
+        Either 'fft', 'minmax' or 'scheludko'.
+    dpi : scalar, optional
+        Resolution of the saved images.
+    figsize : tuple, optional
+        Size of the figure in inches.
+    axes : tuple of `matplotlib.axes.Axes`, optional
+        Axes of the spectrum, of the method and optionally of the order
+        scan, in an existing figure. By default, a new figure is created
+        with an Agg canvas.
+    """
+    def __init__(self, method, dpi=100, figsize=(10, 10), axes=None):
+        self.method = method.lower()
+        if axes is None:
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+            self.figure = Figure(figsize=figsize, dpi=dpi)
+            FigureCanvasAgg(self.figure)
+            axes = self.figure.subplots(nrows=3 if self.method == 'scheludko' else 2)
+            new_figure = True
+        else:
+            self.figure = axes[0].figure
+            new_figure = False
+        self.ax_spectrum, self.ax_method = axes[:2]
+        self.ax_order = axes[2] if len(axes) > 2 else None
+        self.order_lines = []
+
+        ax = self.ax_spectrum
+        self.spectrum_line, = ax.plot([], [], 'o-', markersize=2, label='Data')
+        self.extrema_line, = ax.plot([], [], 'ro', label='Extrema')
+        ax.set_xlabel(r'$\lambda$ $[\mathrm{nm}]$')
+        ax.set_ylabel(r'$I^\star$')
+        ax.legend()
+
+        ax = self.ax_method
+        if self.method == 'fft':
+            ax.set_xscale('log')
+            ax.set_yscale('log')
+            self.lines = [ax.plot([], [], label='FFT')[0],
+                          ax.plot([], [], label='FFT with zero-padding')[0],
+                          ax.plot([], [], 'o', label='Peak')[0]]
+            ax.set_xlabel(r'$\mathrm{Optical \ Distance}\ \mathcal{D}$ $[\mathrm{nm}]$')
+            ax.set_ylabel(r'$\mathrm{FFT}$ $(I^\star)$')
+        elif self.method == 'minmax':
+            self.lines = [ax.plot([], [], 'xb', alpha=0.6, label='Inliers')[0],
+                          ax.plot([], [], '+r', alpha=0.6, label='Outliers')[0],
+                          ax.plot([], [], '-g', label='Fit')[0]]
+            ax.set_xlabel(r'$\mathrm{Index}$ $N$')
+            ax.set_ylabel(r'$n$($\lambda$) / $\lambda$ $[\mathrm{\mu m^{-1}}]$')
+        elif self.method == 'scheludko':
+            self.lines = [ax.plot([], [], 'bo-', markersize=2, label='Data')[0],
+                          ax.plot([], [], 'ro-', markersize=2, label='Fit')[0]]
+            ax.set_xlabel(r'$\lambda$ $[\mathrm{nm}]$')
+            ax.set_ylabel(r'$\Delta$')
+            if self.ax_order is not None:
+                self.ax_order.set_xlabel(r'$\lambda$ $[\mathrm{nm}]$')
+                self.ax_order.set_ylabel(r'$h$ $[\mathrm{nm}]$')
+        else:
+            raise ValueError(f'Unknown method: {method}')
+        ax.legend()
+        if new_figure:
+            # Room for the titles set by `draw`
+            self.ax_spectrum.set_title(' ')
+            self.figure.tight_layout()
+
+    @property
+    def artists(self):
+        """Artists updated by `draw`."""
+        return [self.spectrum_line, self.extrema_line, *self.lines, *self.order_lines,
+                self.ax_spectrum.title]
+
+    def draw(self, index, wavelengths, intensities, result, plot_data, autoscale=True):
+        """
+        Update the figure with the analysis of a spectrum.
+
+        Parameters
+        ----------
+        index : int
+            Index of the spectrum, shown in the title.
+        wavelengths : array
+            Wavelength values in nm.
+        intensities : array
+            Intensity values.
+        result : Instance of `OptimizeResult` class.
+            Result of the analysis.
+        plot_data : dict or None
+            Data returned by the core function of the method,
+            partial or None if the analysis failed.
+        autoscale : bool, optional
+            Adapt the limits of the axes to the new data.
+        """
+        empty = np.empty(0)
+        self.spectrum_line.set_data(wavelengths, intensities)
+        peaks = np.concatenate([result.get('peaks_min', empty),
+                                result.get('peaks_max', empty)]).astype(int)
+        if plot_data is not None and 'extrema' in plot_data:
+            _, _, peaks_min, peaks_max = plot_data['extrema']
+            peaks = np.concatenate([peaks_min, peaks_max]).astype(int)
+        self.extrema_line.set_data(wavelengths[peaks], intensities[peaks])
+
+        for line in self.lines + self.order_lines:
+            line.set_data(empty, empty)
+        if plot_data:
+            getattr(self, f'_draw_{self.method}')(**plot_data)
+
+        if result.get('status', STATUS_OK) == STATUS_OK:
+            val, err = round_to_uncertainty(result.thickness,
+                                            result.get('thickness_uncertainty', 0))
+            title = rf'Spectrum {index}: $h = {val} \pm {err}\ \mathrm{{nm}}$'
+        else:
+            title = f'Spectrum {index}: {result.get("message", "failed")}'
+        self.ax_spectrum.set_title(title)
+
+        if autoscale:
+            for ax in (self.ax_spectrum, self.ax_method, self.ax_order):
+                if ax is None:
+                    continue
+                ax.relim()
+                ax.autoscale_view()
+
+    def _draw_fft(self, positive_freqs, positive_fft, peak_index,
+                  optical_thickness, thickness, error,
+                  positive_freqs_padding=None,
+                  positive_fft_padding=None,
+                  peak_index_padding=None, extrema=None):
+        self.lines[0].set_data(positive_freqs, positive_fft)
+        if positive_freqs_padding is not None:
+            self.lines[1].set_data(positive_freqs_padding, positive_fft_padding)
+            peak = positive_fft_padding[peak_index_padding]
+        else:
+            peak = positive_fft[peak_index]
+        self.lines[2].set_data([optical_thickness], [peak])
+
+    def _draw_minmax(self, method=None, k_values=None, n_over_lambda=None,
+                     thickness=None, thickness_err=None,
+                     inliers=None, model=None, slope=None, intercept=None,
+                     extrema=None):
+        if k_values is None:
+            # No fit, the extrema only
+            return
+        if inliers is not None:
+            self.lines[0].set_data(k_values[inliers], n_over_lambda[inliers] * 1000)
+            self.lines[1].set_data(k_values[~inliers], n_over_lambda[~inliers] * 1000)
+        else:
+            self.lines[0].set_data(k_values, n_over_lambda * 1000)
+        if model is not None:
+            fit = model.predict(k_values.reshape(-1, 1))
+        else:
+            # Line of the regression, or of the RANSAC estimator
+            fit = intercept + k_values * slope
+        self.lines[2].set_data(k_values, fit * 1000)
+
+    def _draw_scheludko(self, wavelengths_masked=None, r_index_masked=None,
+                        Delta_from_data=None, interference_order=None,
+                        fitted_h=None, std_err=None,
+                        extrema=None, order_scan=None):
+        if wavelengths_masked is None:
+            return
+        self.lines[0].set_data(wavelengths_masked, Delta_from_data)
+        if fitted_h is not None:
+            self.lines[1].set_data(wavelengths_masked,
+                                   _Delta(wavelengths_masked, fitted_h,
+                                          interference_order, r_index_masked))
+        if order_scan is None or self.ax_order is None:
+            return
+        # One line per tested order, created on first use
+        while len(self.order_lines) < len(order_scan):
+            self.order_lines.append(self.ax_order.plot([], [], 'o-', markersize=2)[0])
+        for line, (order, h_values, difference) in zip(self.order_lines, order_scan):
+            line.set_data(wavelengths_masked, h_values)
+            line.set_label(f'Order={order}, $h$-variation={difference:.1f} nm')
+        self.ax_order.legend(handles=self.order_lines[:len(order_scan)], fontsize='small')
+
+
+def render_captured(diagnostics, output_dir, file_format='png', dpi=100):
+    """
+    Write the plots of captured diagnostics, in the current process.
+
+    Parameters
+    ----------
+    diagnostics : dict or list
+        Instances of `optifik.results.Diagnostics`, for instance the
+        attribute `diagnostics` of a `optifik.results.BatchResult`.
+    output_dir : string
+        Directory of the plots, created if needed.
+    file_format : string, optional
+        Format of the images, one file per spectrum.
+    dpi : scalar, optional
+        Resolution of the images.
+
+    Returns
+    -------
+    paths : list of string
+        Paths of the written files.
+    """
+    if isinstance(diagnostics, dict):
+        diagnostics = [diagnostics[index] for index in sorted(diagnostics)]
+    os.makedirs(output_dir, exist_ok=True)
+    figures = {}
+    paths = []
+    for number, captured in enumerate(diagnostics):
+        # One figure per method, reused
+        if captured.method not in figures:
+            figures[captured.method] = DiagnosticFigure(captured.method, dpi=dpi)
+        index = number if captured.index is None else captured.index
+        path = os.path.join(output_dir, f'spectrum_{index:06d}.{file_format}')
+        captured.render(path, figure=figures[captured.method])
+        paths.append(path)
+    return paths
+
+
+#
+# Rendering in worker processes
+#
+
+# State of each worker process, filled by `_init_render_worker`
+_WORKER = {}
+
+
+def _init_render_worker(specs, method, kwargs, dpi):
+    import matplotlib
+    matplotlib.use('Agg')
+    # Mathtext instead of LaTeX: much faster for many figures
+    matplotlib.rcParams.update(PLOT_STYLE)
+    matplotlib.rcParams['text.usetex'] = False
+
+    _WORKER.clear()
+    for key, spec in specs.items():
+        _WORKER[key] = _open_spec(spec, 'r')
+    _WORKER['method'] = method
+    _WORKER['kwargs'] = kwargs
+    _WORKER['figure'] = DiagnosticFigure(method, dpi=dpi)
+
+
+def _render_task(output_dir, file_format, page, start, stop):
+    """
+    Render the selected spectra `start:stop` in a worker.
+    """
+    kwargs = dict(_WORKER['kwargs'])
+    if 'refractive_index' in _WORKER:
+        refractive_index = _WORKER['refractive_index']
+    else:
+        refractive_index = kwargs.pop('refractive_index')
+    if 'intensities_void' in _WORKER:
+        kwargs['intensities_void'] = _WORKER['intensities_void']
+    wavelengths = _WORKER['wavelengths']
+    figure = _WORKER['figure']
+
+    def render():
+        for position in range(start, stop):
+            index = int(_WORKER['indices'][position])
+            intensities = np.asarray(_WORKER['intensities'][position])
+            result, plot_data = _analyse(_WORKER['method'], wavelengths, intensities,
+                                         refractive_index, errors='coerce', **kwargs)
+            figure.draw(index, wavelengths, intensities, result, plot_data)
+            yield index
+
+    if file_format == 'pdf':
+        # One multi-page file per page of spectra
+        from matplotlib.backends.backend_pdf import PdfPages
+
+        path = os.path.join(output_dir, f'diagnostics_{page:04d}.pdf')
+        with PdfPages(path) as pdf:
+            for _ in render():
+                pdf.savefig(figure.figure)
+        return [path]
+
+    paths = []
+    for index in render():
+        path = os.path.join(output_dir, f'spectrum_{index:06d}.{file_format}')
+        figure.figure.savefig(path)
+        paths.append(path)
+    return paths
+
+
+def render_diagnostics(method, wavelengths, intensities, refractive_index, /,
+                       output_dir, indices=None, max_plots=100, results=None,
+                       file_format='png', page_size=50, dpi=100,
+                       max_workers=None, mp_context=None, shared_dir=None,
+                       **kwargs):
+    """
+    Write the diagnostic plots of selected spectra of a stack.
+
+    Parameters
+    ----------
+    method : string
+        Either 'fft', 'minmax' or 'scheludko'.
+    wavelengths : array
+        Wavelength values in nm, shared by all spectra.
+    intensities : 2D array
+        Intensity values, one spectrum per row.
+    refractive_index : scalar, array or `optifik.dispersion.RefractiveIndex`
+        Value of the refractive index of the medium, or its model.
+    output_dir : string
+        Directory of the plots, created if needed.
+    indices : array, optional
+        Indices of the spectra to plot. By default, at most `max_plots`
+        spectra are selected with `select_spectra`.
+    max_plots : int, optional
+        Maximum number of plots when `indices` is not given.
+        If `None`, all spectra are plotted.
+    results : Instance of `optifik.results.BatchResult` class, optional
+        Results of the stack. If given, failed spectra are selected first.
+    file_format : string, optional
+        'png' (default) for one image per spectrum, or 'pdf' for one
+        page per spectrum in files of `page_size` pages.
+    page_size : int, optional
+        Number of spectra rendered by each task, and pages per PDF file.
+    dpi : scalar, optional
+        Resolution of the images.
+    max_workers : int, optional
+        Number of processes. If `None`, use the number of CPUs.
+    mp_context : multiprocessing context, optional
+        Context used to start the processes.
+    shared_dir : string, optional
+        Directory for the temporary memory-mapped files,
+        see `optifik.batch.thickness_batch_shared`.
+    **kwargs :
+        Extra parameters passed to the method, see
+        `optifik.batch.analyse_spectrum`.
+
+    Returns
+    -------
+    paths : list of string
+        Paths of the written files, in the order of the spectra.
+    """
+    intensities = np.asanyarray(intensities)
+    if intensities.ndim != 2:
+        raise ValueError('intensities must be a 2D array.')
+    if file_format not in ('png', 'pdf', 'svg', 'jpg'):
+        raise ValueError(f'Unsupported format: {file_format}')
+    if indices is None:
+        priority = None if results is None else results.status != STATUS_OK
+        indices = select_spectra(len(intensities), max_plots, priority)
+    indices = np.asarray(indices, dtype=np.int64)
+    os.makedirs(output_dir, exist_ok=True)
+    if len(indices) == 0:
+        return []
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if shared_dir is None:
+        shared_dir = _default_shared_dir()
+
+    tmp_dir = tempfile.mkdtemp(prefix='optifik-', dir=shared_dir)
+    try:
+        # Only the selected spectra are shared with the workers
+        arrays = {'wavelengths': np.ascontiguousarray(wavelengths, dtype=float),
+                  'intensities': np.ascontiguousarray(intensities[indices]),
+                  'indices': indices}
+        if np.ndim(refractive_index) > 0:
+            arrays['refractive_index'] = np.ascontiguousarray(refractive_index, dtype=float)
+        else:
+            kwargs['refractive_index'] = refractive_index
+        if kwargs.get('intensities_void') is not None and \
+                not isinstance(kwargs['intensities_void'], ReferenceSpectrum):
+            # A reference spectrum is sent with the parameters
+            arrays['intensities_void'] = np.ascontiguousarray(kwargs.pop('intensities_void'),
+                                                              dtype=float)
+        specs = {key: _memmap_spec(array, tmp_dir, key)
+                 for key, array in arrays.items()}
+
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 mp_context=mp_context,
+                                 initializer=_init_render_worker,
+                                 initargs=(specs, method, kwargs, dpi)) as executor:
+            futures = [executor.submit(_render_task, os.fspath(output_dir), file_format,
+                                       page, start, stop)
+                       for page, (start, stop) in enumerate(_chunks(len(indices), page_size))]
+            return [path for future in futures for path in future.result()]
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
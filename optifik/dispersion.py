@@ -0,0 +1,271 @@
+"""
+Models of the refractive index as a function of the wavelength.
+
+A model is evaluated once per wavelength grid: the refractive index and
+the quantities derived from it, used by the methods, are memoised for
+the last grids seen, so that analysing many spectra sharing the same
+wavelengths costs no dispersion computation after the first one.
+
+Models can be given as `refractive_index` to all the methods and to
+the batch functions.
+"""
+import abc
+
+import numpy as np
+
+from .utils import _GridCache
+
+
+class RefractiveIndex(abc.ABC):
+    """ Base class of the refractive index models.
+
+    Subclasses implement `parameters` and `evaluate`, otherwise they
+    cannot be instantiated. Instances are callable: they return
+    the memoised refractive index on the given wavelengths.
+    Memoised arrays are read-only.
+
+    Attributes
+    ----------
+    max_grids : int
+        Number of wavelength grids memoised.
+    """
+    max_grids = 8
+
+    def __init__(self):
+        self._cache = _GridCache(self.max_grids)
+
+    @property
+    @abc.abstractmethod
+    def parameters(self):
+        """Parameters of the model, as a dict."""
+
+    def __repr__(self):
+        parameters = ', '.join(f'{key}={value!r}' for key, value in self.parameters.items())
+        return f'{self.__class__.__name__}({parameters})'
+
+    @abc.abstractmethod
+    def evaluate(self, wavelengths):
+        """
+        Compute the refractive index, without memoisation.
+
+        Parameters
+        ----------
+        wavelengths : array
+            Wavelength values in nm.
+
+        Returns
+        -------
+        refractive_index : array
+        """
+
+    def __call__(self, wavelengths):
+        return self._cache.get(wavelengths, 'n', lambda grid: np.array(
+            np.broadcast_to(self.evaluate(grid), grid.shape), dtype=float))
+
+    def n_over_lambda(self, wavelengths):
+        """
+        Return the refractive index divided by the wavelengths, in 1/nm.
+
+        Parameters
+        ----------
+        wavelengths : array
+            Wavelength values in nm.
+
+        Returns
+        -------
+        n_over_lambda : array
+        """
+        return self._cache.get(wavelengths, 'n_over_lambda', lambda grid: self(grid) / grid)
+
+    def alpha(self, wavelengths):
+        """
+        Return the factor :math:`(n^2-1)^2 / 4n^2` of the Scheludko method.
+
+        Parameters
+        ----------
+        wavelengths : array
+            Wavelength values in nm.
+
+        Returns
+        -------
+        alpha : array
+        """
+        return self._cache.get(wavelengths, 'alpha', lambda grid: _alpha(self(grid)))
+
+    def clear_cache(self):
+        """
+        Forget the memoised grids.
+        """
+        self._cache.clear()
+
+
+def _alpha(refractive_index):
+    """
+    Return :math:`(n^2-1)^2 / 4n^2`.
+    """
+    n = np.asarray(refractive_index)
+    return (n**2 - 1)**2 / (4 * n**2)
+
+
+class ConstantIndex(RefractiveIndex):
+    """ Refractive index independent of the wavelength.
+
+    Parameters
+    ----------
+    value : scalar
+        Value of the refractive index.
+    """
+    def __init__(self, value):
+        super().__init__()
+        self.value = float(value)
+
+    @property
+    def parameters(self):
+        return {'value': self.value}
+
+    def evaluate(self, wavelengths):
+        return np.full(np.shape(wavelengths), self.value)
+
+
+class CauchyIndex(RefractiveIndex):
+    """ Cauchy's law of dispersion.
+
+    .. math::
+
+        n(\\lambda) = A + \\frac{B}{\\lambda^2} + \\frac{C}{\\lambda^4}
+
+    with :math:`\\lambda` in nm.
+
+    Parameters
+    ----------
+    A : scalar
+        Constant term.
+    B : scalar, optional
+        Coefficient of the second order, in nm².
+    C : scalar, optional
+        Coefficient of the fourth order, in nm⁴.
+
+    Examples
+    --------
+    Water:
+
+    >>> water = CauchyIndex(1.324188, 3102.060378)
+    """
+    def __init__(self, A, B=0., C=0.):
+        super().__init__()
+        self.A = float(A)
+        self.B = float(B)
+        self.C = float(C)
+
+    @property
+    def parameters(self):
+        return {'A': self.A, 'B': self.B, 'C': self.C}
+
+    def evaluate(self, wavelengths):
+        wavelengths = np.asarray(wavelengths, dtype=float)
+        n = self.A + self.B / wavelengths**2
+        if self.C:
+            n = n + self.C / wavelengths**4
+        return n
+
+
+class SellmeierIndex(RefractiveIndex):
+    """ Sellmeier's law of dispersion.
+
+    .. math::
+
+        n^2(\\lambda) = 1 + \\sum_i \\frac{B_i \\lambda^2}{\\lambda^2 - C_i}
+
+    with :math:`\\lambda` in µm, as in the usual tables of coefficients.
+    Wavelengths are still given in nm to the methods.
+
+    Parameters
+    ----------
+    B : sequence of scalars
+        Dimensionless coefficients.
+    C : sequence of scalars
+        Coefficients in µm², as many as `B`.
+    """
+    def __init__(self, B, C):
+        super().__init__()
+        self.B = tuple(float(value) for value in B)
+        self.C = tuple(float(value) for value in C)
+        if len(self.B) != len(self.C):
+            raise ValueError('B and C must have the same length.')
+
+    @property
+    def parameters(self):
+        return {'B': self.B, 'C': self.C}
+
+    def evaluate(self, wavelengths):
+        squared = (np.asarray(wavelengths, dtype=float) / 1000)**2
+        n_squared = np.ones_like(squared)
+        for B, C in zip(self.B, self.C):
+            n_squared += B * squared / (squared - C)
+        return np.sqrt(n_squared)
+
+
+class TabulatedIndex(RefractiveIndex):
+    """ Refractive index interpolated linearly from tabulated values.
+
+    Parameters
+    ----------
+    wavelengths : array
+        Wavelength values of the table in nm.
+    values : array
+        Refractive index at these wavelengths.
+
+    Raises
+    ------
+    ValueError
+        When evaluated on wavelengths outside of the table.
+    """
+    def __init__(self, wavelengths, values):
+        super().__init__()
+        wavelengths = np.asarray(wavelengths, dtype=float)
+        values = np.asarray(values, dtype=float)
+        if wavelengths.ndim != 1 or wavelengths.shape != values.shape or len(wavelengths) < 2:
+            raise ValueError('wavelengths and values must be 1D arrays '
+                             'of the same length, with at least two values.')
+        order = np.argsort(wavelengths)
+        self.wavelengths = wavelengths[order]
+        self.values = values[order]
+
+    @classmethod
+    def from_file(cls, path, delimiter=','):
+        """
+        Load a table from a file.
+
+        Format: the first column is the wavelength in nm.
+        The second column is the refractive index.
+        By default, the delimiter is a comma.
+
+        Parameters
+        ----------
+        path : string
+            File path.
+        delimiter : string, optional
+            Delimiter between columns in the datafile.
+
+        Returns
+        -------
+        model : Instance of `TabulatedIndex` class.
+        """
+        data = np.loadtxt(path, delimiter=delimiter, ndmin=2)
+        return cls(data[:, 0], data[:, 1])
+
+    @property
+    def parameters(self):
+        return {'wavelengths': self.wavelengths, 'values': self.values}
+
+    def __repr__(self):
+        return (f'{self.__class__.__name__}({len(self.wavelengths)} values, '
+                f'{self.wavelengths[0]:g}-{self.wavelengths[-1]:g} nm)')
+
+    def evaluate(self, wavelengths):
+        wavelengths = np.asarray(wavelengths, dtype=float)
+        if wavelengths.size and (wavelengths.min() < self.wavelengths[0]
+                                 or wavelengths.max() > self.wavelengths[-1]):
+            raise ValueError(f'Wavelengths outside of the table '
+                             f'({self.wavelengths[0]:g}-{self.wavelengths[-1]:g} nm).')
+        return np.interp(wavelengths, self.wavelengths, self.values)
@@ -2,52 +2,44 @@ import numpy as np
 from scipy.interpolate import interp1d
 from scipy.fftpack import fft, fftfreq
 
-import inspect
-import matplotlib.pyplot as plt
-
-from .utils import OptimizeResult, setup_matplotlib, round_to_uncertainty
-
-def thickness_from_fft(wavelengths, intensities,
-                       refractive_index,
-                       N_padding=1,
-                       num_half_space=None,
-                       plot=None):
+from .utils import OptimizeResult, setup_matplotlib, round_to_uncertainty, stage_timer
+from .metrics import instrumented, handle_failure
+from .dispersion import RefractiveIndex
+from .results import STATUS_OK
+
+
+@instrumented('fft')
+def _fft_core(wavelengths, intensities,
+              refractive_index,
+              N_padding=1,
+              num_half_space=None,
+              timings=False,
+              errors='raise'):
     """
-    Determine the tickness by Fast Fourier Transform.
+    Compute the thickness by FFT, without any side effect.
 
-    Parameters
-    ----------
-    wavelengths : array
-        Wavelength values in nm.
-    intensities : array
-        Intensity values.
-    refractive_index : scalar or array
-        Value of the refractive index of the medium.
-    N_padding : int, optional
-        Multiply the space by `N_padding` with zero-padding.
-        This can be used to refine the peak detection.
-        Default: 1.
-    num_half_space : scalar, optional
-        Number of points to compute FFT's half space.
-        If `None`, default corresponds to `10*len(wavelengths)`.
-    plot : boolean, optional
-        Show plot of the transformed signal and the peak detection.
+    See `thickness_from_fft` for the parameters.
 
     Returns
     -------
     results : Instance of `OptimizeResult` class.
-        The attribute `thickness` gives the thickness value in nm.
-
-    Notes
-    -----
-    if `N_padding` > 1, the peak is first detected without zero-padding,
-    ie `N_padding` = 1. Then, padding is applied and the detection
-    is done nearby the first peak detection.
+    plot_data : dict or None
+        Intermediate arrays required by `_plot_fft`, None if the
+        analysis failed with `errors='coerce'`.
     """
+    timer = stage_timer(timings)
+
+    if len(wavelengths) < 2 or not np.all(np.isfinite(intensities)):
+        return handle_failure(ValueError('The FFT requires at least two intensities, all finite.'),
+                              'invalid_input', errors)
+
     if num_half_space is None:
         num_half_space = 10 * len(wavelengths)
 
-    x = refractive_index / wavelengths
+    if isinstance(refractive_index, RefractiveIndex):
+        x = refractive_index.n_over_lambda(wavelengths)
+    else:
+        x = refractive_index / wavelengths
     y = intensities
 
     # Resample the data
@@ -55,6 +47,7 @@ def thickness_from_fft(wavelengths, intensities,
     x_uniform = np.linspace(x.min(), x.max(), 2 * num_half_space)
     density = x_uniform[1] - x_uniform[0]
     y_uniform = f(x_uniform)
+    timer.lap('interpolation')
 
     # FFT
     # First step, no padding
@@ -71,8 +64,11 @@ def thickness_from_fft(wavelengths, intensities,
 
     thickness = optical_thickness / 2.
     error = np.diff(positive_freqs)[0]
+    timer.lap('fft')
 
-
+    plot_data = dict(positive_freqs=positive_freqs,
+                     positive_fft=positive_fft,
+                     peak_index=peak_index)
 
     if N_padding > 1:
         fft_values = fft(y_uniform, n=N_padding*len(x_uniform))
@@ -89,39 +85,122 @@ def thickness_from_fft(wavelengths, intensities,
 
         thickness = optical_thickness / 2.
         error = np.diff(positive_freqs_padding)[0]
+        timer.lap('padded_fft')
+
+        plot_data.update(positive_freqs_padding=positive_freqs_padding,
+                         positive_fft_padding=positive_fft_padding,
+                         peak_index_padding=peak_index_padding)
+
+    plot_data.update(optical_thickness=optical_thickness,
+                     thickness=thickness,
+                     error=error)
+
+    result = OptimizeResult(thickness=thickness,
+                            thickness_uncertainty=error)
+    if timings:
+        result.timings = timer.results()
+    return result, plot_data
+
+
+def _plot_fft(positive_freqs, positive_fft, peak_index,
+              optical_thickness, thickness, error,
+              positive_freqs_padding=None,
+              positive_fft_padding=None,
+              peak_index_padding=None):
+    """
+    Plot the transformed signal and the peak detection of `thickness_from_fft`.
+    """
+    import matplotlib.pyplot as plt
+
+    setup_matplotlib()
+    if positive_freqs_padding is not None:
+        fig, ax = plt.subplots(nrows=2)
+        ax[0].set_title('Func Call: thickness_from_fft()')
+        ax[0].loglog(positive_freqs, positive_fft,
+                     label='FFT from original signal')
+        ax[0].loglog(optical_thickness, positive_fft[peak_index], 'o')
+
+        val, err = round_to_uncertainty(thickness, error)
+        label = rf'$h = {val} \pm {err}\ \mathrm{{nm}}$'
+        ax[1].loglog(positive_freqs_padding, positive_fft_padding,
+                     label='FFT from signal with zero-padding')
+        ax[1].loglog(optical_thickness, positive_fft_padding[peak_index_padding],
+                     'o', label=label)
+        plt.legend()
+        plt.tight_layout()
+
+        for a in ax:
+            a.set_ylabel(r'$\mathrm{{FFT}}$ $(I^\star)$')
+        ax[1].set_xlabel(r'$\mathrm{{Optical \ Distance}} \ \mathcal{D}$ $[\mathrm{{nm}}]$')
+    else:
+        plt.figure()
+        plt.loglog(positive_freqs, positive_fft)
+
+        val, err = round_to_uncertainty(thickness, error)
+        label = rf'$h = {val} \pm {err}\ \mathrm{{nm}}$'
+        plt.loglog(optical_thickness, positive_fft[peak_index], 'o', label=label)
+        plt.xlabel(r'$\mathrm{{Optical \ Distance}} \ \mathcal{D}$ $[\mathrm{{nm}}]$')
+        plt.ylabel(r'$\mathrm{{FFT}}$ $(I^\star)$')
+        plt.title('Func Call: thickness_from_fft()')
+        plt.legend()
+
+
+def thickness_from_fft(wavelengths, intensities,
+                       refractive_index,
+                       N_padding=1,
+                       num_half_space=None,
+                       plot=None,
+                       timings=False,
+                       errors='raise'):
+    """
+    Determine the tickness by Fast Fourier Transform.
 
-    if plot:
-        setup_matplotlib()
-        if N_padding > 1:
-            fig, ax = plt.subplots(nrows=2)
-            ax[0].set_title(f'Func Call: {inspect.currentframe().f_code.co_name}()')
-            ax[0].loglog(positive_freqs, positive_fft,
-                         label='FFT from original signal')
-            ax[0].loglog(optical_thickness, positive_fft[peak_index], 'o')
-
-            val, err = round_to_uncertainty(thickness, error)
-            label = rf'$h = {val} \pm {err}\ \mathrm{{nm}}$'
-            ax[1].loglog(positive_freqs_padding, positive_fft_padding,
-                         label='FFT from signal with zero-padding')
-            ax[1].loglog(optical_thickness, positive_fft_padding[peak_index_padding],
-                         'o', label=label)
-            plt.legend()
-            plt.tight_layout()
-
-            for a in ax:
-                a.set_ylabel(r'$\mathrm{{FFT}}$ $(I^\star)$')
-            ax[1].set_xlabel(r'$\mathrm{{Optical \ Distance}} \ \mathcal{D}$ $[\mathrm{{nm}}]$')
-        else:
-            plt.figure()
-            plt.loglog(positive_freqs, positive_fft)
-
-            val, err = round_to_uncertainty(thickness, error)
-            label = rf'$h = {val} \pm {err}\ \mathrm{{nm}}$'
-            plt.loglog(optical_thickness, positive_fft[peak_index], 'o', label=label)
-            plt.xlabel(r'$\mathrm{{Optical \ Distance}} \ \mathcal{D}$ $[\mathrm{{nm}}]$')
-            plt.ylabel(r'$\mathrm{{FFT}}$ $(I^\star)$')
-            plt.title(f'Func Call: {inspect.currentframe().f_code.co_name}()')
-            plt.legend()
-
-    return OptimizeResult(thickness=thickness,
-                          thickness_uncertainty=error)
+    Parameters
+    ----------
+    wavelengths : array
+        Wavelength values in nm.
+    intensities : array
+        Intensity values.
+    refractive_index : scalar, array or `optifik.dispersion.RefractiveIndex`
+        Value of the refractive index of the medium, or its model.
+    N_padding : int, optional
+        Multiply the space by `N_padding` with zero-padding.
+        This can be used to refine the peak detection.
+        Default: 1.
+    num_half_space : scalar, optional
+        Number of points to compute FFT's half space.
+        If `None`, default corresponds to `10*len(wavelengths)`.
+    plot : boolean, optional
+        Show plot of the transformed signal and the peak detection.
+    timings : boolean, optional
+        Record the duration and the allocations of the stages
+        'interpolation', 'fft' and 'padded_fft' in the attribute
+        `timings` of the results, see `StageTimer.results`.
+    errors : string, optional
+        With 'raise' (default), a wrong input raises an exception.
+        With 'coerce', failures are only reported in the results.
+
+    Returns
+    -------
+    results : Instance of `OptimizeResult` class.
+        The attribute `thickness` gives the thickness value in nm.
+        If the analysis failed, the thickness is NaN and the attributes
+        `status` and `message` describe the failure
+        (see `optifik.results`).
+
+    Notes
+    -----
+    if `N_padding` > 1, the peak is first detected without zero-padding,
+    ie `N_padding` = 1. Then, padding is applied and the detection
+    is done nearby the first peak detection.
+    """
+    result, plot_data = _fft_core(wavelengths, intensities,
+                                  refractive_index,
+                                  N_padding=N_padding,
+                                  num_half_space=num_half_space,
+                                  timings=timings,
+                                  errors=errors)
+    if plot and result.get('status', STATUS_OK) == STATUS_OK:
+        _plot_fft(**plot_data)
+
+    return result
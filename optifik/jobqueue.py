@@ -0,0 +1,430 @@
+"""
+Work queue over a shared filesystem.
+
+A job directory contains the description of the job (`job.json`)
+and one file per chunk of spectra, which moves between the following
+subdirectories::
+
+    todo/       chunks waiting for a worker
+    running/    chunks claimed by a worker (suffixed by the worker id)
+    done/       processed chunks
+    results/    one CSV file per processed chunk
+
+Chunks are claimed with atomic renames, so that any number of workers,
+on one or several hosts sharing the directory (e.g. NFS), can process
+the same job without any other coordination.
+A worker refreshes the modification time of its claimed chunk after each
+spectrum. A chunk whose modification time is older than a timeout is
+considered to belong to a crashed worker and is put back in `todo/`.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import socket
+import time
+
+import numpy as np
+
+from .utils import OptimizeResult
+from .results import STATUS_OK, STATUS_FAILED
+from .batch import analyse_file
+from .metrics import REGISTRY
+from .dispersion import ConstantIndex, CauchyIndex, SellmeierIndex, TabulatedIndex
+from .reference import ReferenceSpectrum
+
+
+JOB_FILE = 'job.json'
+TODO = 'todo'
+RUNNING = 'running'
+DONE = 'done'
+RESULTS = 'results'
+
+_FIELDS = ('path', 'thickness', 'thickness_uncertainty',
+           'interference_order', 'status', 'message')
+
+# Models of the refractive index that can be sent to the workers
+_MODELS = {model.__name__: model
+           for model in (ConstantIndex, CauchyIndex, SellmeierIndex, TabulatedIndex)}
+
+
+def _encode(value):
+    """
+    Return a JSON representation of the arrays, models and references,
+    decoded by `_decode`.
+    """
+    if isinstance(value, np.ndarray):
+        return {'__array__': value.tolist(), 'dtype': value.dtype.str}
+    if isinstance(value, np.generic):
+        return value.item()
+    if type(value) in _MODELS.values():
+        return {'__model__': type(value).__name__, 'parameters': value.parameters}
+    if isinstance(value, ReferenceSpectrum):
+        return {'__reference__': {'wavelengths': value.wavelengths,
+                                  'intensities': value.intensities}}
+    raise TypeError(f'Cannot send {type(value).__name__} to the workers: '
+                    f'pass its values, or a model of `optifik.dispersion`')
+
+
+def _decode(obj):
+    if '__array__' in obj:
+        return np.array(obj['__array__'], dtype=obj['dtype'])
+    if '__model__' in obj:
+        return _MODELS[obj['__model__']](**obj['parameters'])
+    if '__reference__' in obj:
+        return ReferenceSpectrum(**obj['__reference__'])
+    return obj
+
+
+def _write_atomic(path, content):
+    tmp_path = f'{path}.tmp.{socket.gethostname()}.{os.getpid()}'
+    with open(tmp_path, 'w') as fh:
+        fh.write(content)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp_path, path)
+
+
+def submit_job(job_dir, spectrum_paths, method, refractive_index, /,
+               chunk_size=100, wavelength_min=0, wavelength_max=None,
+               smooth=False, **kwargs):
+    """
+    Create a job in a shared directory.
+
+    Failures of the analysis are reported in the results, with their
+    status (see `optifik.results`), unless `errors='raise'` is given.
+
+    Parameters
+    ----------
+    job_dir : string
+        Job directory. It must not contain a job.
+    spectrum_paths : list
+        Paths of the spectrum files, readable from all the workers.
+    method : string
+        Either 'fft', 'minmax' or 'scheludko'.
+    refractive_index : scalar, array or model
+        Refractive index of the medium, see `analyse_spectrum`. Models of
+        `optifik.dispersion` are sent to the workers by their parameters.
+    chunk_size : int, optional
+        Number of spectra per chunk. The default is 100.
+    wavelength_min : scalar, optional
+        Cut the data at this minimum wavelength, see `load_spectrum`.
+    wavelength_max : scalar, optional
+        Cut the data at this maximum wavelength, see `load_spectrum`.
+    smooth : bool, optional
+        Smooth the intensities with `smooth_intensities` before analysis.
+    **kwargs :
+        Extra parameters passed to the method, see `analyse_spectrum`.
+        They must be serializable in JSON, arrays, models of the
+        refractive index and `ReferenceSpectrum` instances included.
+
+    Raises
+    ------
+    TypeError
+        if a parameter cannot be sent to the workers, e.g. a function.
+
+    Returns
+    -------
+    num_chunks : int
+    """
+    spectrum_paths = [str(path) for path in spectrum_paths]
+    num_chunks = -(-len(spectrum_paths) // chunk_size)
+    job = {'method': method,
+           'refractive_index': refractive_index,
+           'wavelength_min': wavelength_min,
+           'wavelength_max': wavelength_max,
+           'smooth': smooth,
+           'num_spectra': len(spectrum_paths),
+           'num_chunks': num_chunks,
+           'kwargs': kwargs}
+    # Before anything is written, so that an invalid job leaves nothing behind
+    content = json.dumps(job, indent=2, default=_encode)
+
+    os.makedirs(job_dir, exist_ok=True)
+    if os.path.exists(os.path.join(job_dir, JOB_FILE)):
+        raise FileExistsError(f'A job already exists in {job_dir}')
+    for subdir in (TODO, RUNNING, DONE, RESULTS):
+        os.makedirs(os.path.join(job_dir, subdir), exist_ok=True)
+
+    for idx, start in enumerate(range(0, len(spectrum_paths), chunk_size)):
+        chunk = {'start': start, 'paths': spectrum_paths[start:start + chunk_size]}
+        path = os.path.join(job_dir, TODO, f'chunk-{idx:06d}.json')
+        _write_atomic(path, json.dumps(chunk))
+
+    # Written last: workers ignore directories without job file
+    _write_atomic(os.path.join(job_dir, JOB_FILE), content)
+    return num_chunks
+
+
+def _chunk_name(running_name):
+    # chunk-000000.json.<worker_id> -> chunk-000000.json
+    return running_name.split('.json', 1)[0] + '.json'
+
+
+def _result_name(chunk_name):
+    return chunk_name.replace('.json', '.csv')
+
+
+def recover_stale_chunks(job_dir, stale_timeout):
+    """
+    Put back in the queue the chunks of crashed workers.
+
+    Parameters
+    ----------
+    job_dir : string
+        Job directory.
+    stale_timeout : scalar
+        Delay in seconds after which a claimed chunk that has not been
+        refreshed is considered as abandoned.
+
+    Returns
+    -------
+    recovered : list
+        Names of the recovered chunks.
+
+    Notes
+    -----
+    The clocks of the hosts must be synchronized, as the modification
+    times are compared to the local time.
+    """
+    recovered = []
+    running_dir = os.path.join(job_dir, RUNNING)
+    now = time.time()
+    for name in sorted(os.listdir(running_dir)):
+        path = os.path.join(running_dir, name)
+        try:
+            if now - os.stat(path).st_mtime < stale_timeout:
+                continue
+            os.rename(path, os.path.join(job_dir, TODO, _chunk_name(name)))
+        except FileNotFoundError:
+            # Finished or recovered by another worker meanwhile
+            continue
+        recovered.append(_chunk_name(name))
+    return recovered
+
+
+def _claim_chunk(job_dir, worker_id):
+    """
+    Claim the first available chunk.
+
+    Returns
+    -------
+    (chunk_name, running_path) or None if the queue is empty.
+    """
+    todo_dir = os.path.join(job_dir, TODO)
+    for name in sorted(os.listdir(todo_dir)):
+        if not name.endswith('.json'):
+            continue
+        running_path = os.path.join(job_dir, RUNNING, f'{name}.{worker_id}')
+        try:
+            os.rename(os.path.join(todo_dir, name), running_path)
+            # The rename keeps the modification time of the submission:
+            # without a heartbeat, the chunk of an old job would look stale
+            os.utime(running_path)
+        except FileNotFoundError:
+            # Claimed by another worker
+            continue
+        return name, running_path
+    return None
+
+
+def _process_chunk(job, chunk, heartbeat_path):
+    """
+    Analyse the spectra of a chunk.
+
+    Returns
+    -------
+    rows : list of tuples
+    """
+    wavelength_max = job['wavelength_max']
+    if wavelength_max is None:
+        wavelength_max = np.inf
+
+    kwargs = {'errors': 'coerce', **job['kwargs']}
+    rows = []
+    for path in chunk['paths']:
+        try:
+            result = analyse_file(job['method'], path, job['refractive_index'],
+                                  wavelength_min=job['wavelength_min'],
+                                  wavelength_max=wavelength_max,
+                                  smooth=job['smooth'], **kwargs)
+        except (RuntimeError, ValueError, OSError) as err:
+            # Unreadable file, or errors='raise'
+            result = OptimizeResult(thickness=np.nan, status=STATUS_FAILED,
+                                    message=f'{type(err).__name__}: {err}')
+        rows.append((path, repr(float(result.thickness)),
+                     repr(float(result.get('thickness_uncertainty', np.nan))),
+                     int(result.get('interference_order', -1)),
+                     int(result.get('status', STATUS_OK)),
+                     result.get('message', '')))
+
+        # Heartbeat
+        try:
+            os.utime(heartbeat_path)
+        except FileNotFoundError:
+            pass
+    return rows
+
+
+def _rows_to_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(_FIELDS)
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+def run_worker(job_dir, worker_id=None, stale_timeout=600.,
+               poll_interval=1., wait=False, max_chunks=None,
+               metrics_file=None):
+    """
+    Process the chunks of a job until the queue is empty.
+
+    Parameters
+    ----------
+    job_dir : string
+        Job directory, created by `submit_job`.
+    worker_id : string, optional
+        Identifier of the worker. The default is `<hostname>-<pid>`.
+    stale_timeout : scalar, optional
+        Delay in seconds after which a chunk claimed by another worker
+        is considered as abandoned, see `recover_stale_chunks`.
+        The default is 600.
+    poll_interval : scalar, optional
+        Delay in seconds between checks when `wait` is `True`.
+    wait : bool, optional
+        If `True`, keep waiting while chunks are claimed by other workers,
+        to take over chunks of crashed workers.
+        Otherwise, return as soon as the queue is empty.
+    max_chunks : int, optional
+        Stop after processing this number of chunks.
+    metrics_file : string, optional
+        If given, the metrics of the worker are written after each chunk
+        to this file, suffixed by the worker id before its extension
+        (e.g. `metrics.<worker_id>.prom`), so that workers sharing the
+        argument write their own files.
+        See `optifik.metrics.MetricsRegistry.write`.
+
+    Returns
+    -------
+    num_chunks : int
+        Number of chunks processed by this worker.
+    """
+    if worker_id is None:
+        worker_id = f'{socket.gethostname()}-{os.getpid()}'
+    worker_id = worker_id.replace(os.sep, '_')
+    if metrics_file is not None:
+        root, ext = os.path.splitext(os.fspath(metrics_file))
+        metrics_file = f'{root}.{worker_id}{ext}'
+
+    with open(os.path.join(job_dir, JOB_FILE)) as fh:
+        job = json.load(fh, object_hook=_decode)
+
+    num_chunks = 0
+    while max_chunks is None or num_chunks < max_chunks:
+        recover_stale_chunks(job_dir, stale_timeout)
+        claimed = _claim_chunk(job_dir, worker_id)
+        if claimed is None:
+            if wait and os.listdir(os.path.join(job_dir, RUNNING)):
+                time.sleep(poll_interval)
+                continue
+            break
+
+        name, running_path = claimed
+        result_path = os.path.join(job_dir, RESULTS, _result_name(name))
+        if not os.path.exists(result_path):
+            with open(running_path) as fh:
+                chunk = json.load(fh)
+            rows = _process_chunk(job, chunk, running_path)
+            _write_atomic(result_path, _rows_to_csv(rows))
+        try:
+            os.rename(running_path, os.path.join(job_dir, DONE, name))
+        except FileNotFoundError:
+            # Considered as stale and recovered by another worker
+            pass
+        num_chunks += 1
+        if metrics_file is not None:
+            REGISTRY.write(metrics_file)
+    return num_chunks
+
+
+def job_status(job_dir):
+    """
+    Return the number of chunks in each state.
+
+    Returns
+    -------
+    status : dict
+        Keys are 'todo', 'running' and 'done'.
+    """
+    return {state: len(os.listdir(os.path.join(job_dir, state)))
+            for state in (TODO, RUNNING, DONE)}
+
+
+def collect_results(job_dir):
+    """
+    Gather the results of a completed job.
+
+    Parameters
+    ----------
+    job_dir : string
+        Job directory.
+
+    Raises
+    ------
+    RuntimeError
+        if some chunks have not been processed.
+
+    Returns
+    -------
+    results : Instance of `OptimizeResult` class.
+        Attributes `path` and `message` are lists, `thickness`,
+        `thickness_uncertainty`, `interference_order` and `status` are
+        arrays, in the order of submission.
+        The status is `STATUS_OK` and the message is empty if the
+        analysis succeeded.
+    """
+    with open(os.path.join(job_dir, JOB_FILE)) as fh:
+        job = json.load(fh)
+
+    columns = {field: [] for field in _FIELDS}
+    for idx in range(job['num_chunks']):
+        path = os.path.join(job_dir, RESULTS, f'chunk-{idx:06d}.csv')
+        if not os.path.exists(path):
+            raise RuntimeError(f'Job not complete, chunk {idx} is missing.')
+        with open(path, newline='') as fh:
+            for row in csv.DictReader(fh):
+                for field in _FIELDS:
+                    columns[field].append(row[field])
+
+    return OptimizeResult(path=columns['path'],
+                          thickness=np.array(columns['thickness'], dtype=float),
+                          thickness_uncertainty=np.array(columns['thickness_uncertainty'],
+                                                         dtype=float),
+                          interference_order=np.array(columns['interference_order'],
+                                                      dtype=int),
+                          status=np.array(columns['status'], dtype=np.int8),
+                          message=columns['message'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a worker on a job directory.')
+    parser.add_argument('job_dir', help='Job directory')
+    parser.add_argument('--worker-id', default=None, help='Identifier of the worker')
+    parser.add_argument('--stale-timeout', type=float, default=600.,
+                        help='Delay (s) before taking over a chunk of another worker')
+    parser.add_argument('--wait', action='store_true',
+                        help='Wait for chunks claimed by other workers')
+    parser.add_argument('--metrics', default=None,
+                        help='File receiving the metrics (Prometheus, or JSON if *.json), '
+                             'suffixed by the worker id')
+    args = parser.parse_args(argv)
+    num_chunks = run_worker(args.job_dir, worker_id=args.worker_id,
+                            stale_timeout=args.stale_timeout, wait=args.wait,
+                            metrics_file=args.metrics)
+    print(f'{num_chunks} chunks processed')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+"""
+Live display of the thickness during an acquisition.
+
+The analysis loop only appends results to the viewer, which costs a few
+microseconds. The display refreshes at its own rate from the latest
+state: preallocated artists are updated and redrawn with blitting, the
+history being downsampled to a fixed number of points.
+"""
+import os
+import threading
+import time
+
+import numpy as np
+
+from .batch import _analyse
+from .diagnostics import DiagnosticFigure
+from .io import load_spectrum
+from .analysis import smooth_intensities
+from .utils import PLOT_STYLE
+
+
+def downsample(times, values, max_points):
+    """
+    Reduce a series to at most `max_points` points for display.
+
+    The series is cut into buckets of consecutive points, and the minimum
+    and the maximum of each bucket are kept, so that spikes stay visible.
+
+    Parameters
+    ----------
+    times : array
+        Abscissas, sorted.
+    values : array
+        Values. NaN values are dropped.
+    max_points : int
+        Maximum number of points, at least 2.
+
+    Returns
+    -------
+    (times, values) : downsampled arrays.
+    """
+    times = np.asarray(times)
+    values = np.asarray(values, dtype=float)
+    valid = np.isfinite(values)
+    if len(values) <= max_points:
+        return times[valid], values[valid]
+
+    num_buckets = max_points // 2
+    bucket_size = -(-len(values) // num_buckets)
+    padding = num_buckets * bucket_size - len(values)
+    low = np.concatenate([np.where(valid, values, np.inf), np.full(padding, np.inf)])
+    high = np.concatenate([np.where(valid, values, -np.inf), np.full(padding, -np.inf)])
+    offsets = np.arange(num_buckets) * bucket_size
+    idx_min = offsets + low.reshape(num_buckets, bucket_size).argmin(axis=1)
+    idx_max = offsets + high.reshape(num_buckets, bucket_size).argmax(axis=1)
+    # In time order within each bucket
+    indices = np.sort(np.stack([idx_min, idx_max], axis=1), axis=1).ravel()
+    indices = indices[indices < len(values)]
+    indices = indices[valid[indices]]
+    return times[indices], values[indices]
+
+
+def _adapt_limits(ax, margin=0.25):
+    """
+    Adapt the limits of `ax` if its data went out of them.
+
+    Limits are enlarged with a margin, so that redrawing the whole figure
+    is rarely needed, and reduced if the data only cover a small part of
+    them. Returns True if the limits changed.
+    """
+    ax.relim()
+    if not np.all(np.isfinite(ax.dataLim.get_points())):
+        return False
+    changed = False
+    for (data_min, data_max), get_lim, set_lim, scale in (
+            (ax.dataLim.intervalx, ax.get_xlim, ax.set_xlim, ax.get_xscale()),
+            (ax.dataLim.intervaly, ax.get_ylim, ax.set_ylim, ax.get_yscale())):
+        view_min, view_max = get_lim()
+        inside = data_min >= view_min and data_max <= view_max
+        if scale == 'log':
+            shrunk = data_min > 0 and view_min > 0 and \
+                np.log(data_max / data_min) < 0.3 * np.log(view_max / view_min)
+        else:
+            shrunk = data_max - data_min < 0.3 * (view_max - view_min)
+        if inside and not shrunk:
+            continue
+        if scale == 'log':
+            if data_min <= 0:
+                continue
+            factor = (data_max / data_min) ** margin
+            set_lim(data_min / factor, data_max * factor)
+        else:
+            span = (data_max - data_min) or abs(data_max) or 1.
+            set_lim(data_min - margin * span, data_max + margin * span)
+        changed = True
+    return changed
+
+
+class LiveViewer:
+    """ Live plot of the thickness versus time and of the current spectrum.
+
+    Results are given by `update` or `feed`, from any thread. The figure
+    is refreshed by a timer of the GUI, started by `show`, or by calls
+    to `refresh`. Only the latest spectrum is analysed again to draw its
+    fit, at the refresh rate of the display.
+
+    Parameters
+    ----------
+    method : string
+        Either 'fft', 'minmax' or 'scheludko'.
+    refractive_index : scalar, array or `optifik.dispersion.RefractiveIndex`
+        Value of the refractive index of the medium, or its model.
+    max_points : int, optional
+        Maximum number of points of the displayed history.
+    interval : scalar, optional
+        Delay between two refreshes in seconds.
+    wavelength_min : scalar, optional
+        Cut the spectrum files at this minimum wavelength (included).
+    wavelength_max : scalar, optional
+        Cut the spectrum files at this maximum wavelength (included).
+    smooth : bool, optional
+        Smooth the intensities of the spectrum files.
+    **kwargs :
+        Extra parameters passed to the method, see
+        `optifik.batch.analyse_spectrum`.
+
+    Attributes
+    ----------
+    num_full_draws : int
+        Number of refreshes that redrew the whole figure, because the
+        limits of an axis changed.
+    num_blits : int
+        Number of refreshes that only redrew the updated artists.
+    """
+    def __init__(self, method, refractive_index, /, max_points=2000, interval=0.1,
+                 wavelength_min=0, wavelength_max=np.inf, smooth=False, **kwargs):
+        import matplotlib.pyplot as plt
+
+        self.method = method
+        self.refractive_index = refractive_index
+        self.max_points = max_points
+        self.interval = interval
+        self.load_kwargs = dict(wavelength_min=wavelength_min,
+                                wavelength_max=wavelength_max)
+        self.smooth = smooth
+        self.kwargs = kwargs
+
+        self._lock = threading.Lock()
+        self._times = np.empty(1024)
+        self._thickness = np.empty(1024)
+        self._count = 0
+        self._latest = None
+        self._version = 0
+        self._drawn_version = 0
+        self._drawn_spectrum = None
+        self.num_full_draws = 0
+        self.num_blits = 0
+
+        with plt.rc_context(PLOT_STYLE):
+            plt.rcParams['figure.dpi'] = 100
+            self.figure, axes = plt.subplots(nrows=3, figsize=(10, 12))
+            self.ax_history = axes[0]
+            self.history_line, = self.ax_history.plot([], [], '.-', markersize=3)
+            self.ax_history.set_xlabel(r'$t$ $[\mathrm{s}]$')
+            self.ax_history.set_ylabel(r'$h$ $[\mathrm{nm}]$')
+            self.spectrum = DiagnosticFigure(method, axes=axes[1:])
+            self.figure.tight_layout()
+
+        self.artists = [self.history_line, *self.spectrum.artists]
+        for artist in self.artists:
+            artist.set_animated(True)
+        self._background = None
+        self.figure.canvas.mpl_connect('draw_event', self._on_draw)
+        self._timer = None
+
+    def update(self, result, timestamp=None, spectrum=None):
+        """
+        Add a result. Fast, the display is not updated.
+
+        Parameters
+        ----------
+        result : Instance of `OptimizeResult` class.
+            Result of the analysis.
+        timestamp : scalar, optional
+            Time of the spectrum in seconds. The default is now.
+        spectrum : string or tuple, optional
+            Path of the spectrum file, or its wavelengths and intensities.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            if self._count == len(self._times):
+                # Amortized growth
+                self._times = np.concatenate([self._times, np.empty_like(self._times)])
+                self._thickness = np.concatenate([self._thickness,
+                                                  np.empty_like(self._thickness)])
+            self._times[self._count] = timestamp
+            self._thickness[self._count] = result.get('thickness', np.nan)
+            self._count += 1
+            if spectrum is not None:
+                self._latest = (self._count - 1, result, spectrum)
+            self._version += 1
+
+    def feed(self, stream):
+        """
+        Add the results of a stream in a background thread.
+
+        Parameters
+        ----------
+        stream : iterable
+            Pairs (path, result), as yielded by
+            `optifik.stream.watch_directory`.
+
+        Returns
+        -------
+        thread : `threading.Thread`
+            The started thread, ending with the stream.
+        """
+        def consume():
+            for path, result in stream:
+                try:
+                    timestamp = os.path.getmtime(path)
+                except OSError:
+                    timestamp = None
+                self.update(result, timestamp=timestamp, spectrum=path)
+
+        thread = threading.Thread(target=consume, daemon=True)
+        thread.start()
+        return thread
+
+    def _on_draw(self, event):
+        # Full draws do not include the animated artists
+        self._background = self.figure.canvas.copy_from_bbox(self.figure.bbox)
+        for artist in self.artists:
+            self.figure.draw_artist(artist)
+
+    def refresh(self):
+        """
+        Redraw the figure with the latest results.
+
+        Returns
+        -------
+        updated : bool
+            False if there was nothing new to draw.
+        """
+        with self._lock:
+            if self._version == self._drawn_version:
+                return False
+            self._drawn_version = self._version
+            times = self._times[:self._count].copy()
+            thickness = self._thickness[:self._count].copy()
+            latest = self._latest
+
+        times, thickness = downsample(times - times[0], thickness, self.max_points)
+        self.history_line.set_data(times, thickness)
+        axes = [self.ax_history]
+        if latest is not None and latest[0] != self._drawn_spectrum:
+            self._draw_spectrum(*latest)
+            axes += [self.spectrum.ax_spectrum, self.spectrum.ax_method]
+
+        canvas = self.figure.canvas
+        changed = [_adapt_limits(ax) for ax in axes]
+        if any(changed) or self._background is None:
+            self.num_full_draws += 1
+            canvas.draw()
+        else:
+            self.num_blits += 1
+            canvas.restore_region(self._background)
+            for artist in self.artists:
+                self.figure.draw_artist(artist)
+        canvas.blit(self.figure.bbox)
+        canvas.flush_events()
+        return True
+
+    def _draw_spectrum(self, index, result, spectrum):
+        if isinstance(spectrum, (str, os.PathLike)):
+            wavelengths, intensities = load_spectrum(spectrum, **self.load_kwargs)
+            if self.smooth:
+                intensities = smooth_intensities(intensities)
+        else:
+            wavelengths, intensities = spectrum
+        _, plot_data = _analyse(self.method, wavelengths, intensities, self.refractive_index,
+                                errors='coerce', **self.kwargs)
+        self.spectrum.draw(index, wavelengths, intensities, result, plot_data,
+                           autoscale=False)
+        self._drawn_spectrum = index
+
+    def show(self):
+        """
+        Start the refresh timer and show the figure (blocking).
+        """
+        import matplotlib.pyplot as plt
+
+        self._timer = self.figure.canvas.new_timer(interval=int(self.interval * 1000))
+        self._timer.add_callback(self.refresh)
+        self._timer.start()
+        plt.show()
@@ -0,0 +1,289 @@
+"""
+Process-wide registry of counters and latency histograms.
+
+The analysis functions update the registry `REGISTRY`:
+
+- `optifik_spectra_total{method}`: number of analysed spectra,
+- `optifik_failures_total{method, reason}`: number of failures,
+- `optifik_analysis_seconds{method}`: histogram of the analysis durations.
+
+The registry can be dumped to a Prometheus text file or to a JSON
+snapshot. Each process has its own registry: snapshots of worker
+processes can be merged into the registry of the parent process
+with `MetricsRegistry.merge`.
+"""
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+
+from .results import STATUS_OK, FAILURE_REASONS, failed_result
+
+
+DEFAULT_BUCKETS = (1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2,
+                   5e-2, 0.1, 0.25, 0.5, 1., 2.5, 5., 10.)
+
+DESCRIPTIONS = {
+    'optifik_spectra_total': ('counter', 'Number of analysed spectra.'),
+    'optifik_failures_total': ('counter', 'Number of failed analyses.'),
+    'optifik_analysis_seconds': ('histogram', 'Duration of the analyses in seconds.'),
+    'optifik_cache_requests_total': ('counter', 'Number of requests to the result cache.'),
+}
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    content = ','.join(f'{key}="{value}"' for key, value in items)
+    return '{' + content + '}'
+
+
+def _write_atomic(path, content):
+    tmp_path = f'{path}.tmp.{os.getpid()}'
+    with open(tmp_path, 'w') as fh:
+        fh.write(content)
+    os.replace(tmp_path, path)
+
+
+class MetricsRegistry:
+    """ Thread-safe registry of counters and histograms.
+
+    Parameters
+    ----------
+    buckets : tuple, optional
+        Upper bounds of the histogram buckets.
+
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        """
+        Increment a counter.
+        """
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """
+        Add a value to a histogram.
+        """
+        key = (name, _labels_key(labels))
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0., 0]
+            histogram[0][idx] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def counter_value(self, name, **labels):
+        """
+        Return the value of a counter, 0 if it does not exist.
+        """
+        with self._lock:
+            return self._counters.get((name, _labels_key(labels)), 0)
+
+    def reset(self):
+        """
+        Remove all the metrics.
+        """
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self, reset=False):
+        """
+        Return the metrics in a JSON serializable dict.
+
+        Parameters
+        ----------
+        reset : bool, optional
+            Atomically remove the metrics after the snapshot.
+        """
+        with self._lock:
+            snapshot = {
+                'buckets': list(self.buckets),
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in sorted(self._counters.items())],
+                'histograms': [{'name': name, 'labels': dict(labels),
+                                'counts': list(counts), 'sum': total, 'count': count}
+                               for (name, labels), (counts, total, count)
+                               in sorted(self._histograms.items())],
+            }
+            if reset:
+                self._counters.clear()
+                self._histograms.clear()
+        return snapshot
+
+    def merge(self, snapshot):
+        """
+        Add the metrics of a snapshot, e.g. from another process.
+        """
+        if tuple(snapshot['buckets']) != self.buckets:
+            raise ValueError('Histogram buckets differ.')
+        with self._lock:
+            for item in snapshot['counters']:
+                key = (item['name'], _labels_key(item['labels']))
+                self._counters[key] = self._counters.get(key, 0) + item['value']
+            for item in snapshot['histograms']:
+                key = (item['name'], _labels_key(item['labels']))
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0., 0]
+                histogram[0] = [a + b for a, b in zip(histogram[0], item['counts'])]
+                histogram[1] += item['sum']
+                histogram[2] += item['count']
+
+    def to_prometheus(self):
+        """
+        Return the metrics in the Prometheus text format.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        described = set()
+
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                kind, text = DESCRIPTIONS.get(name, (kind, ''))
+                if text:
+                    lines.append(f'# HELP {name} {text}')
+                lines.append(f'# TYPE {name} {kind}')
+
+        for item in snapshot['counters']:
+            describe(item['name'], 'counter')
+            labels = _format_labels(item['labels'].items())
+            lines.append(f"{item['name']}{labels} {item['value']}")
+
+        bounds = [repr(float(bound)) for bound in self.buckets] + ['+Inf']
+        for item in snapshot['histograms']:
+            name = item['name']
+            describe(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(bounds, item['counts']):
+                cumulative += count
+                labels = _format_labels(item['labels'].items(), [('le', bound)])
+                lines.append(f'{name}_bucket{labels} {cumulative}')
+            labels = _format_labels(item['labels'].items())
+            lines.append(f"{name}_sum{labels} {item['sum']!r}")
+            lines.append(f"{name}_count{labels} {item['count']}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """
+        Atomically write the metrics to a file.
+
+        The format is JSON if the file name ends with '.json',
+        the Prometheus text format otherwise.
+        """
+        path = str(path)
+        if path.endswith('.json'):
+            content = json.dumps(self.snapshot(), indent=1)
+        else:
+            content = self.to_prometheus()
+        _write_atomic(path, content)
+
+    def _after_fork(self):
+        # The lock may have been held by another thread during the fork
+        self._lock = threading.Lock()
+
+
+REGISTRY = MetricsRegistry()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=REGISTRY._after_fork)
+
+
+def record_failure(method, reason):
+    """
+    Count a failure of a method in `REGISTRY`.
+    """
+    if REGISTRY.enabled:
+        REGISTRY.inc('optifik_failures_total', method=method, reason=reason)
+
+
+def tag_failure(error, reason):
+    """
+    Attach the reason of a failure to an exception.
+
+    The reason is used as label when the exception goes through
+    a function decorated by `instrumented`.
+
+    Returns
+    -------
+    error : the exception.
+    """
+    error.optifik_reason = reason
+    return error
+
+
+def handle_failure(error, reason, errors='raise', plot_data=None):
+    """
+    Raise an exception or return a failed result.
+
+    Parameters
+    ----------
+    error : Exception
+        The exception describing the failure.
+    reason : string
+        Reason of the failure, see `tag_failure`.
+    errors : string, optional
+        'raise' to raise `error`, or 'coerce' to return the result
+        of a failed analysis (see `optifik.results.failed_result`).
+    plot_data : dict, optional
+        Data of the plots computed before the failure.
+
+    Returns
+    -------
+    (results, plot_data) : the failed result and the partial plot data.
+    """
+    if errors == 'raise':
+        raise tag_failure(error, reason)
+    return failed_result(reason, str(error)), plot_data
+
+
+def instrumented(method):
+    """
+    Decorator counting the calls of a method and measuring their durations.
+
+    Exceptions are counted as failures, with the reason given by
+    `tag_failure` or, by default, the name of the exception class.
+    So are results returned with a failure `status`
+    (see `optifik.results.failed_result`).
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not REGISTRY.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                output = func(*args, **kwargs)
+                result = output[0] if isinstance(output, tuple) else output
+                status = result.get('status', STATUS_OK)
+                if status != STATUS_OK:
+                    record_failure(method, FAILURE_REASONS.get(status, 'failed'))
+                return output
+            except Exception as err:
+                record_failure(method, getattr(err, 'optifik_reason', type(err).__name__))
+                raise
+            finally:
+                REGISTRY.inc('optifik_spectra_total', method=method)
+                REGISTRY.observe('optifik_analysis_seconds',
+                                 time.perf_counter() - start, method=method)
+        return wrapper
+    return decorator
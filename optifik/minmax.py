@@ -3,73 +3,59 @@ import numpy as np
 
 from scipy import stats
 from sklearn.linear_model import RANSACRegressor, LinearRegression
-from scipy.signal import find_peaks
-
-import inspect
-import matplotlib.pyplot as plt
-
-from .utils import OptimizeResult, setup_matplotlib, round_to_uncertainty
-
-
-def thickness_from_minmax(wavelengths,
-                          intensities,
-                          refractive_index,
-                          min_peak_prominence,
-                          min_peak_distance=10,
-                          method='linreg',
-                          ransac_residual_threshold=1e-4,
-                          plot=None):
 
+from .utils import OptimizeResult, setup_matplotlib, round_to_uncertainty, stage_timer
+from .metrics import instrumented, handle_failure
+from .results import failed_result, STATUS_OK
+from .analysis import _find_extrema
+from .dispersion import RefractiveIndex
+
+
+@instrumented('minmax')
+def _minmax_core(wavelengths,
+                 intensities,
+                 refractive_index,
+                 min_peak_prominence,
+                 min_peak_distance=10,
+                 method='linreg',
+                 ransac_residual_threshold=1e-4,
+                 timings=False,
+                 errors='raise'):
     """
-    Return the thickness from a min-max detection.
+    Compute the thickness from a min-max detection, without plotting.
 
-    Parameters
-    ----------
-    wavelengths : array
-        Wavelength values in nm.
-    intensities : array
-        Intensity values.
-    refractive_index : scalar, optional
-        Value of the refractive index of the medium.
-    min_peak_prominence : scalar, optional
-        Required prominence of peaks.
-    min_peak_distance : scalar, optional
-        Minimum distance between peaks.
-    method : string, optional
-        Either 'linreg' for linear regression or 'ransac'
-        for Randon Sampling Consensus.
-    ransac_residual_threshold : float, optional
-        Residual threshold for ransac.
-        Used only if `method=='ransac'`.
-    plot : boolean, optional
-        Show plots of peak detection and lin regression.
+    See `thickness_from_minmax` for the parameters.
 
     Returns
     -------
     results : Instance of `OptimizeResult` class.
-        The attribute `thickness` gives the thickness value in nm.
-
-    Notes
-    -----
-    For more details about `min_peak_prominence` and `min_peak_distance`,
-    see the documentation of `scipy.signal.find_peaks`. This function
-    is used to find extrema.
+    plot_data : dict or None
+        Intermediate data required by `_plot_minmax`. If the fit could
+        not be performed, only the detected extrema, as
+        `extrema=(wavelengths, intensities, peaks_min, peaks_max)`.
     """
-    if plot:
-        setup_matplotlib()
+    timer = stage_timer(timings)
 
-    peaks_max, _ = find_peaks(intensities, prominence=min_peak_prominence, distance=min_peak_distance)
-    peaks_min, _ = find_peaks(-intensities, prominence=min_peak_prominence, distance=min_peak_distance)
+    peaks_min, peaks_max = _find_extrema(intensities,
+                                         min_peak_prominence,
+                                         min_peak_distance=min_peak_distance)
     peaks = np.concatenate((peaks_min, peaks_max))
     peaks.sort()
+    timer.lap('peak_detection')
 
     k_values = np.arange(len(peaks))
 
     if k_values.size < 2:
-        warnings.warn('Number of peaks < 2, cannot fit. Thickness set to NaN.', RuntimeWarning)
-        return OptimizeResult(thickness=np.nan)
-
-    if isinstance(refractive_index, np.ndarray):
+        if errors == 'raise':
+            warnings.warn('Number of peaks < 2, cannot fit. Thickness set to NaN.', RuntimeWarning)
+        result = failed_result('too_few_peaks', 'Number of peaks < 2, cannot fit.')
+        if timings:
+            result.timings = timer.results()
+        return result, dict(extrema=(wavelengths, intensities, peaks_min, peaks_max))
+
+    if isinstance(refractive_index, RefractiveIndex):
+        n_over_lambda = refractive_index.n_over_lambda(wavelengths)[peaks][::-1]
+    elif isinstance(refractive_index, np.ndarray):
         n_over_lambda = refractive_index[peaks][::-1] / wavelengths[peaks][::-1]
     else:
         n_over_lambda = refractive_index / wavelengths[peaks][::-1]
@@ -110,56 +96,148 @@ def thickness_from_minmax(wavelengths,
         y_in = data[inliers, 1]
         res_lin_fit = stats.linregress(x_in, y_in)
         thickness_err = res_lin_fit.stderr / (4 * res_lin_fit.slope**2)
-
-
-        if plot:
-            val, err = round_to_uncertainty(thickness_minmax, thickness_err)
-            label = rf'$\mathrm{{Fit}}\ (h = {val} \pm {err}\ \mathrm{{nm}})$'
-
-            fig, ax = plt.subplots()
-            ax.set_xlabel(r'$\mathrm{{Index}}$ $N$')
-            ax.set_ylabel(r'$n$($\lambda$) / $\lambda$ \ $[\mathrm{{\mu m^{-1}}}]$ ')
-            ax.plot(data[inliers, 0], data[inliers, 1] * 1000, 'xb', alpha=0.6, label='Inliers')
-            ax.plot(data[~inliers, 0], data[~inliers, 1] * 1000, '+r', alpha=0.6, label='Outliers')
-            ax.plot(k_values, model_robust.predict(X) * 1000, '-g', label=label)
-
-            ax.legend()
-            plt.title(f'Func Call: {inspect.currentframe().f_code.co_name}()')
-            plt.tight_layout()
-            plt.show()
-
-        return OptimizeResult(thickness=thickness_minmax,
-                              num_inliers=inliers.sum(),
-                              num_outliers=(~inliers).sum(),
-                              peaks_max=peaks_max,
-                              peaks_min=peaks_min,
-                              thickness_uncertainty=thickness_err)
+        timer.lap('regression')
+
+        plot_data = dict(method='ransac',
+                         k_values=k_values,
+                         n_over_lambda=n_over_lambda,
+                         inliers=inliers,
+                         model=model_robust,
+                         thickness=thickness_minmax,
+                         thickness_err=thickness_err)
+
+        result = OptimizeResult(thickness=thickness_minmax,
+                                num_inliers=inliers.sum(),
+                                num_outliers=(~inliers).sum(),
+                                peaks_max=peaks_max,
+                                peaks_min=peaks_min,
+                                thickness_uncertainty=thickness_err)
 
     elif method.lower() == 'linreg':
         res_lin_fit = stats.linregress(k_values, n_over_lambda)
         thickness_minmax = 1 / res_lin_fit.slope / 4
         thickness_err = res_lin_fit.stderr / (4 * res_lin_fit.slope**2)
+        timer.lap('regression')
+
+        plot_data = dict(method='linreg',
+                         k_values=k_values,
+                         n_over_lambda=n_over_lambda,
+                         slope=res_lin_fit.slope,
+                         intercept=res_lin_fit.intercept,
+                         thickness=thickness_minmax,
+                         thickness_err=thickness_err)
 
-        if plot:
-            val, err = round_to_uncertainty(thickness_minmax, thickness_err)
-            label = rf'$\mathrm{{Fit}}\ (h = {val} \pm {err}\ \mathrm{{nm}})$'
+        result = OptimizeResult(thickness=thickness_minmax,
+                                peaks_max=peaks_max,
+                                peaks_min=peaks_min,
+                                thickness_uncertainty=thickness_err)
 
-            fig, ax = plt.subplots()
-            ax.set_xlabel(r'$\mathrm{{Index}}$ $N$')
-            ax.set_ylabel(r'$n$($\lambda$) / $\lambda$ \ $[\mathrm{{\mu m^{-1}}}]$ ')
-            ax.plot(k_values, n_over_lambda * 1000, 's', label='Extrema')
-            ax.plot(k_values, (res_lin_fit.intercept + k_values * res_lin_fit.slope) * 1000, label=label)
+    else:
+        return handle_failure(ValueError('Wrong method'), 'invalid_input', errors,
+                              dict(extrema=(wavelengths, intensities, peaks_min, peaks_max)))
 
-            ax.legend()
+    if timings:
+        result.timings = timer.results()
+    return result, plot_data
 
-            plt.title(f'Func Call: {inspect.currentframe().f_code.co_name}()')
-            plt.tight_layout()
-            plt.show()
 
-        return OptimizeResult(thickness=thickness_minmax,
-                              peaks_max=peaks_max,
-                              peaks_min=peaks_min,
-                              thickness_uncertainty=thickness_err)
+def _plot_minmax(method, k_values, n_over_lambda, thickness, thickness_err,
+                 inliers=None, model=None, slope=None, intercept=None):
+    """
+    Plot the linear regression of `thickness_from_minmax`.
+    """
+    import matplotlib.pyplot as plt
 
+    setup_matplotlib()
+
+    val, err = round_to_uncertainty(thickness, thickness_err)
+    label = rf'$\mathrm{{Fit}}\ (h = {val} \pm {err}\ \mathrm{{nm}})$'
+
+    fig, ax = plt.subplots()
+    ax.set_xlabel(r'$\mathrm{{Index}}$ $N$')
+    ax.set_ylabel(r'$n$($\lambda$) / $\lambda$ \ $[\mathrm{{\mu m^{-1}}}]$ ')
+    if method == 'ransac':
+        ax.plot(k_values[inliers], n_over_lambda[inliers] * 1000, 'xb', alpha=0.6, label='Inliers')
+        ax.plot(k_values[~inliers], n_over_lambda[~inliers] * 1000, '+r', alpha=0.6, label='Outliers')
+        ax.plot(k_values, model.predict(k_values.reshape(-1, 1)) * 1000, '-g', label=label)
     else:
-        raise ValueError('Wrong method')
+        ax.plot(k_values, n_over_lambda * 1000, 's', label='Extrema')
+        ax.plot(k_values, (intercept + k_values * slope) * 1000, label=label)
+
+    ax.legend()
+    plt.title('Func Call: thickness_from_minmax()')
+    plt.tight_layout()
+    plt.show()
+
+
+def thickness_from_minmax(wavelengths,
+                          intensities,
+                          refractive_index,
+                          min_peak_prominence,
+                          min_peak_distance=10,
+                          method='linreg',
+                          ransac_residual_threshold=1e-4,
+                          plot=None,
+                          timings=False,
+                          errors='raise'):
+
+    """
+    Return the thickness from a min-max detection.
+
+    Parameters
+    ----------
+    wavelengths : array
+        Wavelength values in nm.
+    intensities : array
+        Intensity values.
+    refractive_index : scalar, array or `optifik.dispersion.RefractiveIndex`
+        Value of the refractive index of the medium, or its model.
+    min_peak_prominence : scalar, optional
+        Required prominence of peaks.
+    min_peak_distance : scalar, optional
+        Minimum distance between peaks.
+    method : string, optional
+        Either 'linreg' for linear regression or 'ransac'
+        for Randon Sampling Consensus.
+    ransac_residual_threshold : float, optional
+        Residual threshold for ransac.
+        Used only if `method=='ransac'`.
+    plot : boolean, optional
+        Show plots of peak detection and lin regression.
+    timings : boolean, optional
+        Record the duration and the allocations of the stages
+        'peak_detection' and 'regression' in the attribute
+        `timings` of the results, see `StageTimer.results`.
+    errors : string, optional
+        With 'raise' (default), a wrong input raises an exception and
+        a warning is emitted if less than two peaks are detected.
+        With 'coerce', failures are only reported in the results.
+
+    Returns
+    -------
+    results : Instance of `OptimizeResult` class.
+        The attribute `thickness` gives the thickness value in nm.
+        If the analysis failed, the thickness is NaN and the attributes
+        `status` and `message` describe the failure
+        (see `optifik.results`).
+
+    Notes
+    -----
+    For more details about `min_peak_prominence` and `min_peak_distance`,
+    see the documentation of `scipy.signal.find_peaks`. This function
+    is used to find extrema.
+    """
+    result, plot_data = _minmax_core(wavelengths,
+                                     intensities,
+                                     refractive_index,
+                                     min_peak_prominence,
+                                     min_peak_distance=min_peak_distance,
+                                     method=method,
+                                     ransac_residual_threshold=ransac_residual_threshold,
+                                     timings=timings,
+                                     errors=errors)
+
+    if plot and result.get('status', STATUS_OK) == STATUS_OK:
+        _plot_minmax(**plot_data)
+
+    return result
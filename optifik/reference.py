@@ -0,0 +1,147 @@
+"""
+Reference spectra, such as the intensities in absence of film required
+by the Scheludko method at order 0.
+
+A reference is loaded once and resampled once on each distinct
+wavelength grid of the analysed spectra. The quantities used by the
+analysis are memoised with the resampled intensities, so that the
+analysis of a time series does no redundant reading, interpolation or
+reduction of the reference.
+"""
+import numpy as np
+
+from .io import load_spectrum
+from .analysis import smooth_intensities
+from .utils import _GridCache
+
+
+class ReferenceSpectrum:
+    """ Reference spectrum, resampled on demand on the analysed grids.
+
+    Can be given as `intensities_void` to `thickness_from_scheludko`
+    and to the batch functions.
+
+    Parameters
+    ----------
+    wavelengths : array
+        Wavelength values in nm.
+    intensities : array
+        Intensity values.
+    max_grids : int, optional
+        Number of wavelength grids memoised.
+    """
+    def __init__(self, wavelengths, intensities, max_grids=8):
+        wavelengths = np.asarray(wavelengths, dtype=float)
+        intensities = np.asarray(intensities, dtype=float)
+        if wavelengths.ndim != 1 or wavelengths.shape != intensities.shape:
+            raise ValueError('wavelengths and intensities must be 1D arrays '
+                             'of the same length.')
+        order = np.argsort(wavelengths, kind='stable')
+        self.wavelengths = wavelengths[order]
+        self.intensities = intensities[order]
+        self._cache = _GridCache(max_grids)
+
+    @classmethod
+    def from_file(cls, path, wavelength_min=0, wavelength_max=np.inf,
+                  delimiter=',', smooth=False, **kwargs):
+        """
+        Load a reference spectrum from a file.
+
+        Parameters
+        ----------
+        path : string
+            File path, see `optifik.io.load_spectrum` for the format.
+        wavelength_min : scalar, optional
+            Cut the data at this minimum wavelength (included).
+        wavelength_max : scalar, optional
+            Cut the data at this maximum wavelength (included).
+        delimiter : string, optional
+            Delimiter between columns in the datafile.
+        smooth : bool, optional
+            Smooth the intensities with
+            `optifik.analysis.smooth_intensities`.
+        **kwargs :
+            Extra parameters of the constructor.
+
+        Returns
+        -------
+        reference : Instance of `ReferenceSpectrum` class.
+        """
+        wavelengths, intensities = load_spectrum(path,
+                                                 wavelength_min=wavelength_min,
+                                                 wavelength_max=wavelength_max,
+                                                 delimiter=delimiter)
+        if smooth:
+            intensities = smooth_intensities(intensities)
+        return cls(wavelengths, intensities, **kwargs)
+
+    def __repr__(self):
+        return (f'{self.__class__.__name__}({len(self.wavelengths)} values, '
+                f'{self.wavelengths[0]:g}-{self.wavelengths[-1]:g} nm)')
+
+    def _resample(self, grid):
+        if np.array_equal(grid, self.wavelengths):
+            return self.intensities.copy()
+        if grid.size and (grid.min() < self.wavelengths[0]
+                          or grid.max() > self.wavelengths[-1]):
+            raise ValueError(f'Wavelengths outside of the reference spectrum '
+                             f'({self.wavelengths[0]:g}-{self.wavelengths[-1]:g} nm).')
+        return np.interp(grid, self.wavelengths, self.intensities)
+
+    def resample(self, wavelengths):
+        """
+        Return the intensities on `wavelengths`, interpolated linearly.
+
+        The result is memoised and read-only.
+
+        Parameters
+        ----------
+        wavelengths : array
+            Wavelength values in nm.
+
+        Raises
+        ------
+        ValueError
+            if `wavelengths` exceed the range of the reference.
+
+        Returns
+        -------
+        intensities : array
+        """
+        return self._cache.get(wavelengths, 'intensities', self._resample)
+
+    def _suffix_minima(self, grid):
+        # Grid in increasing order and minimum of the intensities
+        # from each wavelength of the sorted grid to the end
+        order = np.argsort(grid, kind='stable')
+        intensities = self.resample(grid)[order]
+        sorted_grid = grid[order]
+        minima = np.minimum.accumulate(intensities[::-1])[::-1]
+        sorted_grid.flags.writeable = minima.flags.writeable = False
+        return sorted_grid, minima
+
+    def minimum_from(self, wavelengths, wavelength_start):
+        """
+        Return the minimum of the resampled intensities over
+        `wavelengths >= wavelength_start`.
+
+        Minima are precomputed once per grid, each call is a search.
+
+        Parameters
+        ----------
+        wavelengths : array
+            Wavelength values in nm.
+        wavelength_start : scalar
+            Minimum wavelength (included).
+
+        Returns
+        -------
+        minimum : scalar
+            NaN if no wavelength is selected.
+        """
+        sorted_grid, minima = self._cache.get(wavelengths, 'suffix_minima',
+                                              self._suffix_minima)
+        index = np.searchsorted(sorted_grid, wavelength_start, side='left')
+        if index == len(minima):
+            return np.nan
+        return minima[index]
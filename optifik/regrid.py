@@ -0,0 +1,194 @@
+"""
+Resampling of spectra acquired on different wavelength grids onto a
+common grid, so that they can be analysed by the batch functions.
+
+Spectra are grouped by source grid. The linear interpolation from each
+source grid to the target grid is a sparse matrix with two non-zero
+values per target wavelength, computed once per grid and applied to
+all the spectra of the group with one matrix product.
+"""
+import numpy as np
+import scipy.sparse
+
+from .utils import _GridCache
+
+
+def common_grid(wavelength_grids, num=None):
+    """
+    Return a regular grid covering the range common to all the grids.
+
+    Parameters
+    ----------
+    wavelength_grids : iterable of arrays
+        Wavelength values in nm.
+    num : int, optional
+        Number of wavelengths. The default is the size of the largest grid.
+
+    Raises
+    ------
+    ValueError
+        if the grids do not overlap.
+
+    Returns
+    -------
+    wavelengths : array
+    """
+    grids = [np.asarray(grid, dtype=float) for grid in wavelength_grids]
+    if not grids:
+        raise ValueError('At least one grid is required.')
+    start = max(grid.min() for grid in grids)
+    stop = min(grid.max() for grid in grids)
+    if start >= stop:
+        raise ValueError('The wavelength grids do not overlap.')
+    if num is None:
+        num = max(grid.size for grid in grids)
+    return np.linspace(start, stop, num)
+
+
+class Regridder:
+    """ Resample spectra onto a target wavelength grid.
+
+    Parameters
+    ----------
+    wavelengths : array
+        Target wavelength values in nm.
+    fill_value : scalar, optional
+        Intensity at target wavelengths outside of a source grid.
+        The default is NaN.
+    max_grids : int, optional
+        Number of source grids whose interpolation matrices are memoised.
+
+    Examples
+    --------
+    >>> regridder = Regridder(common_grid([lambdas_a, lambdas_b]))
+    >>> stack = regridder.regrid([(lambdas_a, intensities_a),
+    ...                           (lambdas_b, intensities_b)])
+    >>> results = thickness_batch('fft', regridder.wavelengths, stack, 1.33)
+    """
+    def __init__(self, wavelengths, fill_value=np.nan, max_grids=8):
+        self.wavelengths = np.array(wavelengths, dtype=float)
+        self.wavelengths.flags.writeable = False
+        if self.wavelengths.ndim != 1:
+            raise ValueError('The target wavelengths must be a 1D array.')
+        self.fill_value = fill_value
+        self._cache = _GridCache(max_grids)
+
+    def _operator(self, grid):
+        if grid.ndim != 1 or grid.size < 2:
+            raise ValueError('A source grid must be a 1D array of at least two values.')
+        order = np.argsort(grid, kind='stable')
+        sorted_grid = grid[order]
+        if np.any(np.diff(sorted_grid) == 0):
+            raise ValueError('A source grid must not contain duplicated wavelengths.')
+        target = self.wavelengths
+        inside = np.flatnonzero((target >= sorted_grid[0]) & (target <= sorted_grid[-1]))
+        right = np.searchsorted(sorted_grid, target[inside], side='right').clip(1, grid.size - 1)
+        left = right - 1
+        weight = (target[inside] - sorted_grid[left]) / (sorted_grid[right] - sorted_grid[left])
+        operator = scipy.sparse.csc_matrix(
+            (np.concatenate([1 - weight, weight]),
+             (np.concatenate([order[left], order[right]]), np.concatenate([inside, inside]))),
+            shape=(grid.size, target.size))
+        outside = np.ones(target.size, dtype=bool)
+        outside[inside] = False
+        outside.flags.writeable = False
+        return operator, outside
+
+    def operator(self, wavelengths):
+        """
+        Return the interpolation matrix from the grid `wavelengths`.
+
+        Parameters
+        ----------
+        wavelengths : array
+            Source wavelength values in nm, distinct, in any order.
+
+        Returns
+        -------
+        operator : sparse matrix
+            Matrix of shape (source size, target size), memoised.
+        outside : array
+            Mask of the target wavelengths outside of the source grid.
+        """
+        return self._cache.get(wavelengths, 'operator', self._operator)
+
+    def resample(self, wavelengths, intensities, out=None):
+        """
+        Resample spectra sharing the same grid.
+
+        Parameters
+        ----------
+        wavelengths : array
+            Source wavelength values in nm.
+        intensities : array
+            One spectrum, or a 2D array of spectra (one per row).
+        out : array, optional
+            Array of shape (number of spectra, target size), or
+            (target size,) for one spectrum, receiving the result.
+
+        Returns
+        -------
+        intensities : array
+            Resampled intensities, on `self.wavelengths`.
+        """
+        operator, outside = self.operator(wavelengths)
+        intensities = np.asarray(intensities, dtype=float)
+        if intensities.shape[-1] != operator.shape[0]:
+            raise ValueError('intensities and wavelengths must have the same length.')
+        if out is None:
+            out = np.empty(intensities.shape[:-1] + self.wavelengths.shape)
+        out[...] = intensities @ operator
+        out[..., outside] = self.fill_value
+        return out
+
+    def regrid(self, spectra, out=None):
+        """
+        Resample spectra on various grids, grouped by grid.
+
+        Parameters
+        ----------
+        spectra : iterable
+            Pairs (wavelengths, intensities), intensities being one
+            spectrum or a 2D array of spectra sharing the wavelengths.
+            Passing the spectra of a grid as one 2D array avoids
+            copying them into a stack.
+        out : array, optional
+            Array of shape (number of spectra, target size) receiving
+            the result.
+
+        Returns
+        -------
+        intensities : 2D array
+            Resampled spectra, one per row, in the order of `spectra`.
+        """
+        groups = {}
+        # Grids already seen in this call, by identity, kept alive so
+        # that their identities are not reused
+        seen = {}
+        count = 0
+        for wavelengths, intensities in spectra:
+            intensities = np.atleast_2d(np.asarray(intensities, dtype=float))
+            if id(wavelengths) in seen:
+                operator = seen[id(wavelengths)][1]
+            else:
+                # Equal grids share the same memoised operator
+                operator, _ = self.operator(wavelengths)
+                seen[id(wavelengths)] = (wavelengths, operator)
+            group = groups.setdefault(id(operator), (wavelengths, [], []))
+            group[1].append(intensities)
+            group[2].append((count, count + len(intensities)))
+            count += len(intensities)
+
+        if out is None:
+            out = np.empty((count, self.wavelengths.size))
+        elif out.shape != (count, self.wavelengths.size):
+            raise ValueError(f'out must have the shape {(count, self.wavelengths.size)}.')
+        for wavelengths, stacks, bounds in groups.values():
+            stack = stacks[0] if len(stacks) == 1 else np.concatenate(stacks)
+            if all(stop == next_start for (_, stop), (next_start, _) in zip(bounds, bounds[1:])):
+                # Contiguous rows
+                self.resample(wavelengths, stack, out=out[bounds[0][0]:bounds[-1][1]])
+            else:
+                out[np.concatenate([np.arange(*bound) for bound in bounds])] = \
+                    self.resample(wavelengths, stack)
+        return out
@@ -0,0 +1,413 @@
+"""
+Append-only columnar binary files of thickness results.
+
+A file starts with a header, followed by chunks of at most `chunk_size`
+rows and, once the writer is closed, by a footer indexing the chunks::
+
+    header | chunk 0 | chunk 1 | ... | index | trailer
+
+Each chunk stores the columns of its rows one after the other
+(`COLUMNS`), preceded by its number of rows and the CRC32 of the columns,
+and padded to a multiple of 8 bytes. A chunk written by a flush holds
+only the buffered rows. The position of a chunk follows from the numbers
+of rows of the previous ones. Chunks are written in one piece, so that a
+file interrupted by a crash can be read up to its last complete chunk:
+without a footer, the chunks are scanned and checked with their CRC32.
+
+The reader memory-maps the chunks, so that a column is read from the
+file without any parsing.
+"""
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+
+from .results import STATUS_OK, STATUS_FAILED
+
+
+COLUMNS = (('thickness', '<f8', np.nan),
+           ('thickness_uncertainty', '<f8', np.nan),
+           ('interference_order', '<i8', -1),
+           ('timestamp', '<f8', np.nan),
+           ('status', 'i1', STATUS_OK))
+
+_MAGIC = b'OPTKRES1'
+_CHUNK_MAGIC = b'CHNK'
+_END_MAGIC = b'OPTKEND1'
+_HEADER = struct.Struct('<8sII')  # magic, version, chunk size
+_CHUNK_HEADER = struct.Struct('<4sII4x')  # magic, number of rows, crc
+_TRAILER = struct.Struct('<QQ8s')  # number of chunks, number of rows, magic
+_INDEX_DTYPE = np.dtype([('num_rows', '<u4'), ('crc', '<u4'),
+                         ('timestamp_min', '<f8'), ('timestamp_max', '<f8')])
+# 2: chunks of variable length
+_VERSION = 2
+_ROW_BYTES = sum(np.dtype(dtype).itemsize for _, dtype, _ in COLUMNS)
+
+
+def _payload_size(num_rows):
+    # Columns of a chunk, padded to a multiple of 8 bytes
+    return -(-num_rows * _ROW_BYTES // 8) * 8
+
+
+def _chunk_offsets(num_rows):
+    """
+    Return the file offsets of the chunks and of the end of the last one.
+    """
+    sizes = _CHUNK_HEADER.size + np.array([_payload_size(int(count)) for count in num_rows],
+                                          dtype=np.int64)
+    offsets = np.full(len(sizes) + 1, _HEADER.size, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+    offsets[1:] += _HEADER.size
+    return offsets
+
+
+def _read_layout(fh):
+    """
+    Return (chunk_size, index, complete) of an open result file.
+
+    `index` describes the valid chunks. `complete` is False if the footer
+    is missing, in which case the chunks have been scanned.
+    """
+    fh.seek(0)
+    header = fh.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        raise ValueError('Not a result file: truncated header.')
+    magic, version, chunk_size = _HEADER.unpack(header)
+    if magic != _MAGIC:
+        raise ValueError('Not a result file.')
+    if version != _VERSION:
+        raise ValueError(f'Unsupported version of result file: {version}.')
+    file_size = os.fstat(fh.fileno()).st_size
+
+    # Footer written by `ResultWriter.close`
+    if file_size >= _HEADER.size + _TRAILER.size:
+        fh.seek(file_size - _TRAILER.size)
+        num_chunks, _, end_magic = _TRAILER.unpack(fh.read(_TRAILER.size))
+        index_start = file_size - _TRAILER.size - num_chunks * _INDEX_DTYPE.itemsize
+        if end_magic == _END_MAGIC and index_start >= _HEADER.size:
+            fh.seek(index_start)
+            index = np.frombuffer(fh.read(num_chunks * _INDEX_DTYPE.itemsize),
+                                  dtype=_INDEX_DTYPE).copy()
+            if _chunk_offsets(index['num_rows'])[-1] == index_start:
+                return chunk_size, index, True
+
+    # Interrupted file: keep the complete and valid chunks
+    records = []
+    fh.seek(_HEADER.size)
+    while True:
+        raw = fh.read(_CHUNK_HEADER.size)
+        if len(raw) < _CHUNK_HEADER.size:
+            break
+        chunk_magic, num_rows, crc = _CHUNK_HEADER.unpack(raw)
+        if chunk_magic != _CHUNK_MAGIC or num_rows > chunk_size:
+            break
+        payload = fh.read(_payload_size(num_rows))
+        if len(payload) < _payload_size(num_rows) or zlib.crc32(payload) != crc:
+            break
+        timestamps = _columns_of(payload, num_rows)['timestamp']
+        records.append((num_rows, crc,
+                        np.min(timestamps, initial=np.inf),
+                        np.max(timestamps, initial=-np.inf)))
+    return chunk_size, np.array(records, dtype=_INDEX_DTYPE), False
+
+
+def _columns_of(buffer, num_rows, offset=0):
+    """
+    Return the columns of a chunk as arrays viewing `buffer`.
+    """
+    columns = {}
+    for name, dtype, _ in COLUMNS:
+        columns[name] = np.frombuffer(buffer, dtype=dtype, count=num_rows, offset=offset)
+        offset += columns[name].nbytes
+    return columns
+
+
+class ResultWriter:
+    """ Append results to a columnar binary file.
+
+    Rows are buffered and written by chunks of `chunk_size` rows, or
+    fewer when flushed. If the file exists, new rows are appended after
+    its valid chunks.
+
+    Parameters
+    ----------
+    path : string
+        File path.
+    chunk_size : int, optional
+        Number of rows per chunk, a multiple of 8. Ignored when appending
+        to an existing file. The default is 4096.
+    flush_interval : scalar, optional
+        If given, the buffered rows are written when they are older than
+        this delay in seconds, even if the chunk is not full.
+    fsync : bool, optional
+        Call `os.fsync` after each chunk, so that written chunks survive
+        a power failure. The default is False.
+
+    Notes
+    -----
+    Use the writer as a context manager, or call `close` to write the
+    footer. A file without footer remains readable.
+    """
+    def __init__(self, path, chunk_size=4096, flush_interval=None, fsync=False):
+        if chunk_size <= 0 or chunk_size % 8:
+            raise ValueError('chunk_size must be a positive multiple of 8.')
+        self.path = path
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self._fh = open(path, 'r+b')
+            chunk_size, self._index, _ = _read_layout(self._fh)
+            # Drop the footer and any incomplete chunk
+            self._fh.truncate(_chunk_offsets(self._index['num_rows'])[-1])
+            self._index = list(self._index.tolist())
+        else:
+            self._fh = open(path, 'w+b')
+            self._fh.write(_HEADER.pack(_MAGIC, _VERSION, chunk_size))
+            self._index = []
+        self._fh.seek(0, os.SEEK_END)
+        self.chunk_size = chunk_size
+
+        self._columns = {name: np.empty(chunk_size, dtype=dtype)
+                         for name, dtype, _ in COLUMNS}
+        self._num_buffered = 0
+        self._oldest = None
+        self._clear()
+
+    def _clear(self):
+        for name, _, missing in COLUMNS:
+            self._columns[name][...] = missing
+        self._num_buffered = 0
+        self._oldest = None
+
+    def __len__(self):
+        return sum(record[0] for record in self._index) + self._num_buffered
+
+    def append(self, result, timestamp=None):
+        """
+        Append the result of one spectrum.
+
+        Parameters
+        ----------
+        result : Instance of `OptimizeResult` class.
+            Result of a thickness function.
+        timestamp : scalar, optional
+            Time of the spectrum in seconds since the epoch.
+            The default is the current time.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        thickness = result.thickness
+        status = result.get('status', STATUS_OK if np.isfinite(thickness) else STATUS_FAILED)
+        row = self._num_buffered
+        columns = self._columns
+        columns['thickness'][row] = thickness
+        columns['thickness_uncertainty'][row] = result.get('thickness_uncertainty', np.nan)
+        columns['interference_order'][row] = result.get('interference_order', -1)
+        columns['timestamp'][row] = timestamp
+        columns['status'][row] = status
+        self._rows_added(1)
+
+    def extend(self, results, timestamps=None):
+        """
+        Append the results of several spectra.
+
+        Parameters
+        ----------
+        results : Instance of `optifik.results.BatchResult` class.
+            Results of a batch.
+        timestamps : scalar or array, optional
+            Times of the spectra in seconds since the epoch.
+            The default is the current time.
+        """
+        num_rows = len(results)
+        if timestamps is None:
+            timestamps = time.time()
+        values = {name: getattr(results, name) for name, _, _ in COLUMNS
+                  if name != 'timestamp'}
+        values['timestamp'] = np.broadcast_to(timestamps, (num_rows,))
+        start = 0
+        while start < num_rows:
+            row = self._num_buffered
+            count = min(num_rows - start, self.chunk_size - row)
+            for name, array in values.items():
+                self._columns[name][row:row + count] = array[start:start + count]
+            start += count
+            self._rows_added(count)
+
+    def _rows_added(self, count):
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+        self._num_buffered += count
+        if self._num_buffered == self.chunk_size:
+            self._write_chunk()
+        elif self.flush_interval is not None:
+            self.flush(min_age=self.flush_interval)
+
+    def _write_chunk(self):
+        # Only the buffered rows
+        num_rows = self._num_buffered
+        payload = bytearray(_payload_size(num_rows))
+        offset = 0
+        for name, _, _ in COLUMNS:
+            data = self._columns[name][:num_rows].tobytes()
+            payload[offset:offset + len(data)] = data
+            offset += len(data)
+        crc = zlib.crc32(payload)
+        self._fh.write(_CHUNK_HEADER.pack(_CHUNK_MAGIC, num_rows, crc) + payload)
+        self._fh.flush()
+        if self.fsync:
+            os.fsync(self._fh.fileno())
+        timestamps = self._columns['timestamp'][:num_rows]
+        self._index.append((num_rows, crc, timestamps.min(), timestamps.max()))
+        self._clear()
+
+    def flush(self, min_age=None):
+        """
+        Write the buffered rows, even if the chunk is not full.
+
+        Parameters
+        ----------
+        min_age : scalar, optional
+            Only write the rows if the oldest one was buffered for
+            more than this delay in seconds.
+        """
+        if not self._num_buffered:
+            return
+        if min_age is None or time.monotonic() - self._oldest >= min_age:
+            self._write_chunk()
+
+    def close(self):
+        """
+        Write the buffered rows and the footer, and close the file.
+        """
+        if self._fh.closed:
+            return
+        self.flush()
+        index = np.array(self._index, dtype=_INDEX_DTYPE)
+        self._fh.write(index.tobytes())
+        self._fh.write(_TRAILER.pack(len(index), int(index['num_rows'].sum()), _END_MAGIC))
+        self._fh.flush()
+        if self.fsync:
+            os.fsync(self._fh.fileno())
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ResultReader:
+    """ Read a file written by `ResultWriter`.
+
+    Parameters
+    ----------
+    path : string
+        File path.
+
+    Attributes
+    ----------
+    complete : bool
+        False if the file has no footer (writer still running or
+        interrupted). Only the complete chunks are read.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as fh:
+            self.chunk_size, self._index, self.complete = _read_layout(fh)
+        self.path = path
+        self._offsets = np.zeros(len(self._index) + 1, dtype=np.int64)
+        np.cumsum(self._index['num_rows'], out=self._offsets[1:])
+        self._chunks = []
+        if len(self._index):
+            chunk_offsets = _chunk_offsets(self._index['num_rows'])
+            buffer = np.memmap(path, dtype=np.uint8, mode='r', shape=(chunk_offsets[-1],))
+            self._chunks = [_columns_of(buffer, int(num_rows), offset + _CHUNK_HEADER.size)
+                            for num_rows, offset in zip(self._index['num_rows'],
+                                                        chunk_offsets)]
+
+    def __len__(self):
+        return int(self._offsets[-1])
+
+    @property
+    def columns(self):
+        return [name for name, _, _ in COLUMNS]
+
+    def chunks(self, name):
+        """
+        Return a column as a list of memory-mapped arrays, one per chunk,
+        without copy.
+        """
+        if name not in self.columns:
+            raise KeyError(name)
+        return [chunk[name] for chunk in self._chunks]
+
+    def column(self, name, start=0, stop=None):
+        """
+        Return the rows `start:stop` of a column.
+
+        Only the chunks containing these rows are read, and copied into
+        a contiguous array. Use `chunks` for a view without copy.
+
+        Parameters
+        ----------
+        name : string
+            Column name, see `COLUMNS`.
+        start : int, optional
+            First row.
+        stop : int, optional
+            Last row (excluded). The default is the end of the file.
+
+        Returns
+        -------
+        values : array
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        start = min(max(start, 0), stop)
+        chunks = self.chunks(name)
+        if start == stop:
+            dtype = {column: dtype for column, dtype, _ in COLUMNS}[name]
+            return np.empty(0, dtype=dtype)
+        first = np.searchsorted(self._offsets, start, side='right') - 1
+        last = np.searchsorted(self._offsets, stop, side='left')
+        values = np.concatenate(chunks[first:last])
+        offset = start - self._offsets[first]
+        return values[offset:offset + stop - start]
+
+    def __getitem__(self, name):
+        return self.column(name)
+
+    def rows_between(self, timestamp_start, timestamp_stop):
+        """
+        Return the rows of the chunks overlapping a time interval.
+
+        The footer index is used, so that only the timestamps of these
+        chunks are read.
+
+        Parameters
+        ----------
+        timestamp_start : scalar
+            Start time in seconds since the epoch.
+        timestamp_stop : scalar
+            Stop time in seconds since the epoch.
+
+        Returns
+        -------
+        (start, stop) : tuple of int
+            Row bounds, restricted to the rows within the interval
+            if the timestamps are sorted.
+        """
+        selected = np.flatnonzero((self._index['timestamp_max'] >= timestamp_start)
+                                  & (self._index['timestamp_min'] <= timestamp_stop))
+        if len(selected) == 0:
+            return 0, 0
+        start, stop = self._offsets[selected[0]], self._offsets[selected[-1] + 1]
+        timestamps = self.column('timestamp', start, stop)
+        if np.all(np.diff(timestamps) >= 0):
+            stop = start + np.searchsorted(timestamps, timestamp_stop, side='right')
+            start = start + np.searchsorted(timestamps, timestamp_start, side='left')
+        return int(start), int(stop)
+
@@ -0,0 +1,502 @@
+"""
+Compact storage of the results of many spectra.
+"""
+import numpy as np
+
+from .utils import OptimizeResult
+
+
+STATUS_OK = 0
+STATUS_FAILED = 1
+STATUS_TOO_FEW_PEAKS = 2
+STATUS_NO_EXTREMUM = 3
+STATUS_NO_SINGLE_MAXIMUM = 4
+STATUS_NO_CONVERGENCE = 5
+STATUS_INVALID_INPUT = 6
+
+# Status of each failure reason (see `optifik.metrics.record_failure`)
+FAILURE_STATUS = {
+    'failed': STATUS_FAILED,
+    'too_few_peaks': STATUS_TOO_FEW_PEAKS,
+    'no_extremum': STATUS_NO_EXTREMUM,
+    'no_single_maximum': STATUS_NO_SINGLE_MAXIMUM,
+    'no_convergence': STATUS_NO_CONVERGENCE,
+    'invalid_input': STATUS_INVALID_INPUT,
+}
+FAILURE_REASONS = {status: reason for reason, status in FAILURE_STATUS.items()}
+
+# Scalar fields: (dtype, missing value)
+FIELDS = {
+    'thickness': (np.float64, np.nan),
+    'thickness_uncertainty': (np.float64, np.nan),
+    'interference_order': (np.int64, -1),
+    'num_inliers': (np.int64, -1),
+    'num_outliers': (np.int64, -1),
+    'status': (np.int8, STATUS_OK),
+}
+
+# Ragged fields, stored as concatenated values and offsets
+RAGGED_FIELDS = ('peaks_min', 'peaks_max')
+
+
+def failed_result(reason, message):
+    """
+    Return the result of a failed analysis.
+
+    Parameters
+    ----------
+    reason : string
+        Reason of the failure, a key of `FAILURE_STATUS`
+        (unknown reasons give `STATUS_FAILED`).
+    message : string
+        Description of the failure.
+
+    Returns
+    -------
+    results : Instance of `OptimizeResult` class.
+        The thickness is NaN.
+    """
+    return OptimizeResult(thickness=np.nan,
+                          status=FAILURE_STATUS.get(reason, STATUS_FAILED),
+                          message=message)
+
+
+def _ragged(arrays):
+    """
+    Return (values, offsets) for a list of 1D arrays (or None).
+    """
+    lengths = [0 if array is None else len(array) for array in arrays]
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    values = [array for array in arrays if array is not None and len(array)]
+    values = np.concatenate(values).astype(np.int64) if values else np.empty(0, dtype=np.int64)
+    return values, offsets
+
+
+class BatchResult:
+    """ Results of a stack of spectra, stored in contiguous arrays.
+
+    The scalar fields (`thickness`, `thickness_uncertainty`,
+    `interference_order`, `num_inliers`, `num_outliers` and `status`)
+    are arrays with one value per spectrum. Values not given by a method
+    are NaN for floats and -1 for integers.
+    The status codes are defined in this module (`STATUS_OK` for a
+    success) and `message` (None if no spectrum has one) describes the
+    failures. The peak indices of all spectra are concatenated in
+    `peaks_min_values`, spectrum `i` owning
+    `peaks_min_values[peaks_min_offsets[i]:peaks_min_offsets[i + 1]]`
+    (and similarly for `peaks_max`).
+
+    Indexing returns an `OptimizeResult` with the values of one
+    spectrum, so that a `BatchResult` can be used as a list of results.
+    Missing values are left out, except for the peaks: if any spectrum
+    has peaks, the others get empty arrays.
+
+    Parameters
+    ----------
+    num_spectra : int
+        Number of spectra.
+    **arrays :
+        Initial values of the fields, see `FIELDS`, of `message` and of
+        the ragged buffers `<field>_values` and `<field>_offsets`.
+
+    Attributes
+    ----------
+    timings : dict or None
+        Timings aggregated over all spectra, see
+        `optifik.batch.aggregate_timings`.
+    diagnostics : dict or None
+        Captured `Diagnostics`, by index of spectrum.
+    """
+    def __init__(self, num_spectra, **arrays):
+        for name, (dtype, missing) in FIELDS.items():
+            if name in arrays:
+                value = np.asarray(arrays.pop(name), dtype=dtype)
+            else:
+                value = np.full(num_spectra, missing, dtype=dtype)
+            if value.shape != (num_spectra,):
+                raise ValueError(f'{name} must have {num_spectra} values.')
+            setattr(self, name, value)
+        for name in RAGGED_FIELDS:
+            values = arrays.pop(f'{name}_values', None)
+            offsets = arrays.pop(f'{name}_offsets', None)
+            if offsets is None:
+                values, offsets = None, None
+            setattr(self, f'{name}_values', values)
+            setattr(self, f'{name}_offsets', offsets)
+        self.message = arrays.pop('message', None)
+        self.timings = arrays.pop('timings', None)
+        self.diagnostics = arrays.pop('diagnostics', None)
+        # Per-spectrum timings, kept only when requested
+        self._item_timings = arrays.pop('item_timings', None)
+        if arrays:
+            raise TypeError(f'Unknown fields: {", ".join(arrays)}')
+
+    @classmethod
+    def from_results(cls, results):
+        """
+        Build a `BatchResult` from a list of `OptimizeResult`.
+
+        Parameters
+        ----------
+        results : list
+            Results of the individual spectra.
+
+        Returns
+        -------
+        batch : `BatchResult`
+        """
+        arrays = {}
+        for name, (dtype, missing) in FIELDS.items():
+            arrays[name] = np.fromiter((result.get(name, missing) for result in results),
+                                       dtype=dtype, count=len(results))
+        arrays['status'][~np.isfinite(arrays['thickness'])
+                         & (arrays['status'] == STATUS_OK)] = STATUS_FAILED
+        if any('message' in result for result in results):
+            arrays['message'] = np.array([result.get('message') for result in results],
+                                         dtype=object)
+        for name in RAGGED_FIELDS:
+            if any(name in result for result in results):
+                arrays[f'{name}_values'], arrays[f'{name}_offsets'] = \
+                    _ragged([result.get(name) for result in results])
+        if any('timings' in result for result in results):
+            arrays['item_timings'] = [result.get('timings') for result in results]
+        return cls(len(results), **arrays)
+
+    @classmethod
+    def concatenate(cls, batches):
+        """
+        Join several `BatchResult`, in order.
+
+        Parameters
+        ----------
+        batches : list
+            Instances of `BatchResult`.
+
+        Returns
+        -------
+        batch : `BatchResult`
+        """
+        num_spectra = sum(len(batch) for batch in batches)
+        arrays = {name: np.concatenate([getattr(batch, name) for batch in batches])
+                  if batches else np.empty(0, dtype=dtype)
+                  for name, (dtype, _) in FIELDS.items()}
+        for name in RAGGED_FIELDS:
+            if not any(getattr(batch, f'{name}_offsets') is not None for batch in batches):
+                continue
+            arrays[f'{name}_values'], arrays[f'{name}_offsets'] = \
+                _ragged([array for batch in batches
+                         for array in batch._ragged_items(name)])
+        if any(batch.message is not None for batch in batches):
+            arrays['message'] = np.concatenate([np.full(len(batch), None, dtype=object)
+                                                if batch.message is None else batch.message
+                                                for batch in batches])
+        if any(batch.diagnostics is not None for batch in batches):
+            arrays['diagnostics'] = {}
+            offset = 0
+            for batch in batches:
+                for index, diagnostics in (batch.diagnostics or {}).items():
+                    arrays['diagnostics'][offset + index] = diagnostics
+                offset += len(batch)
+        if any(batch._item_timings is not None for batch in batches):
+            arrays['item_timings'] = [timings for batch in batches
+                                      for timings in (batch._item_timings
+                                                      or [None] * len(batch))]
+        return cls(num_spectra, **arrays)
+
+    def _ragged_items(self, name):
+        values = getattr(self, f'{name}_values')
+        offsets = getattr(self, f'{name}_offsets')
+        if offsets is None:
+            return [None] * len(self)
+        return [values[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+
+    def __len__(self):
+        return len(self.thickness)
+
+    def __getitem__(self, index):
+        num_spectra = len(self)
+        if not -num_spectra <= index < num_spectra:
+            raise IndexError('BatchResult index out of range')
+        index = index % num_spectra
+
+        result = OptimizeResult()
+        for name, (_, missing) in FIELDS.items():
+            value = getattr(self, name)[index]
+            if name == 'thickness' or name == 'status' or not (
+                    value == missing or (np.isnan(missing) and np.isnan(value))):
+                result[name] = value
+        for name in RAGGED_FIELDS:
+            offsets = getattr(self, f'{name}_offsets')
+            if offsets is not None:
+                result[name] = getattr(self, f'{name}_values')[offsets[index]:
+                                                                offsets[index + 1]]
+        if self.message is not None and self.message[index] is not None:
+            result['message'] = self.message[index]
+        if self._item_timings is not None and self._item_timings[index] is not None:
+            result['timings'] = self._item_timings[index]
+        return result
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __repr__(self):
+        num_failed = np.count_nonzero(self.status != STATUS_OK)
+        return f'{self.__class__.__name__}({len(self)} spectra, {num_failed} failed)'
+
+    def to_structured(self):
+        """
+        Return the scalar fields as a structured array.
+
+        Returns
+        -------
+        array : structured array
+            One record per spectrum.
+        """
+        out = np.empty(len(self), dtype=[(name, dtype) for name, (dtype, _) in FIELDS.items()])
+        for name in FIELDS:
+            out[name] = getattr(self, name)
+        return out
+
+    def to_dataframe(self):
+        """
+        Return the scalar fields as a `pandas.DataFrame`.
+
+        Returns
+        -------
+        dataframe : `pandas.DataFrame`
+            One row per spectrum.
+
+        Notes
+        -----
+        Requires pandas.
+        """
+        import pandas as pd
+
+        return pd.DataFrame({name: getattr(self, name) for name in FIELDS})
+
+
+def _compact(array, dtype=np.float32):
+    return None if array is None else np.asarray(array, dtype=dtype)
+
+
+class Diagnostics:
+    """ Intermediate data of the analysis of a spectrum, for later plots.
+
+    Built by `capture` from the data that the `plot=True` option of the
+    methods would plot, without using matplotlib. Arrays are stored in
+    single precision and the FFT only around its peak, so that the
+    diagnostics of many spectra can be kept in memory.
+
+    Parameters
+    ----------
+    method : string
+        Either 'fft', 'minmax' or 'scheludko'.
+    index : int or None
+        Index of the spectrum in its batch.
+    result : Instance of `OptimizeResult` class.
+        Scalar values of the result.
+    wavelengths, intensities : array
+        The analysed spectrum.
+    data : dict or None
+        Arrays and values of the method.
+        'fft': `freqs`, `fft` and `peak_index` around the peak (and their
+        `*_padding` counterparts), `optical_thickness`, `thickness`, `error`.
+        'minmax': `method`, `k_values`, `n_over_lambda`, `inliers`,
+        `slope`, `intercept`, `thickness`, `thickness_err`.
+        'scheludko': `wavelengths`, `refractive_index`, `Delta`,
+        `residuals`, `interference_order`, `fitted_h`, `std_err` and,
+        if the order was scanned, `orders`, `h_curves`, `h_variations`.
+        All methods: `peaks_min` and `peaks_max` if the extrema were
+        detected but are not in the result.
+        If the analysis failed, only the values computed before the
+        failure, or None.
+    """
+    def __init__(self, method, index, result, wavelengths, intensities, data):
+        self.method = method
+        self.index = index
+        self.result = result
+        self.wavelengths = wavelengths
+        self.intensities = intensities
+        self.data = data
+
+    @classmethod
+    def capture(cls, method, wavelengths, intensities, result, plot_data,
+                index=None, fft_window=64):
+        """
+        Build the diagnostics of an analysis.
+
+        Parameters
+        ----------
+        method : string
+            Either 'fft', 'minmax' or 'scheludko'.
+        wavelengths : array
+            Wavelength values in nm.
+        intensities : array
+            Intensity values.
+        result : Instance of `OptimizeResult` class.
+            Result of the analysis.
+        plot_data : dict or None
+            Data returned by the core function of the method,
+            possibly partial.
+        index : int, optional
+            Index of the spectrum in its batch.
+        fft_window : int, optional
+            Number of FFT values kept on each side of the peak.
+
+        Returns
+        -------
+        diagnostics : `Diagnostics`
+        """
+        method = method.lower()
+        scalars = OptimizeResult({key: value for key, value in result.items()
+                                  if key not in ('timings', 'diagnostics')})
+        data = None
+        if plot_data:
+            plot_data = dict(plot_data)
+            extrema = plot_data.pop('extrema', None)
+            data = getattr(cls, f'_capture_{method}')(fft_window=fft_window, **plot_data)
+            if extrema is not None:
+                data.update(peaks_min=_compact(extrema[2], np.int32),
+                            peaks_max=_compact(extrema[3], np.int32))
+        return cls(method, index, scalars, _compact(wavelengths), _compact(intensities), data)
+
+    @staticmethod
+    def _capture_fft(positive_freqs, positive_fft, peak_index,
+                     optical_thickness, thickness, error,
+                     positive_freqs_padding=None,
+                     positive_fft_padding=None,
+                     peak_index_padding=None, fft_window=64):
+        start = max(peak_index - fft_window, 0)
+        stop = peak_index + fft_window + 1
+        return dict(freqs=_compact(positive_freqs[start:stop]),
+                    fft=_compact(positive_fft[start:stop]),
+                    peak_index=peak_index - start,
+                    freqs_padding=_compact(positive_freqs_padding),
+                    fft_padding=_compact(positive_fft_padding),
+                    peak_index_padding=peak_index_padding,
+                    optical_thickness=optical_thickness,
+                    thickness=thickness,
+                    error=error)
+
+    @staticmethod
+    def _capture_minmax(method=None, k_values=None, n_over_lambda=None,
+                        thickness=None, thickness_err=None,
+                        inliers=None, model=None, slope=None, intercept=None,
+                        fft_window=None):
+        if k_values is None:
+            # No fit
+            return {}
+        if model is not None:
+            # The line only, not the fitted estimator
+            slope = model.estimator_.coef_[0]
+            intercept = model.estimator_.intercept_
+        return dict(method=method,
+                    k_values=_compact(k_values),
+                    n_over_lambda=np.asarray(n_over_lambda),
+                    inliers=inliers,
+                    slope=slope,
+                    intercept=intercept,
+                    thickness=thickness,
+                    thickness_err=thickness_err)
+
+    @staticmethod
+    def _capture_scheludko(wavelengths_masked=None, r_index_masked=None,
+                           Delta_from_data=None, interference_order=None,
+                           fitted_h=None, std_err=None,
+                           order_scan=None, fft_window=None):
+        from .scheludko import _Delta
+
+        data = {}
+        if wavelengths_masked is not None:
+            data.update(wavelengths=_compact(wavelengths_masked),
+                        refractive_index=_compact(r_index_masked),
+                        Delta=_compact(Delta_from_data),
+                        interference_order=interference_order)
+        if fitted_h is not None:
+            fit = _Delta(wavelengths_masked, fitted_h, interference_order, r_index_masked)
+            data.update(residuals=_compact(Delta_from_data - fit),
+                        fitted_h=fitted_h,
+                        std_err=std_err)
+        if order_scan is not None:
+            orders, h_curves, variations = zip(*order_scan)
+            data.update(orders=np.array(orders, dtype=np.int16),
+                        h_curves=_compact(np.array(h_curves)),
+                        h_variations=np.array(variations))
+        return data
+
+    @property
+    def nbytes(self):
+        """Size of the stored arrays in bytes."""
+        arrays = [self.wavelengths, self.intensities, *(self.data or {}).values()]
+        return sum(array.nbytes for array in arrays if isinstance(array, np.ndarray))
+
+    def plot_data(self):
+        """
+        Return the data in the format of the core function of the method.
+
+        Returns
+        -------
+        plot_data : dict or None
+            Partial if the analysis failed, None if no data was computed.
+        """
+        if self.data is None:
+            return None
+        data = dict(self.data)
+        plot_data = {}
+        if 'peaks_min' in data:
+            plot_data['extrema'] = (self.wavelengths, self.intensities,
+                                    data.pop('peaks_min'), data.pop('peaks_max'))
+        if self.method == 'fft':
+            plot_data.update(positive_freqs=data['freqs'],
+                             positive_fft=data['fft'],
+                             peak_index=data['peak_index'],
+                             positive_freqs_padding=data['freqs_padding'],
+                             positive_fft_padding=data['fft_padding'],
+                             peak_index_padding=data['peak_index_padding'],
+                             optical_thickness=data['optical_thickness'],
+                             thickness=data['thickness'],
+                             error=data['error'])
+        elif self.method == 'minmax':
+            plot_data.update(data)
+        else:
+            names = dict(wavelengths='wavelengths_masked',
+                         refractive_index='r_index_masked',
+                         Delta='Delta_from_data',
+                         interference_order='interference_order',
+                         fitted_h='fitted_h',
+                         std_err='std_err')
+            plot_data.update({names[key]: value for key, value in data.items()
+                              if key in names})
+            if 'orders' in data:
+                plot_data['order_scan'] = list(zip(data['orders'], data['h_curves'],
+                                                   data['h_variations']))
+        return plot_data
+
+    def render(self, path=None, figure=None, dpi=100):
+        """
+        Plot the diagnostics.
+
+        Parameters
+        ----------
+        path : string, optional
+            If given, the figure is saved to this file.
+        figure : Instance of `optifik.diagnostics.DiagnosticFigure`, optional
+            Figure to reuse. By default, a new figure is created.
+        dpi : scalar, optional
+            Resolution of a new figure.
+
+        Returns
+        -------
+        figure : Instance of `optifik.diagnostics.DiagnosticFigure`
+        """
+        from .diagnostics import DiagnosticFigure
+
+        if figure is None:
+            figure = DiagnosticFigure(self.method, dpi=dpi)
+        figure.draw(self.index, self.wavelengths, self.intensities, self.result,
+                    self.plot_data())
+        if path is not None:
+            figure.figure.savefig(path)
+        return figure
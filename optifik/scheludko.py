@@ -2,18 +2,21 @@ import numpy as np
 from scipy.optimize import curve_fit
 
 from functools import partial
-import inspect
-import matplotlib.pyplot as plt
 
-from .utils import OptimizeResult, setup_matplotlib, round_to_uncertainty
-from .analysis import finds_peak
+from .utils import OptimizeResult, setup_matplotlib, round_to_uncertainty, stage_timer
+from .metrics import instrumented, handle_failure, tag_failure
+from .results import STATUS_OK
+from .analysis import _find_extrema, _plot_extrema
+from .dispersion import RefractiveIndex, _alpha
+from .reference import ReferenceSpectrum
 
 
 def _thicknesses_scheludko_at_order(wavelengths,
                                     intensities,
                                     interference_order,
                                     refractive_index,
-                                    intensities_void=None):
+                                    intensities_void=None,
+                                    alpha=None):
     """
     Compute thicknesses vs wavelength for a given interference order.
 
@@ -29,6 +32,8 @@ def _thicknesses_scheludko_at_order(wavelengths,
         Refractive index.
     intensities_void : array, optional
         Intensities of void.
+    alpha : array, optional
+        Precomputed :math:`(n^2-1)^2 / 4n^2`.
 
     Returns
     -------
@@ -42,10 +47,12 @@ def _thicknesses_scheludko_at_order(wavelengths,
 
     n = refractive_index
     m = interference_order
+    if alpha is None:
+        alpha = _alpha(n)
     I_norm = (np.asarray(intensities) - Imin) / (np.max(intensities) - Imin)
 
     prefactor = wavelengths / (2 * np.pi * n)
-    argument = np.sqrt(I_norm / (1 + (1 - I_norm) * (n**2 - 1)**2 / (4 * n**2)))
+    argument = np.sqrt(I_norm / (1 + (1 - I_norm) * alpha))
 
     if m % 2 == 0:
         term1 = (m / 2) * np.pi
@@ -57,7 +64,7 @@ def _thicknesses_scheludko_at_order(wavelengths,
     return prefactor * (term1 + term2)
 
 
-def _Delta(wavelengths, thickness, interference_order, refractive_index):
+def _Delta(wavelengths, thickness, interference_order, refractive_index, alpha=None):
     """
     Compute the Delta values.
 
@@ -71,6 +78,8 @@ def _Delta(wavelengths, thickness, interference_order, refractive_index):
         Interference order.
     refractive_index : array_like (or float)
         Refractive index.
+    alpha : array_like, optional
+        Precomputed :math:`(n^2-1)^2 / 4n^2`.
 
     Returns
     -------
@@ -91,7 +100,8 @@ def _Delta(wavelengths, thickness, interference_order, refractive_index):
         p = (m + 1) / 2
 
     # Calculation of alpha
-    alpha = ((n**2 - 1)**2) / (4 * n**2)
+    if alpha is None:
+        alpha = _alpha(n)
 
     # Argument of sinus
     angle = (2 * np.pi * n * h / wavelengths) - p * np.pi
@@ -103,55 +113,30 @@ def _Delta(wavelengths, thickness, interference_order, refractive_index):
     return (A * (1 + alpha)) / (1 + A * alpha)
 
 
-def get_default_start_stop_wavelengths(wavelengths,
-                                       intensities,
-                                       refractive_index,
-                                       min_peak_prominence,
-                                       plot=None):
+def _missing_extrema_message(idx_peaks_min, idx_peaks_max):
     """
-    Returns the start and stop wavelength values of the last monotonic branch.
+    Returns the description of the missing extrema, or an empty string.
+    """
+    message = ''
+    if len(idx_peaks_min) == 0:
+        message += 'Failed to detect at least one minimum. '
+    if len(idx_peaks_max) == 0:
+        message += 'Failed to detect at least one maximum. '
+    return message
 
-    Parameters
-    ----------
-    wavelengths : array
-        Wavelength values in nm.
-    intensities : array
-        Intensity values.
-    refractive_index : scalar or array
-        Value of the refractive index of the medium.
-    min_peak_prominence : scalar
-        Required prominence of peaks.
-    plot : bool, optional
-        Display a curve, useful for checking or debuging. The default is None.
 
+def _start_stop_from_extrema(wavelengths, idx_peaks_min, idx_peaks_max):
+    """
+    Returns the start and stop wavelengths from detected extrema.
 
     Raises
     ------
     RuntimeError
         if at least one maximum and one minimum are not detected.
-
-    Returns
-    -------
-    wavelength_start : scalar
-    wavelength_stop : scalar
     """
-    if isinstance(refractive_index, (float, int)):
-        refractive_index = np.full_like(wavelengths,  refractive_index)
-
-    # idx_min idx max
-    idx_peaks_min, idx_peaks_max = finds_peak(wavelengths, intensities,
-                                              min_peak_prominence=min_peak_prominence,
-                                              plot=plot)
-
-    failure, message = False, ''
-    if len(idx_peaks_min) == 0:
-        message += 'Failed to detect at least one minimum. '
-        failure = True
-    if len(idx_peaks_max) == 0:
-        message += 'Failed to detect at least one maximum. '
-        failure = True
-    if failure:
-        raise RuntimeError(message)
+    message = _missing_extrema_message(idx_peaks_min, idx_peaks_max)
+    if message:
+        raise tag_failure(RuntimeError(message), 'no_extremum')
 
     # Get the last oscillation peaks
     lambda_min = wavelengths[idx_peaks_min[-1]]
@@ -164,17 +149,14 @@ def get_default_start_stop_wavelengths(wavelengths,
     return wavelength_start, wavelength_stop
 
 
-def thickness_from_scheludko(wavelengths,
-                             intensities,
-                             refractive_index,
-                             wavelength_start=None,
-                             wavelength_stop=None,
-                             interference_order=None,
-                             max_order_tested=8,
-                             intensities_void=None,
-                             plot=None):
+def get_default_start_stop_wavelengths(wavelengths,
+                                       intensities,
+                                       refractive_index,
+                                       min_peak_prominence,
+                                       plot=None,
+                                       errors='raise'):
     """
-    Compute the film thickness based on Scheludko method.
+    Returns the start and stop wavelength values of the last monotonic branch.
 
     Parameters
     ----------
@@ -182,59 +164,125 @@ def thickness_from_scheludko(wavelengths,
         Wavelength values in nm.
     intensities : array
         Intensity values.
-    refractive_index : scalar or array
-        Value of the refractive index of the medium.
-    wavelength_start : scalar, optional
-        Starting value of a monotonic branch.
-        Mandatory if interference_order != 0.
-    wavelength_stop : scalar, optional
-        Stoping value of a monotonic branch.
-        Mandatory if interference_order != 0.
-    interference_order : scalar, optional
-        Interference order, zero or positive integer.
-        If set to None, the value is guessed.
-    max_order_tested : int, optional
-        Maximum order tested if interference_order is `None'.
-        The default is 8.
-    intensities_void : array, optional
-        Intensity in absence of a film.
-        Mandatory if interference_order == 0.
+    refractive_index : scalar, array or `optifik.dispersion.RefractiveIndex`
+        Value of the refractive index of the medium, or its model.
+    min_peak_prominence : scalar
+        Required prominence of peaks.
     plot : bool, optional
         Display a curve, useful for checking or debuging. The default is None.
+    errors : string, optional
+        With 'raise' (default), missing extrema raise an exception.
+        With 'coerce', NaN values are returned instead, which
+        `thickness_from_scheludko` reports as a 'no_extremum' failure.
+
+
+    Raises
+    ------
+    RuntimeError
+        if at least one maximum and one minimum are not detected,
+        with `errors='raise'`.
 
     Returns
     -------
-    results : Instance of `OptimizeResult` class.
-        The attribute `thickness` gives the thickness value in nm.
+    wavelength_start : scalar
+    wavelength_stop : scalar
+    """
+    if errors not in ('raise', 'coerce'):
+        raise ValueError(f'Wrong value for `errors`: {errors}')
+    # idx_min idx max
+    idx_peaks_min, idx_peaks_max = _find_extrema(intensities,
+                                                 min_peak_prominence=min_peak_prominence)
+    if plot:
+        _plot_extrema(wavelengths, intensities, idx_peaks_min, idx_peaks_max)
+
+    if errors == 'coerce' and _missing_extrema_message(idx_peaks_min, idx_peaks_max):
+        # Counted by the analysis receiving the NaN values
+        return np.nan, np.nan
+    return _start_stop_from_extrema(wavelengths, idx_peaks_min, idx_peaks_max)
+
+
+@instrumented('scheludko')
+def _scheludko_core(wavelengths,
+                    intensities,
+                    refractive_index,
+                    wavelength_start=None,
+                    wavelength_stop=None,
+                    interference_order=None,
+                    max_order_tested=8,
+                    intensities_void=None,
+                    timings=False,
+                    errors='raise',
+                    extrema=None):
+    """
+    Compute the film thickness based on Scheludko method, without plotting.
+
+    See `thickness_from_scheludko` for the parameters. If `extrema`
+    (indices of the minima and of the maxima) is given, missing
+    `wavelength_start` and `wavelength_stop` are computed from it as in
+    `get_default_start_stop_wavelengths`, and missing extrema are
+    counted as a failure of the analysis.
 
+    Returns
+    -------
+    results : Instance of `OptimizeResult` class.
+    plot_data : dict or None
+        Intermediate data required by `_plot_scheludko`. If the analysis
+        failed with `errors='coerce'`, the data computed before the
+        failure (`extrema`, `order_scan`, the data to fit), or `None`.
     """
-    if isinstance(refractive_index, (float, int)):
-        refractive_index = np.full_like(wavelengths,  refractive_index)
-    r_index = refractive_index
+    timer = stage_timer(timings)
 
-    if plot:
-        setup_matplotlib()
+    if isinstance(refractive_index, RefractiveIndex):
+        r_index = refractive_index(wavelengths)
+        alpha = refractive_index.alpha(wavelengths)
+    else:
+        r_index = np.broadcast_to(np.asarray(refractive_index, dtype=float),
+                                  np.shape(wavelengths))
+        alpha = None
+
+    plot_data = {}
+    void_minimum = None
 
     if interference_order is None or interference_order > 0:
+        if extrema is not None and (wavelength_stop is None or wavelength_start is None):
+            peaks_min, peaks_max = extrema
+            plot_data['extrema'] = (wavelengths, intensities, peaks_min, peaks_max)
+            message = _missing_extrema_message(peaks_min, peaks_max)
+            if message:
+                return handle_failure(RuntimeError(message), 'no_extremum', errors, plot_data)
+            wavelength_start, wavelength_stop = _start_stop_from_extrema(wavelengths,
+                                                                         peaks_min, peaks_max)
+
         if wavelength_stop is None or wavelength_start is None:
-            raise ValueError('wavelength_start and wavelength_stop must be passed for interference_order != 0.')
+            return handle_failure(ValueError('wavelength_start and wavelength_stop must be passed for interference_order != 0.'),
+                                  'invalid_input', errors)
+        elif np.isnan(wavelength_start) or np.isnan(wavelength_stop):
+            # See `get_default_start_stop_wavelengths` with errors='coerce'
+            return handle_failure(RuntimeError('wavelength_start or wavelength_stop is NaN: the extrema were not detected.'),
+                                  'no_extremum', errors)
         else:
             if wavelength_start > wavelength_stop:
-                raise ValueError('wavelength_start and wavelength_stop are swapped.')
+                return handle_failure(ValueError('wavelength_start and wavelength_stop are swapped.'),
+                                      'invalid_input', errors)
 
     # Mask the input data
     if interference_order is None or interference_order > 0:
         mask = (wavelengths >= wavelength_start) & (wavelengths <= wavelength_stop)
         wavelengths_masked = wavelengths[mask]
         r_index_masked = r_index[mask]
+        alpha_masked = _alpha(r_index_masked) if alpha is None else alpha[mask]
         intensities_masked = intensities[mask]
     elif interference_order == 0:
+        if intensities_void is None:
+            return handle_failure(ValueError('intensities_void must be passed for interference_order == 0.'),
+                                  'invalid_input', errors)
         min_peak_prominence = 0.02
-        peaks_min, peaks_max = finds_peak(wavelengths, intensities,
-                                          min_peak_prominence=min_peak_prominence,
-                                          plot=plot)
+        peaks_min, peaks_max = _find_extrema(intensities,
+                                             min_peak_prominence=min_peak_prominence)
+        plot_data['extrema'] = (wavelengths, intensities, peaks_min, peaks_max)
         if len(peaks_max) != 1:
-            raise RuntimeError('Failed to detect a single maximum peak.')
+            return handle_failure(RuntimeError('Failed to detect a single maximum peak.'),
+                                  'no_single_maximum', errors, plot_data)
 
         lambda_unique = wavelengths[peaks_max[0]]
 
@@ -242,30 +290,33 @@ def thickness_from_scheludko(wavelengths,
         mask = wavelengths >= lambda_unique
         wavelengths_masked = wavelengths[mask]
         r_index_masked = r_index[mask]
+        alpha_masked = _alpha(r_index_masked) if alpha is None else alpha[mask]
         intensities_masked = intensities[mask]
+        if isinstance(intensities_void, ReferenceSpectrum):
+            void_minimum = intensities_void.minimum_from(wavelengths, lambda_unique)
+            intensities_void = intensities_void.resample(wavelengths)
         intensities_void_masked = intensities_void[mask]
+        if void_minimum is None:
+            void_minimum = np.min(intensities_void_masked)
     else:
-        raise ValueError('Wrong value for `interference_order`.')
+        return handle_failure(ValueError('Wrong value for `interference_order`.'),
+                              'invalid_input', errors)
+    timer.lap('masking')
 
     # Find the thicknesses vs lambda
     if interference_order is None:
-        if plot:
-            plt.figure()
-            plt.ylabel(r'$h$ $[\mathrm{{nm}}]$')
-            plt.xlabel(r'$\lambda$ $[\mathrm{nm}]$')
-
+        order_scan = []
         min_difference = np.inf
         thickness_values = None
         for _order in range(0, max_order_tested+1):
             h_values = _thicknesses_scheludko_at_order(wavelengths_masked,
                                                        intensities_masked,
                                                        _order,
-                                                       r_index_masked)
+                                                       r_index_masked,
+                                                       alpha=alpha_masked)
 
             difference = np.max(h_values) - np.min(h_values)
-
-            # Put this in a logger eventually
-            #print(f"h-difference for m={_order}: {difference:.1f} nm")
+            order_scan.append((_order, h_values, difference))
 
             # Keep the order that minimizes the range of h_values
             if difference < min_difference:
@@ -273,68 +324,179 @@ def thickness_from_scheludko(wavelengths,
                 interference_order = _order
                 thickness_values = h_values
 
-            if plot:
-                plt.plot(wavelengths_masked, h_values, 'o-',
-                         markersize=3,
-                         label=f"Order={_order}, $h$-variation={difference:.1f} nm")
-                plt.legend()
-                plt.title(f'Func Call: {inspect.currentframe().f_code.co_name}()')
+        plot_data['order_scan'] = order_scan
 
     elif interference_order == 0:
         thickness_values = _thicknesses_scheludko_at_order(wavelengths_masked,
                                                            intensities_masked,
                                                            interference_order,
                                                            r_index_masked,
-                                                           intensities_void=intensities_void_masked)
+                                                           intensities_void=intensities_void_masked,
+                                                           alpha=alpha_masked)
 
     elif interference_order > 0:
         thickness_values = _thicknesses_scheludko_at_order(wavelengths_masked,
                                                    intensities_masked,
                                                    interference_order,
-                                                   r_index_masked)
-
+                                                   r_index_masked,
+                                                   alpha=alpha_masked)
+    timer.lap('order_scan')
 
     # Compute the thickness for the selected order
-    if interference_order == 0:
-        num = intensities_masked - np.min(intensities_void_masked)
-        denom = np.max(intensities_masked) - np.min(intensities_void_masked)
+    if void_minimum is not None:
+        # Order 0 with the intensities in absence of film; a guessed
+        # order 0 is normalised without them, as in the order scan
+        num = intensities_masked - void_minimum
+        denom = np.max(intensities_masked) - void_minimum
     else:
         num = intensities_masked - np.min(intensities_masked)
         denom = np.max(intensities_masked) - np.min(intensities_masked)
 
     Delta_from_data = num / denom
+    plot_data.update(wavelengths_masked=wavelengths_masked,
+                     r_index_masked=r_index_masked,
+                     Delta_from_data=Delta_from_data,
+                     interference_order=interference_order)
 
     _Delta_fit = partial(_Delta,
                          interference_order=interference_order,
-                         refractive_index=r_index_masked)
-
-    popt, pcov = curve_fit(_Delta_fit,
-                           wavelengths_masked,
-                           Delta_from_data,
-                           p0=[np.mean(thickness_values),])
+                         refractive_index=r_index_masked,
+                         alpha=alpha_masked)
+
+    try:
+        popt, pcov = curve_fit(_Delta_fit,
+                               wavelengths_masked,
+                               Delta_from_data,
+                               p0=[np.mean(thickness_values),])
+    except RuntimeError as err:
+        # curve_fit did not converge
+        return handle_failure(err, 'no_convergence', errors, plot_data)
     fitted_h = popt[0]
     std_err = np.sqrt(pcov[0][0])
+    timer.lap('curve_fit')
 
-    if plot:
-        Delta_values = _Delta(wavelengths_masked, fitted_h, interference_order, r_index_masked)
+    plot_data.update(fitted_h=fitted_h, std_err=std_err)
+
+    result = OptimizeResult(thickness=fitted_h,
+                            thickness_uncertainty=std_err,
+                            interference_order=interference_order)
+    if timings:
+        result.timings = timer.results()
+    return result, plot_data
 
-        plt.figure()
-        plt.plot(wavelengths_masked, Delta_from_data,
-                 'bo-', markersize=2,
-                 label=r'$\mathrm{{Smoothed}}\ \mathrm{{data}}$')
 
-        # Fit
-        val, err = round_to_uncertainty(fitted_h, std_err)
-        label = rf'$h = {val} \pm {err}\ \mathrm{{nm}}$'
-        plt.plot(wavelengths_masked,  Delta_values,
-                 'ro-', markersize=2,
-                 label=label)
+def _plot_scheludko(wavelengths_masked, r_index_masked, Delta_from_data,
+                    interference_order, fitted_h, std_err,
+                    extrema=None, order_scan=None):
+    """
+    Plot the order guess and the fit of `thickness_from_scheludko`.
+    """
+    import matplotlib.pyplot as plt
 
+    setup_matplotlib()
+
+    if extrema is not None:
+        _plot_extrema(*extrema)
+
+    if order_scan is not None:
+        plt.figure()
+        plt.ylabel(r'$h$ $[\mathrm{{nm}}]$')
+        plt.xlabel(r'$\lambda$ $[\mathrm{nm}]$')
+        for _order, h_values, difference in order_scan:
+            plt.plot(wavelengths_masked, h_values, 'o-',
+                     markersize=3,
+                     label=f"Order={_order}, $h$-variation={difference:.1f} nm")
         plt.legend()
-        plt.ylabel(r'$\Delta$')
-        plt.xlabel(r'$\lambda$ $[\mathrm{{nm}}]$')
-        plt.title(f'Func Call: {inspect.currentframe().f_code.co_name}()')
+        plt.title('Func Call: thickness_from_scheludko()')
+
+    Delta_values = _Delta(wavelengths_masked, fitted_h, interference_order, r_index_masked)
+
+    plt.figure()
+    plt.plot(wavelengths_masked, Delta_from_data,
+             'bo-', markersize=2,
+             label=r'$\mathrm{{Smoothed}}\ \mathrm{{data}}$')
+
+    # Fit
+    val, err = round_to_uncertainty(fitted_h, std_err)
+    label = rf'$h = {val} \pm {err}\ \mathrm{{nm}}$'
+    plt.plot(wavelengths_masked,  Delta_values,
+             'ro-', markersize=2,
+             label=label)
+
+    plt.legend()
+    plt.ylabel(r'$\Delta$')
+    plt.xlabel(r'$\lambda$ $[\mathrm{{nm}}]$')
+    plt.title('Func Call: thickness_from_scheludko()')
+
+
+def thickness_from_scheludko(wavelengths,
+                             intensities,
+                             refractive_index,
+                             wavelength_start=None,
+                             wavelength_stop=None,
+                             interference_order=None,
+                             max_order_tested=8,
+                             intensities_void=None,
+                             plot=None,
+                             timings=False,
+                             errors='raise'):
+    """
+    Compute the film thickness based on Scheludko method.
 
-    return OptimizeResult(thickness=fitted_h,
-                          thickness_uncertainty=std_err,
-                          interference_order=interference_order)
+    Parameters
+    ----------
+    wavelengths : array
+        Wavelength values in nm.
+    intensities : array
+        Intensity values.
+    refractive_index : scalar, array or `optifik.dispersion.RefractiveIndex`
+        Value of the refractive index of the medium, or its model.
+    wavelength_start : scalar, optional
+        Starting value of a monotonic branch.
+        Mandatory if interference_order != 0.
+    wavelength_stop : scalar, optional
+        Stoping value of a monotonic branch.
+        Mandatory if interference_order != 0.
+    interference_order : scalar, optional
+        Interference order, zero or positive integer.
+        If set to None, the value is guessed.
+    max_order_tested : int, optional
+        Maximum order tested if interference_order is `None'.
+        The default is 8.
+    intensities_void : array or `optifik.reference.ReferenceSpectrum`, optional
+        Intensity in absence of a film, on `wavelengths`, or a reference
+        spectrum resampled on `wavelengths`.
+        Mandatory if interference_order == 0.
+    plot : bool, optional
+        Display a curve, useful for checking or debuging. The default is None.
+    timings : bool, optional
+        Record the duration and the allocations of the stages
+        'masking', 'order_scan' and 'curve_fit' in the attribute
+        `timings` of the results, see `StageTimer.results`.
+    errors : string, optional
+        With 'raise' (default), failures raise an exception.
+        With 'coerce', failures are only reported in the results.
+
+    Returns
+    -------
+    results : Instance of `OptimizeResult` class.
+        The attribute `thickness` gives the thickness value in nm.
+        If the analysis failed, the thickness is NaN and the attributes
+        `status` and `message` describe the failure
+        (see `optifik.results`).
+
+    """
+    result, plot_data = _scheludko_core(wavelengths,
+                                        intensities,
+                                        refractive_index,
+                                        wavelength_start=wavelength_start,
+                                        wavelength_stop=wavelength_stop,
+                                        interference_order=interference_order,
+                                        max_order_tested=max_order_tested,
+                                        intensities_void=intensities_void,
+                                        timings=timings,
+                                        errors=errors)
+    if plot and result.get('status', STATUS_OK) == STATUS_OK:
+        _plot_scheludko(**plot_data)
+
+    return result
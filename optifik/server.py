@@ -0,0 +1,337 @@
+"""
+asyncio server analysing spectra streamed over TCP.
+
+Each request frame is made of a header (little-endian `uint64` frame
+identifier, `uint32` number of points `N`) followed by `N` `float64`
+wavelengths and `N` `float64` intensities.
+
+For each request, in the same order, the server sends back a frame
+(`uint64` frame identifier, `int32` status, `float64` thickness,
+`float64` thickness uncertainty, `float64` latency in seconds).
+The status is a code of `optifik.results`: `STATUS_OK` (0) on success,
+the reason of the failure otherwise. A frame of more than `max_points`
+points is answered with `STATUS_INVALID_INPUT`, without reading its
+data, and the connection is closed.
+"""
+import argparse
+import asyncio
+import collections
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .utils import OptimizeResult
+from .results import STATUS_OK, STATUS_FAILED, STATUS_INVALID_INPUT
+from .batch import analyse_spectrum
+from .dispersion import RefractiveIndex
+from .synthetic import reflectance, wavelength_grid
+
+
+REQUEST_HEADER = struct.Struct('<QI')
+RESPONSE = struct.Struct('<Qiddd')
+
+
+def encode_request(frame_id, wavelengths, intensities):
+    """
+    Return the bytes of a request frame.
+    """
+    wavelengths = np.asarray(wavelengths, dtype='<f8')
+    intensities = np.asarray(intensities, dtype='<f8')
+    if wavelengths.shape != intensities.shape or wavelengths.ndim != 1:
+        raise ValueError('wavelengths and intensities must be 1D arrays of same size.')
+    return (REQUEST_HEADER.pack(frame_id, len(wavelengths))
+            + wavelengths.tobytes() + intensities.tobytes())
+
+
+class SpectrumServer:
+    """
+    Analyse spectra sent by clients over TCP.
+
+    Parameters
+    ----------
+    method : string
+        Either 'fft', 'minmax' or 'scheludko'.
+    refractive_index : scalar, array, `optifik.dispersion.RefractiveIndex` or callable
+        Value of the refractive index of the medium, or its model, whose
+        values are memoised on the wavelength grids of the frames.
+        Another callable is evaluated on the wavelengths of each frame.
+    max_workers : int, optional
+        Number of threads computing the thicknesses.
+    queue_size : int, optional
+        Maximum number of frames in flight per client. When it is reached,
+        the server stops reading from the client, which is slowed down
+        by TCP flow control. The default is 64.
+    max_points : int, optional
+        Maximum number of points of a frame. Larger frames are rejected
+        and the connection is closed. The default is 100 000.
+    executor : `concurrent.futures.Executor`, optional
+        Executor computing the thicknesses. If given, `max_workers`
+        is ignored and the executor is not shut down by `close`.
+    **kwargs :
+        Extra parameters passed to the method, see `analyse_spectrum`.
+    """
+    def __init__(self, method, refractive_index, /, max_workers=None,
+                 queue_size=64, max_points=100_000, executor=None, **kwargs):
+        self.method = method
+        self.refractive_index = refractive_index
+        self.queue_size = queue_size
+        self.max_points = max_points
+        # Failures are reported in the results, with their status
+        self.kwargs = {'errors': 'coerce', **kwargs}
+        self._own_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(max_workers=max_workers)
+        self._server = None
+        self._clients = set()
+        self._latencies = collections.deque(maxlen=100_000)
+        self._num_frames = 0
+        self._num_failures = 0
+        self._start_time = None
+
+    def _compute(self, wavelengths, intensities):
+        if callable(self.refractive_index) and \
+                not isinstance(self.refractive_index, RefractiveIndex):
+            refractive_index = self.refractive_index(wavelengths)
+        else:
+            refractive_index = self.refractive_index
+        return analyse_spectrum(self.method, wavelengths, intensities,
+                                refractive_index, **self.kwargs)
+
+    async def start(self, host='127.0.0.1', port=0):
+        """
+        Start listening.
+
+        Returns
+        -------
+        (host, port) : the address of the server.
+        """
+        self._server = await asyncio.start_server(self._handle_client, host, port)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def close(self, timeout=1.):
+        """
+        Stop the server.
+
+        Parameters
+        ----------
+        timeout : scalar, optional
+            Delay in seconds given to the connected clients to finish,
+            before their connections are cancelled.
+        """
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._clients:
+            _, running = await asyncio.wait(self._clients, timeout=timeout)
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+        if self._own_executor:
+            self.executor.shutdown(wait=False)
+
+    async def _read_frames(self, reader, pending):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                header = await reader.readexactly(REQUEST_HEADER.size)
+                frame_id, num_points = REQUEST_HEADER.unpack(header)
+                if num_points > self.max_points:
+                    # The payload is not read: answer and stop
+                    await pending.put((frame_id, time.perf_counter(), None))
+                    break
+                payload = await reader.readexactly(16 * num_points)
+                received = time.perf_counter()
+                if self._start_time is None:
+                    self._start_time = received
+                data = np.frombuffer(payload, dtype='<f8').reshape(2, num_points)
+                future = loop.run_in_executor(self.executor, self._compute,
+                                              data[0], data[1])
+                # Blocks when the queue is full: backpressure
+                await pending.put((frame_id, received, future))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        # Not in a `finally` clause: a cancelled reader must not block
+        await pending.put(None)
+
+    async def _write_results(self, writer, pending):
+        while True:
+            item = await pending.get()
+            if item is None:
+                break
+            frame_id, received, future = item
+            if future is None:
+                # Rejected frame
+                status = STATUS_INVALID_INPUT
+                thickness, uncertainty = np.nan, np.nan
+            else:
+                try:
+                    result = await future
+                    status = int(result.get('status', STATUS_OK))
+                    thickness = result.thickness
+                    uncertainty = result.get('thickness_uncertainty', np.nan)
+                except Exception:
+                    status = STATUS_FAILED
+                    thickness, uncertainty = np.nan, np.nan
+            if status == STATUS_OK and not np.isfinite(thickness):
+                status = STATUS_FAILED
+            latency = time.perf_counter() - received
+
+            self._num_frames += 1
+            self._num_failures += status != STATUS_OK
+            self._latencies.append(latency)
+
+            writer.write(RESPONSE.pack(frame_id, status, thickness, uncertainty, latency))
+            await writer.drain()
+
+    async def _handle_client(self, reader, writer):
+        task = asyncio.current_task()
+        self._clients.add(task)
+        pending = asyncio.Queue(maxsize=self.queue_size)
+        tasks = [asyncio.create_task(self._read_frames(reader, pending)),
+                 asyncio.create_task(self._write_results(writer, pending))]
+        try:
+            await asyncio.gather(*tasks)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            # If one task failed, the other one would wait forever
+            for child in tasks:
+                child.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            writer.close()
+            self._clients.discard(task)
+
+    def stats(self):
+        """
+        Return statistics on the processed frames.
+
+        Returns
+        -------
+        stats : Instance of `OptimizeResult` class.
+            Number of frames and failures, throughput in frames per second
+            since the first frame, and latency statistics in seconds
+            (mean, median, 99th percentile and maximum) over the last
+            100 000 frames.
+        """
+        latencies = np.array(self._latencies)
+        if self._start_time is None or latencies.size == 0:
+            return OptimizeResult(num_frames=0, num_failures=0, fps=0.)
+        elapsed = time.perf_counter() - self._start_time
+        return OptimizeResult(num_frames=self._num_frames,
+                              num_failures=self._num_failures,
+                              fps=self._num_frames / elapsed,
+                              latency_mean=latencies.mean(),
+                              latency_p50=np.percentile(latencies, 50),
+                              latency_p99=np.percentile(latencies, 99),
+                              latency_max=latencies.max())
+
+
+async def send_spectra(host, port, wavelengths, intensities):
+    """
+    Send spectra to a `SpectrumServer` and collect the results.
+
+    This client is a stand-in for an acquisition software.
+
+    Parameters
+    ----------
+    host : string
+        Server address.
+    port : int
+        Server port.
+    wavelengths : array
+        Wavelength values in nm, shared by all spectra.
+    intensities : 2D array
+        Intensity values, one spectrum per row.
+
+    Returns
+    -------
+    results : Instance of `OptimizeResult` class.
+        Arrays `frame_id`, `status`, `thickness`, `thickness_uncertainty`
+        and `latency` (server side), and the throughput `fps` seen by
+        the client.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    num_spectra = len(intensities)
+    start = time.perf_counter()
+
+    async def send():
+        for frame_id, spectrum in enumerate(intensities):
+            writer.write(encode_request(frame_id, wavelengths, spectrum))
+            await writer.drain()
+
+    async def receive():
+        responses = []
+        for _ in range(num_spectra):
+            responses.append(RESPONSE.unpack(await reader.readexactly(RESPONSE.size)))
+        return responses
+
+    _, responses = await asyncio.gather(send(), receive())
+    elapsed = time.perf_counter() - start
+    writer.close()
+    await writer.wait_closed()
+
+    frame_id, status, thickness, uncertainty, latency = (np.array(column)
+                                                         for column in zip(*responses))
+    return OptimizeResult(frame_id=frame_id,
+                          status=status,
+                          thickness=thickness,
+                          thickness_uncertainty=uncertainty,
+                          latency=latency,
+                          fps=num_spectra / elapsed)
+
+
+async def _demo(num_spectra, num_clients, method, max_workers):
+    lambdas = wavelength_grid(1_000, 450, 800)
+    n_values = 1.324188 + 3102.060378 / lambdas**2
+    h_values = np.linspace(1_000, 5_000, num_spectra)
+    intensities = reflectance(h_values, lambdas, n_values)
+
+    kwargs = {} if method == 'fft' else {'min_peak_prominence': 0.02}
+    server = SpectrumServer(method, lambda wavelengths: 1.324188 + 3102.060378 / wavelengths**2,
+                            max_workers=max_workers, **kwargs)
+    host, port = await server.start()
+    try:
+        await asyncio.gather(*[send_spectra(host, port, lambdas, intensities)
+                               for _ in range(num_clients)])
+        return server.stats()
+    finally:
+        await server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve thickness analysis over TCP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--method', default='fft', choices=['fft', 'minmax', 'scheludko'])
+    parser.add_argument('--refractive-index', type=float, default=1.33)
+    parser.add_argument('--workers', type=int, default=None, help='Number of threads')
+    parser.add_argument('--max-points', type=int, default=100_000,
+                        help='Maximum number of points of a frame')
+    parser.add_argument('--demo', type=int, default=0, metavar='N',
+                        help='Replay N synthetic spectra per client on a local server and exit')
+    parser.add_argument('--clients', type=int, default=4, help='Number of demo clients')
+    args = parser.parse_args(argv)
+
+    if args.demo:
+        print(asyncio.run(_demo(args.demo, args.clients, args.method, args.workers)))
+        return
+
+    async def serve():
+        server = SpectrumServer(args.method, args.refractive_index, max_workers=args.workers,
+                                max_points=args.max_points)
+        host, port = await server.start(args.host, args.port)
+        print(f'Listening on {host}:{port}')
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+
+    asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""
+Streaming analysis of spectrum files written during an acquisition.
+"""
+import collections
+import csv
+import fnmatch
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .utils import OptimizeResult
+from .results import STATUS_OK, STATUS_FAILED
+from .batch import analyse_file
+from .resultfile import ResultWriter
+
+
+_FIELDS = ('path', 'thickness', 'thickness_uncertainty',
+           'interference_order', 'status', 'message')
+
+
+def _safe_analyse_file(method, path, refractive_index, /, **kwargs):
+    try:
+        return analyse_file(method, path, refractive_index, **kwargs)
+    except (RuntimeError, ValueError, OSError) as err:
+        # Unreadable file, or errors='raise'
+        return OptimizeResult(thickness=np.nan, status=STATUS_FAILED,
+                              message=f'{type(err).__name__}: {err}')
+
+
+def _row(path, result):
+    return (path, repr(float(result.thickness)),
+            repr(float(result.get('thickness_uncertainty', np.nan))),
+            int(result.get('interference_order', -1)),
+            int(result.get('status', STATUS_OK)),
+            result.get('message', ''))
+
+
+def watch_directory(directory, method, refractive_index, /,
+                    pattern='*.xy',
+                    output=None,
+                    results_file=None,
+                    poll_interval=0.05,
+                    settle_time=1.,
+                    idle_timeout=None,
+                    stop_event=None,
+                    max_workers=None,
+                    wavelength_min=0,
+                    wavelength_max=np.inf,
+                    smooth=False,
+                    **kwargs):
+    """
+    Analyse spectrum files as soon as they are written in a directory.
+
+    Files are processed in the order of their names. A file is considered
+    complete when its size and modification time did not change during
+    `settle_time`. The most reliable producers write each file under a
+    temporary name that does not match `pattern` (e.g. `*.xy.tmp`) and
+    rename it when complete, which is atomic: their files can be analysed
+    as soon as they appear, with `settle_time=0`. Files are only read, so
+    that the producer is never blocked. Bursts of files are analysed in
+    parallel with a pool of threads, and results are yielded in the order
+    of the files.
+
+    Parameters
+    ----------
+    directory : string
+        Directory to watch.
+    method : string
+        Either 'fft', 'minmax' or 'scheludko'.
+    refractive_index : scalar, array or `optifik.dispersion.RefractiveIndex`
+        Value of the refractive index of the medium, or its model.
+    pattern : string, optional
+        Shell-style pattern of the file names. The default is '*.xy'.
+    output : string, optional
+        If given, results are appended to this CSV file
+        as soon as they are available.
+    results_file : string, optional
+        If given, results are appended to this columnar binary file,
+        see `optifik.resultfile.ResultWriter`. The timestamp of a row
+        is the modification time of the spectrum file. Buffered rows
+        are written at the latest 10 seconds after their analysis.
+    poll_interval : scalar, optional
+        Delay between two scans of the directory in seconds.
+        The default is 0.05.
+    settle_time : scalar, optional
+        Delay in seconds during which the size and modification time of
+        a file must not change before it is analysed. The default is 1.
+        Set it to 0 if files are renamed into place once written.
+    idle_timeout : scalar, optional
+        Stop when no file appeared or changed during this delay in seconds
+        and all files are processed. If `None`, watch forever.
+    stop_event : `threading.Event`, optional
+        Stop when this event is set, once the pending files are processed.
+    max_workers : int, optional
+        Number of threads.
+    wavelength_min : scalar, optional
+        Cut the data at this minimum wavelength (included).
+    wavelength_max : scalar, optional
+        Cut the data at this maximum wavelength (included).
+    smooth : bool, optional
+        Smooth the intensities with `smooth_intensities` before analysis.
+    **kwargs :
+        Extra parameters passed to the method, see `analyse_spectrum`.
+
+    Yields
+    ------
+    (path, results) : the file path and an instance of `OptimizeResult`.
+        If the analysis failed, the thickness is NaN and the attributes
+        `status` and `message` describe the failure
+        (see `optifik.results`), unless `errors='raise'` is given.
+
+    Notes
+    -----
+    Files whose name sorts before an already processed file are ignored.
+    """
+    kwargs = {'errors': 'coerce', **kwargs}
+    kwargs.update(wavelength_min=wavelength_min,
+                  wavelength_max=wavelength_max,
+                  smooth=smooth)
+
+    last_name = ''
+    previous_stat = {}
+    pending = collections.deque()
+    last_activity = time.monotonic()
+
+    out = None
+    if output is not None:
+        out = open(output, 'a', newline='')
+        csv_writer = csv.writer(out)
+        if out.tell() == 0:
+            csv_writer.writerow(_FIELDS)
+            out.flush()
+    writer = None
+    if results_file is not None:
+        writer = ResultWriter(results_file, flush_interval=10.)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while True:
+                stopping = stop_event is not None and stop_event.is_set()
+
+                # Submit the new complete files, in order
+                with os.scandir(directory) as entries:
+                    names = sorted(entry.name for entry in entries
+                                   if entry.name > last_name
+                                   and fnmatch.fnmatch(entry.name, pattern))
+                for name in names:
+                    path = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        previous_stat.pop(name, None)
+                        break
+                    now = time.monotonic()
+                    key = (stat.st_size, stat.st_mtime_ns)
+                    if name not in previous_stat or previous_stat[name][0] != key:
+                        previous_stat[name] = (key, now)
+                        last_activity = now
+                    if settle_time > 0 and (stat.st_size == 0
+                                            or now - previous_stat[name][1] < settle_time):
+                        # Possibly still being written: wait for it to keep the order
+                        break
+                    del previous_stat[name]
+                    last_name = name
+                    last_activity = time.monotonic()
+                    pending.append((path, stat.st_mtime,
+                                    executor.submit(_safe_analyse_file, method, path,
+                                                    refractive_index, **kwargs)))
+
+                # Yield the available results, in order
+                while pending and (pending[0][2].done() or stopping):
+                    path, mtime, future = pending.popleft()
+                    result = future.result()
+                    if out is not None:
+                        csv_writer.writerow(_row(path, result))
+                        out.flush()
+                    if writer is not None:
+                        writer.append(result, timestamp=mtime)
+                    yield path, result
+
+                if writer is not None:
+                    writer.flush(min_age=writer.flush_interval)
+                if not pending:
+                    if stopping:
+                        return
+                    if idle_timeout is not None and \
+                            time.monotonic() - last_activity > idle_timeout:
+                        return
+                time.sleep(poll_interval)
+    finally:
+        if out is not None:
+            out.close()
+        if writer is not None:
+            writer.close()
@@ -0,0 +1,216 @@
+"""
+Generation of synthetic interferometric spectra.
+
+Spectra are computed with the reflectance of a thin film of thickness
+`h` and refractive index `n` in air, at normal incidence
+
+.. math::
+
+    I(\\lambda) = \\frac{\\sin^2(2 \\pi n h / \\lambda)}
+                       {\\left(\\frac{2n}{n^2-1}\\right)^2 + \\sin^2(2 \\pi n h / \\lambda)}
+
+The generator works by chunks, so that any number of spectra can be
+streamed or written to a memory-mapped file.
+"""
+import numpy as np
+
+
+def _evaluate_index(refractive_index, wavelengths):
+    if callable(refractive_index):
+        return np.asarray(refractive_index(wavelengths), dtype=float)
+    return np.broadcast_to(np.asarray(refractive_index, dtype=float),
+                           wavelengths.shape)
+
+
+def reflectance(thickness, wavelengths, refractive_index):
+    """
+    Return the theoretical reflected intensity of a thin film.
+
+    Parameters
+    ----------
+    thickness : scalar or array
+        Film thickness in nm. For an array, one spectrum is returned
+        per thickness (one per row).
+    wavelengths : array
+        Wavelength values in nm.
+    refractive_index : scalar, array or callable
+        Value of the refractive index of the film, or function of
+        the wavelengths.
+
+    Returns
+    -------
+    intensities : array
+    """
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    n_values = _evaluate_index(refractive_index, wavelengths)
+    h = np.asarray(thickness, dtype=float)
+    if h.ndim:
+        h = h[:, np.newaxis]
+    sin_term = np.sin(2 * np.pi * n_values * h / wavelengths) ** 2
+    denominator = (2 * n_values / (n_values**2 - 1)) ** 2 + sin_term
+    return sin_term / denominator
+
+
+def wavelength_grid(num_points, wavelength_min=400., wavelength_max=800.):
+    """
+    Return a regular spectrometer grid.
+
+    Parameters
+    ----------
+    num_points : int
+        Number of pixels of the spectrometer.
+    wavelength_min : scalar, optional
+        First wavelength in nm. The default is 400.
+    wavelength_max : scalar, optional
+        Last wavelength in nm. The default is 800.
+
+    Returns
+    -------
+    wavelengths : array
+    """
+    return np.linspace(wavelength_min, wavelength_max, num_points)
+
+
+def thickness_trajectory(num_frames, thickness_start, thickness_stop,
+                         kind='exponential'):
+    """
+    Return the thicknesses of a film thinning over time.
+
+    Parameters
+    ----------
+    num_frames : int
+        Number of frames.
+    thickness_start : scalar
+        Initial thickness in nm.
+    thickness_stop : scalar
+        Final thickness in nm.
+    kind : string, optional
+        Either 'linear' or 'exponential' (constant relative
+        thinning rate). The default is 'exponential'.
+
+    Returns
+    -------
+    thicknesses : array
+    """
+    if kind == 'linear':
+        return np.linspace(thickness_start, thickness_stop, num_frames)
+    elif kind == 'exponential':
+        return np.geomspace(thickness_start, thickness_stop, num_frames)
+    else:
+        raise ValueError('Wrong kind')
+
+
+def generate_spectra(thicknesses, wavelengths, refractive_index,
+                     amplitude=1., noise=0., dark_offset=0., drift=0.,
+                     chunk_size=10_000, dtype=np.float64, seed=None):
+    """
+    Generate spectra by chunks.
+
+    The intensity of frame `k` is
+    `amplitude * I(h_k) + dark_offset + k * drift + noise * N(0, 1)`.
+
+    Parameters
+    ----------
+    thicknesses : array
+        Film thickness of each frame, in nm.
+    wavelengths : array
+        Wavelength values in nm.
+    refractive_index : scalar, array or callable
+        Value of the refractive index of the film, or function of
+        the wavelengths.
+    amplitude : scalar, optional
+        Gain applied to the reflectance. The default is 1.
+    noise : scalar, optional
+        Standard deviation of the additive Gaussian noise.
+        The default is 0.
+    dark_offset : scalar or array, optional
+        Offset added to all frames (an array gives a dark spectrum).
+        The default is 0.
+    drift : scalar or array, optional
+        Offset added per frame, to simulate a drift of the baseline.
+        The default is 0.
+    chunk_size : int, optional
+        Number of spectra per chunk. The default is 10 000.
+    dtype : data-type, optional
+        Either `numpy.float64` or `numpy.float32`.
+    seed : int or `numpy.random.Generator`, optional
+        Seed of the noise.
+
+    Yields
+    ------
+    intensities : 2D array
+        A chunk of spectra, one per row. The buffer is reused between
+        chunks: copy it if it must be kept.
+    """
+    wavelengths = np.asarray(wavelengths, dtype=float)
+    thicknesses = np.asarray(thicknesses, dtype=float)
+    rng = np.random.default_rng(seed)
+
+    # Per-wavelength factors, computed once
+    n_values = _evaluate_index(refractive_index, wavelengths)
+    wavenumber = (2 * np.pi * n_values / wavelengths).astype(dtype)
+    contrast = ((2 * n_values / (n_values**2 - 1)) ** 2).astype(dtype)
+    baseline = np.broadcast_to(np.asarray(dark_offset, dtype=dtype), wavelengths.shape)
+    drift = np.broadcast_to(np.asarray(drift, dtype=dtype), wavelengths.shape)
+
+    num_points = len(wavelengths)
+    buffer = np.empty((min(chunk_size, len(thicknesses)), num_points), dtype=dtype)
+    tmp = np.empty_like(buffer)
+
+    for start in range(0, len(thicknesses), chunk_size):
+        h = thicknesses[start:start + chunk_size].astype(dtype)
+        out = buffer[:len(h)]
+        work = tmp[:len(h)]
+
+        np.multiply.outer(h, wavenumber, out=out)
+        np.sin(out, out=out)
+        np.square(out, out=out)
+        np.add(out, contrast, out=work)
+        np.divide(out, work, out=out)
+
+        if amplitude != 1:
+            out *= amplitude
+        out += baseline
+        if np.any(drift):
+            frames = np.arange(start, start + len(h), dtype=dtype)
+            out += np.multiply.outer(frames, drift, out=work)
+        if noise:
+            rng.standard_normal(dtype=work.dtype, out=work)
+            work *= noise
+            out += work
+        yield out
+
+
+def generate_to_file(path, thicknesses, wavelengths, refractive_index, **kwargs):
+    """
+    Generate spectra into a `.npy` file, without holding them in memory.
+
+    Parameters
+    ----------
+    path : string
+        Path of the `.npy` file.
+    thicknesses : array
+        Film thickness of each frame, in nm.
+    wavelengths : array
+        Wavelength values in nm.
+    refractive_index : scalar, array or callable
+        Value of the refractive index of the film, or function of
+        the wavelengths.
+    **kwargs :
+        Extra parameters passed to `generate_spectra`.
+
+    Returns
+    -------
+    intensities : `numpy.memmap`
+        The spectra, memory-mapped from the file.
+        They can be reopened with `numpy.load(path, mmap_mode='r')`.
+    """
+    dtype = kwargs.get('dtype', np.float64)
+    out = np.lib.format.open_memmap(path, mode='w+', dtype=dtype,
+                                    shape=(len(thicknesses), len(wavelengths)))
+    start = 0
+    for chunk in generate_spectra(thicknesses, wavelengths, refractive_index, **kwargs):
+        out[start:start + len(chunk)] = chunk
+        start += len(chunk)
+    out.flush()
+    return out
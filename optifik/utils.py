@@ -1,3 +1,12 @@
+import collections
+import functools
+import sys
+import threading
+import time
+
+import numpy as np
+
+
 class OptimizeResult(dict):
     """ Represents the optimization result.
 
@@ -27,14 +36,189 @@ class OptimizeResult(dict):
         return list(self.keys())
 
 
+class StageTimer:
+    """ Record the duration and the allocations of successive stages.
+
+    Each call to `lap` closes a stage started at the previous call
+    (or at the creation of the timer).
+    Durations are measured with `time.perf_counter_ns`, allocations
+    with `sys.getallocatedblocks` (Python objects) and, if `tracemalloc`
+    is tracing, with the traced memory (including NumPy buffers).
+
+    """
+    def __init__(self):
+        import tracemalloc
+
+        self._tracing = tracemalloc.is_tracing()
+        self._stages = {}
+        self._start = self._last = time.perf_counter_ns()
+        self._blocks = sys.getallocatedblocks()
+        self._memory = self._traced_memory()
+
+    def _traced_memory(self):
+        if self._tracing:
+            import tracemalloc
+            return tracemalloc.get_traced_memory()[0]
+        return 0
+
+    def lap(self, stage):
+        """
+        Close the current stage and start the next one.
+
+        Parameters
+        ----------
+        stage : string
+            Name of the stage that ends. Durations and allocations
+            of stages with the same name are accumulated.
+        """
+        now = time.perf_counter_ns()
+        blocks = sys.getallocatedblocks()
+        memory = self._traced_memory()
+
+        record = self._stages.setdefault(stage, {'time': 0.,
+                                                 'allocated_blocks': 0})
+        record['time'] += (now - self._last) * 1e-9
+        record['allocated_blocks'] += blocks - self._blocks
+        if self._tracing:
+            record['memory'] = record.get('memory', 0) + memory - self._memory
+
+        self._blocks = blocks
+        self._memory = memory
+        # Exclude the time spent in this method
+        self._last = time.perf_counter_ns()
+
+    def results(self):
+        """
+        Return the recorded stages.
+
+        Returns
+        -------
+        timings : dict
+            For each stage, a dict with the duration `time` in seconds,
+            the number of allocated blocks `allocated_blocks` and, if
+            `tracemalloc` is tracing, the allocated memory `memory`
+            in bytes. The key `total` gives the duration of all stages.
+        """
+        timings = {stage: dict(record) for stage, record in self._stages.items()}
+        timings['total'] = {'time': (self._last - self._start) * 1e-9}
+        return timings
+
+
+class _NoTimer:
+    """ Drop-in replacement of `StageTimer` doing nothing. """
+    def lap(self, stage):
+        pass
+
+
+_NO_TIMER = _NoTimer()
+
+
+def stage_timer(enabled):
+    """
+    Return a `StageTimer` if `enabled`, otherwise a timer doing nothing.
+    """
+    if enabled:
+        return StageTimer()
+    return _NO_TIMER
+
+
+class _GridCache:
+    """ Quantities memoised for the last wavelength grids seen.
+
+    A grid is found by its shape and its end values, then compared
+    element-wise, which is cheaper than hashing its content. Memoised
+    arrays are read-only. The memoised grids are not pickled.
+
+    Parameters
+    ----------
+    max_grids : int
+        Number of grids memoised.
+    """
+    def __init__(self, max_grids=8):
+        self.max_grids = max_grids
+        self._lock = threading.RLock()
+        self._grids = collections.OrderedDict()
+
+    def __getstate__(self):
+        return {'max_grids': self.max_grids}
+
+    def __setstate__(self, state):
+        self.__init__(state['max_grids'])
+
+    def __len__(self):
+        return len(self._grids)
+
+    def _entry(self, wavelengths):
+        if wavelengths.size:
+            key = (wavelengths.shape, wavelengths.flat[0], wavelengths.flat[-1])
+        else:
+            key = (wavelengths.shape,)
+        entry = self._grids.get(key)
+        if entry is None or not np.array_equal(entry['wavelengths'], wavelengths):
+            grid = wavelengths.copy()
+            grid.flags.writeable = False
+            entry = self._grids[key] = {'wavelengths': grid}
+        self._grids.move_to_end(key)
+        while len(self._grids) > self.max_grids:
+            self._grids.popitem(last=False)
+        return entry
+
+    def get(self, wavelengths, name, compute):
+        """
+        Return the quantity `name` on the grid `wavelengths`.
+
+        Parameters
+        ----------
+        wavelengths : array
+            Wavelength values in nm.
+        name : string
+            Name of the quantity.
+        compute : callable
+            Function of the (read-only) grid returning the quantity,
+            called if it is not memoised yet.
+        """
+        wavelengths = np.asarray(wavelengths, dtype=float)
+        with self._lock:
+            entry = self._entry(wavelengths)
+            if name not in entry:
+                value = compute(entry['wavelengths'])
+                if isinstance(value, np.ndarray):
+                    value.flags.writeable = False
+                entry[name] = value
+            return entry[name]
+
+    def clear(self):
+        """
+        Forget the memoised grids.
+        """
+        with self._lock:
+            self._grids.clear()
+
+
+@functools.lru_cache(maxsize=None)
 def is_latex_installed():
     """
     Return True if latex or pdflatex found in system binaries.
+
+    The result is computed once per process.
     """
     import shutil
     return shutil.which("latex") is not None or shutil.which("pdflatex") is not None
 
 
+# Style of the diagnostic plots
+PLOT_STYLE = {
+    'figure.dpi': 300,
+    'figure.figsize': (10, 6),
+    'font.size': 20,
+    'axes.labelsize': 25,
+    'xtick.labelsize': 25,
+    'ytick.labelsize': 25,
+    'legend.fontsize': 23,
+    'figure.titlesize': 20,
+}
+
+
 def setup_matplotlib():
     """
     Configure matplotlib with LaTeX text rendering and custom font sizes.
@@ -51,16 +235,7 @@ def setup_matplotlib():
         matplotlib.rcParams['font.family'] = 'STIXGeneral'
 
 
-    plt.rcParams.update({
-        'figure.dpi': 300,
-        'figure.figsize': (10, 6),
-        'font.size': 20,
-        'axes.labelsize': 25,
-        'xtick.labelsize': 25,
-        'ytick.labelsize': 25,
-        'legend.fontsize': 23,
-        'figure.titlesize': 20,
-    })
+    plt.rcParams.update(PLOT_STYLE)
 
 
 def round_to_uncertainty(value, uncertainty, uncertainty_digits=1):
@@ -141,3 +316,119 @@ def round_to_uncertainty(value, uncertainty, uncertainty_digits=1):
     formatted_uncertainty = format_number(uncertainty_rounded)
 
     return formatted_value, formatted_uncertainty
+
+
+def _round_half_up(x):
+    """
+    Round `x` half away from zero, as `decimal.ROUND_HALF_UP`.
+
+    Returns the rounded values and a mask of the values too close to a
+    tie (or too large) to be rounded reliably in floating point.
+    """
+    magnitude = np.abs(x)
+    rounded = np.floor(magnitude + 0.5)
+    # x carries the error of the decimal to binary conversion
+    # and of one multiplication
+    unsure = (np.abs(magnitude - np.floor(magnitude) - 0.5) <= 4 * np.finfo(float).eps * magnitude) \
+        | (magnitude >= 2.**50)
+    return np.copysign(rounded, x), unsure
+
+
+def _trailing_zeros(integers, max_zeros):
+    """
+    Number of trailing zeros of `integers` (as floats), up to `max_zeros`.
+    """
+    zeros = np.zeros(integers.shape, dtype=int)
+    remaining = np.abs(integers)
+    for _ in range(int(np.max(max_zeros, initial=0))):
+        divisible = (remaining % 10 == 0) & (zeros < max_zeros)
+        if not divisible.any():
+            break
+        zeros += divisible
+        remaining = np.where(divisible, remaining / 10, remaining)
+    return zeros
+
+
+def _format_fixed(values, decimals):
+    """
+    Format `values` with a number of decimals given for each value.
+    """
+    return ['%.*f' % item for item in zip(decimals.tolist(), values.tolist())]
+
+
+def round_to_uncertainty_array(values, uncertainties, uncertainty_digits=1):
+    """
+    Format arrays of numbers to standard rules of uncertainty.
+
+    Vectorized version of `round_to_uncertainty`, giving the same
+    strings for each pair of value and uncertainty.
+
+    Parameters
+    ----------
+    values : array
+    uncertainties : array
+        Broadcast against `values`.
+    uncertainty_digits : int, optional
+
+    Returns
+    -------
+    values : array of str
+    uncertainties : array of str
+
+    Notes
+    -----
+    Values and uncertainties are rounded half up on their shortest
+    decimal representation. The few pairs that cannot be rounded
+    reliably with floating-point operations (exact ties, uncertainties
+    below 1e-6, zero or negative uncertainties) are formatted by
+    `round_to_uncertainty`. Non-finite values or uncertainties give
+    'nan' or 'inf'.
+    """
+    values, uncertainties = np.broadcast_arrays(np.asarray(values, dtype=float),
+                                                np.asarray(uncertainties, dtype=float))
+    shape = values.shape
+    values = values.ravel()
+    uncertainties = uncertainties.ravel()
+    out_values = np.empty(values.shape, dtype=object)
+    out_uncertainties = np.empty(values.shape, dtype=object)
+
+    finite = np.isfinite(values) & np.isfinite(uncertainties)
+    for idx in np.flatnonzero(~finite):
+        out_values[idx] = str(values[idx])
+        out_uncertainties[idx] = str(uncertainties[idx])
+    regular = finite & (uncertainties >= 1e-6)
+    fallback = finite & ~regular
+    v = values[regular]
+    u = uncertainties[regular]
+
+    # Exponent of the first significant digit, never overestimated
+    exponent = np.floor(np.log10(u)).astype(int)
+    exponent -= u < 10.**exponent
+    power = exponent - uncertainty_digits + 1
+    # Powers of ten are exact for non-negative exponents
+    scaled = np.where(power < 0, u * 10.**np.maximum(-power, 0),
+                      u / 10.**np.maximum(power, 0))
+    mantissa, unsure = _round_half_up(scaled)
+
+    # Decimals of the rounded uncertainty without trailing zeros
+    decimals = np.maximum(-power, 0)
+    decimals = decimals - _trailing_zeros(mantissa, decimals)
+
+    rounded, unsure_value = _round_half_up(v * 10.**decimals)
+    unsure |= unsure_value
+    # The value keeps all its decimals, trailing zeros stripped
+    value_decimals = decimals - _trailing_zeros(rounded, decimals)
+
+    out_values[regular] = _format_fixed(rounded / 10.**decimals, value_decimals)
+    out_uncertainties[regular] = _format_fixed(mantissa * 10.**np.maximum(power, 0)
+                                               / 10.**np.maximum(-power, 0), decimals)
+
+    fallback[np.flatnonzero(regular)[unsure]] = True
+    for idx in np.flatnonzero(fallback):
+        value, uncertainty = round_to_uncertainty(values[idx], uncertainties[idx],
+                                                  uncertainty_digits)
+        out_values[idx] = str(value)
+        out_uncertainties[idx] = str(uncertainty)
+
+    return (out_values.astype(str).reshape(shape),
+            out_uncertainties.astype(str).reshape(shape))
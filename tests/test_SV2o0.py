@@ -9,6 +9,7 @@ from optifik.scheludko import thickness_from_scheludko
 from optifik.scheludko import get_default_start_stop_wavelengths
 from optifik.io import load_spectrum
 from optifik.analysis import smooth_intensities
+from optifik.reference import ReferenceSpectrum
 
 
 def load(filename):
@@ -24,15 +25,18 @@ def load(filename):
     return data
 
 
-#@pytest.mark.skip('...')
-@pytest.mark.parametrize("spectrum_path, expected", load('known_value.yaml'))
-def test_SV2o0_small_tol(spectrum_path, expected):
+@pytest.fixture(scope='module')
+def void():
+    # Loaded once for all the spectra
     test_data_dir = Path(__file__).parent.parent / 'data'
+    return ReferenceSpectrum.from_file(test_data_dir / 'spectraVictor2' / 'void.xy',
+                                       wavelength_min=450)
 
-    lambdas, raw_intensities = load_spectrum(spectrum_path, wavelength_min=450)
 
-    File_I_min = test_data_dir / 'spectraVictor2' / 'void.xy'
-    _, intensities_void = load_spectrum(File_I_min, wavelength_min=450)
+#@pytest.mark.skip('...')
+@pytest.mark.parametrize("spectrum_path, expected", load('known_value.yaml'))
+def test_SV2o0_small_tol(spectrum_path, expected, void):
+    lambdas, raw_intensities = load_spectrum(spectrum_path, wavelength_min=450)
 
     smoothed_intensities = smooth_intensities(raw_intensities)
 
@@ -46,20 +50,15 @@ def test_SV2o0_small_tol(spectrum_path, expected):
                                       wavelength_start=w_start,
                                       wavelength_stop=w_stop,
                                       interference_order=0,
-                                      intensities_void=intensities_void,
+                                      intensities_void=void,
                                       plot=False)
 
     assert_allclose(result.thickness, expected, rtol=1e-1)
 
 @pytest.mark.parametrize("spectrum_path, expected", load('known_value_large_tol.yaml'))
-def test_SV2o0_large_tol(spectrum_path, expected):
-    test_data_dir = Path(__file__).parent.parent / 'data'
-
+def test_SV2o0_large_tol(spectrum_path, expected, void):
     lambdas, raw_intensities = load_spectrum(spectrum_path, wavelength_min=450)
 
-    File_I_min = test_data_dir / 'spectraVictor2' / 'void.xy'
-    _, intensities_void = load_spectrum(File_I_min, wavelength_min=450)
-
     smoothed_intensities = smooth_intensities(raw_intensities)
 
     r_index =  1.324188 + 3102.060378 / (lambdas**2)
@@ -72,7 +71,7 @@ def test_SV2o0_large_tol(spectrum_path, expected):
                                       wavelength_start=w_start,
                                       wavelength_stop=w_stop,
                                       interference_order=0,
-                                      intensities_void=intensities_void,
+                                      intensities_void=void,
                                       plot=False)
 
     assert_allclose(result.thickness, expected, rtol=2.5e-1)
@@ -0,0 +1,67 @@
+import pytest
+
+import numpy as np
+from numpy.testing import assert_allclose, assert_equal
+from scipy.signal import savgol_filter
+
+from optifik.analysis import smooth_intensities, smooth_stack, derivative_extrema
+
+
+@pytest.fixture
+def stack():
+    rng = np.random.default_rng(0)
+    lambdas = np.linspace(450, 800, 300)
+    phases = rng.uniform(0, 2 * np.pi, (20, 1))
+    return lambdas, np.sin(lambdas / 15 + phases) + 0.05 * rng.standard_normal((20, 300))
+
+
+@pytest.mark.parametrize('window_size, polynom_order', [(11, 3), (21, 2), (7, 6)])
+def test_smooth_stack(stack, window_size, polynom_order):
+    lambdas, intensities = stack
+    expected = np.array([smooth_intensities(spectrum, window_size, polynom_order)
+                         for spectrum in intensities])
+    assert_allclose(smooth_stack(intensities, window_size, polynom_order), expected,
+                    rtol=0, atol=1e-12)
+
+    step = lambdas[1] - lambdas[0]
+    smoothed, derivative = smooth_stack(intensities, window_size, polynom_order,
+                                        derivative=True, wavelength_step=step)
+    assert_allclose(derivative, savgol_filter(intensities, window_size, polynom_order,
+                                              deriv=1, delta=step),
+                    rtol=0, atol=1e-12)
+
+
+def test_smooth_stack_in_place(stack):
+    _, intensities = stack
+    expected = smooth_stack(intensities)
+    work = intensities.copy()
+    out, derivative = smooth_stack(work, out=work, derivative=True)
+    assert out is work
+    assert_allclose(work, expected, rtol=0, atol=1e-12)
+    assert_allclose(derivative, smooth_stack(intensities, derivative=True)[1])
+
+    with pytest.raises(ValueError):
+        smooth_stack(intensities[:, :5])
+
+
+def test_derivative_extrema():
+    x = np.linspace(0, 4 * np.pi, 400)
+    _, derivative = smooth_stack(np.sin(x)[None], derivative=True)
+    minima, maxima = derivative_extrema(derivative)
+    assert_equal(np.flatnonzero(maxima[0]), [np.argmin(np.abs(x - np.pi / 2)),
+                                             np.argmin(np.abs(x - 5 * np.pi / 2))])
+    assert_equal(np.flatnonzero(minima[0]), [np.argmin(np.abs(x - 3 * np.pi / 2)),
+                                             np.argmin(np.abs(x - 7 * np.pi / 2))])
+
+
+def test_derivative_extrema_plateaus():
+    # Monotone ramp with a plateau: no extremum
+    derivative = np.array([[1., 1., 0., 0., 0., 1., 1.],
+                           [-1., 0., 0., -1., -1., 0., -1.]])
+    minima, maxima = derivative_extrema(derivative)
+    assert not minima.any() and not maxima.any()
+
+    # Flat top and flat bottom: one extremum each, at the first zero
+    minima, maxima = derivative_extrema(np.array([1., 2., 0., 0., -1., 0., 0., 1.]))
+    assert_equal(np.flatnonzero(maxima), [2])
+    assert_equal(np.flatnonzero(minima), [5])
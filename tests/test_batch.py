@@ -0,0 +1,266 @@
+import pytest
+import warnings
+from pathlib import Path
+
+import numpy as np
+from numpy.testing import assert_allclose
+
+from optifik.batch import analyse_spectrum, aggregate_timings
+from optifik.batch import thickness_batch, thickness_batch_shared
+from optifik.metrics import REGISTRY
+from optifik.results import STATUS_OK, STATUS_TOO_FEW_PEAKS, STATUS_NO_EXTREMUM
+from optifik.results import STATUS_INVALID_INPUT, FAILURE_REASONS
+from optifik.fft import thickness_from_fft
+from optifik.minmax import thickness_from_minmax
+from optifik.scheludko import thickness_from_scheludko
+from optifik.scheludko import get_default_start_stop_wavelengths
+
+
+def n_lambda(lmbda):
+    """
+    For water + TTAB 1 CMC
+    """
+    return 1.324188 + 3102.060378 / (lmbda**2)
+
+
+def compute_spectrum_theory(h, lambdas, n_values):
+    sin_term = np.sin(2 * np.pi * n_values * h / lambdas) ** 2
+    denominator = (2 * n_values / (n_values**2 - 1)) ** 2 + sin_term
+    return sin_term / denominator
+
+
+@pytest.fixture
+def stack():
+    lambdas = np.linspace(450, 800, 1_000)
+    n_values = n_lambda(lambdas)
+    h_values = np.linspace(400, 900, 12)
+    intensities = np.array([compute_spectrum_theory(h, lambdas, n_values)
+                            for h in h_values])
+    return lambdas, intensities, n_values, h_values
+
+
+@pytest.fixture
+def no_pyplot(monkeypatch):
+    import matplotlib.pyplot as plt
+
+    def fail(*args, **kwargs):
+        raise AssertionError('pyplot must not be used')
+
+    monkeypatch.setattr(plt, 'figure', fail)
+    monkeypatch.setattr(plt, 'subplots', fail)
+
+
+def test_batch_fft(stack, no_pyplot):
+    lambdas, intensities, n_values, h_values = stack
+    results = thickness_batch('fft', lambdas, intensities, n_values,
+                              max_workers=4, N_padding=4)
+    assert len(results) == len(h_values)
+    for result, spectrum in zip(results, intensities):
+        expected = thickness_from_fft(lambdas, spectrum, n_values, N_padding=4)
+        assert result.thickness == expected.thickness
+
+
+def test_batch_minmax(stack, no_pyplot):
+    lambdas, intensities, n_values, h_values = stack
+    results = thickness_batch('minmax', lambdas, intensities, n_values,
+                              max_workers=3, chunk_size=5,
+                              min_peak_prominence=None)
+    for result, spectrum in zip(results, intensities):
+        expected = thickness_from_minmax(lambdas, spectrum, n_values,
+                                         min_peak_prominence=None)
+        assert result.thickness == expected.thickness
+
+
+def test_batch_minmax_ransac(stack):
+    lambdas, intensities, n_values, h_values = stack
+    results = thickness_batch('minmax', lambdas, intensities, n_values,
+                              max_workers=2, min_peak_prominence=None,
+                              method='ransac')
+    assert all('num_inliers' in result for result in results)
+
+
+def test_batch_scheludko(stack, no_pyplot):
+    lambdas, intensities, n_values, h_values = stack
+    results = thickness_batch('scheludko', lambdas, intensities, n_values,
+                              max_workers=4, min_peak_prominence=None)
+    for result, spectrum, h in zip(results, intensities, h_values):
+        w_start, w_stop = get_default_start_stop_wavelengths(lambdas, spectrum, n_values,
+                                                             min_peak_prominence=None)
+        expected = thickness_from_scheludko(lambdas, spectrum, n_values,
+                                            wavelength_start=w_start,
+                                            wavelength_stop=w_stop)
+        assert result.thickness == expected.thickness
+        assert result.interference_order == expected.interference_order
+        assert_allclose(result.thickness, h, rtol=2e-3)
+
+
+def test_analyse_spectrum_wrong_method(stack):
+    lambdas, intensities, n_values, _ = stack
+    with pytest.raises(ValueError):
+        analyse_spectrum('foo', lambdas, intensities[0], n_values)
+
+
+def test_batch_wrong_shape(stack):
+    lambdas, intensities, n_values, _ = stack
+    with pytest.raises(ValueError):
+        thickness_batch('fft', lambdas, intensities[0], n_values)
+
+
+def test_batch_shared(stack):
+    lambdas, intensities, n_values, h_values = stack
+    expected = thickness_batch('scheludko', lambdas, intensities, n_values,
+                               min_peak_prominence=None)
+    result = thickness_batch_shared('scheludko', lambdas, intensities, n_values,
+                                    max_workers=2, chunk_size=5,
+                                    min_peak_prominence=None)
+    assert_allclose(result.thickness, [r.thickness for r in expected])
+    assert_allclose(result.thickness_uncertainty,
+                    [r.thickness_uncertainty for r in expected])
+    assert list(result.interference_order) == [r.interference_order for r in expected]
+
+
+def test_batch_shared_memmap_input(stack, tmp_path):
+    lambdas, intensities, n_values, h_values = stack
+    stored = np.memmap(tmp_path / 'stack.dat', dtype=float, mode='w+',
+                       shape=intensities.shape)
+    stored[...] = intensities
+    stored.flush()
+
+    result = thickness_batch_shared('fft', lambdas, stored, 1.33, max_workers=2)
+    for thickness, spectrum in zip(result.thickness, intensities):
+        assert thickness == thickness_from_fft(lambdas, spectrum, 1.33).thickness
+    assert np.all(result.interference_order == -1)
+
+
+def test_batch_timings(stack):
+    lambdas, intensities, n_values, h_values = stack
+    results = thickness_batch('fft', lambdas, intensities, n_values,
+                              max_workers=2, timings=True)
+    timings = aggregate_timings(results)
+    assert timings['interpolation']['count'] == len(h_values)
+    assert_allclose(timings['fft']['time'],
+                    sum(result.timings['fft']['time'] for result in results))
+
+    shared = thickness_batch_shared('fft', lambdas, intensities, n_values,
+                                    max_workers=2, chunk_size=5, timings=True)
+    assert shared.timings['total']['count'] == len(h_values)
+
+
+@pytest.fixture
+def stack_with_failures(stack):
+    lambdas, intensities, n_values, h_values = stack
+    intensities = intensities.copy()
+    # No extremum in these spectra
+    intensities[[2, 7]] = 0.5
+    return lambdas, intensities, n_values, h_values
+
+
+@pytest.mark.parametrize('method, status', [('minmax', STATUS_TOO_FEW_PEAKS),
+                                            ('scheludko', STATUS_NO_EXTREMUM)])
+def test_batch_coerce(stack_with_failures, method, status):
+    lambdas, intensities, n_values, h_values = stack_with_failures
+    REGISTRY.reset()
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        results = thickness_batch(method, lambdas, intensities, n_values,
+                                  max_workers=2, min_peak_prominence=None,
+                                  errors='coerce')
+    assert list(np.flatnonzero(results.status != STATUS_OK)) == [2, 7]
+    assert np.all(results.status[[2, 7]] == status)
+    assert np.all(np.isnan(results.thickness[[2, 7]]))
+    assert np.all(np.isfinite(np.delete(results.thickness, [2, 7])))
+    assert results[2].message
+    assert 'message' not in results[0]
+    # A single summary instead of one warning per spectrum
+    messages = [str(item.message) for item in caught]
+    assert messages == [f'2 of 12 spectra failed ({FAILURE_REASONS[status]}: 2).']
+    assert REGISTRY.counter_value('optifik_failures_total', method=method,
+                                  reason=FAILURE_REASONS[status]) == 2
+    REGISTRY.reset()
+
+
+def test_batch_raise(stack_with_failures):
+    lambdas, intensities, n_values, h_values = stack_with_failures
+    with pytest.raises(RuntimeError):
+        thickness_batch('scheludko', lambdas, intensities, n_values,
+                        min_peak_prominence=None)
+    with pytest.raises(ValueError):
+        thickness_batch('fft', lambdas, intensities, n_values, errors='ignore')
+
+
+def test_analyse_spectrum_coerce(stack):
+    lambdas, intensities, n_values, _ = stack
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        result = analyse_spectrum('minmax', lambdas, np.full_like(lambdas, 0.5), n_values,
+                                  min_peak_prominence=0.02, errors='coerce')
+    assert result.status == STATUS_TOO_FEW_PEAKS
+    assert np.isnan(result.thickness)
+
+    # Unexpected failures are also reported
+    result = analyse_spectrum('minmax', lambdas, intensities[0], n_values,
+                              min_peak_prominence=None, method='foo', errors='coerce')
+    assert result.status == STATUS_INVALID_INPUT
+    assert result.message
+
+
+def test_coerce_invalid_inputs(stack):
+    lambdas, intensities, n_values, _ = stack
+    # Order 0 without the intensities in absence of film
+    result = analyse_spectrum('scheludko', lambdas, intensities[0], n_values,
+                              interference_order=0, errors='coerce')
+    assert result.status == STATUS_INVALID_INPUT
+    with pytest.raises(ValueError):
+        analyse_spectrum('scheludko', lambdas, intensities[0], n_values,
+                         interference_order=0)
+
+    # TypeError of a wrong refractive index
+    with pytest.warns(RuntimeWarning, match='2 of 2 spectra failed'):
+        results = thickness_batch('fft', lambdas, intensities[:2], 'water', errors='coerce')
+    assert np.all(results.status == STATUS_INVALID_INPUT)
+    assert results[0].message.startswith('TypeError')
+
+    # Non-finite intensities
+    corrupted = intensities[0].copy()
+    corrupted[10] = np.nan
+    result = thickness_from_fft(lambdas, corrupted, n_values, errors='coerce')
+    assert result.status == STATUS_INVALID_INPUT
+    assert np.isnan(result.thickness)
+    with pytest.raises(ValueError):
+        thickness_from_fft(lambdas, corrupted, n_values)
+
+
+def test_misspelt_parameter_raises(stack):
+    lambdas, intensities, n_values, _ = stack
+    for method in ('fft', 'minmax', 'scheludko'):
+        with pytest.raises(TypeError, match='min_peak_prominance'):
+            analyse_spectrum(method, lambdas, intensities[0], n_values, errors='coerce',
+                             min_peak_prominance=0.02)
+    with pytest.raises(TypeError):
+        thickness_batch('minmax', lambdas, intensities[:2], n_values, errors='coerce',
+                        min_peak_prominance=0.02)
+
+
+def test_default_start_stop_coerce(stack):
+    lambdas, intensities, n_values, _ = stack
+    flat = np.full_like(lambdas, 0.5)
+    with pytest.raises(RuntimeError):
+        get_default_start_stop_wavelengths(lambdas, flat, n_values, min_peak_prominence=0.02)
+    start, stop = get_default_start_stop_wavelengths(lambdas, flat, n_values,
+                                                     min_peak_prominence=0.02,
+                                                     errors='coerce')
+    assert np.isnan(start) and np.isnan(stop)
+    result = thickness_from_scheludko(lambdas, flat, n_values, wavelength_start=start,
+                                      wavelength_stop=stop, errors='coerce')
+    assert result.status == STATUS_NO_EXTREMUM
+
+
+def test_batch_shared_coerce(stack_with_failures):
+    lambdas, intensities, n_values, h_values = stack_with_failures
+    with pytest.warns(RuntimeWarning, match='2 of 12 spectra failed'):
+        results = thickness_batch_shared('scheludko', lambdas, intensities, n_values,
+                                         max_workers=2, chunk_size=5,
+                                         min_peak_prominence=None, errors='coerce')
+    assert np.all(results.status[[2, 7]] == STATUS_NO_EXTREMUM)
+    assert results[7].message
+    assert results.message[0] is None
@@ -0,0 +1,138 @@
+import os
+
+import numpy as np
+from numpy.testing import assert_allclose
+
+import optifik
+from optifik.cache import ResultCache
+from optifik.metrics import REGISTRY
+from optifik.batch import analyse_spectrum, thickness_batch, thickness_batch_shared
+from optifik.synthetic import reflectance, wavelength_grid
+
+
+def n_lambda(lmbda):
+    """
+    For water + TTAB 1 CMC
+    """
+    return 1.324188 + 3102.060378 / (lmbda**2)
+
+
+def stack(num_spectra=6):
+    lambdas = wavelength_grid(1_000, 450, 800)
+    return lambdas, reflectance(np.linspace(1_000, 3_000, num_spectra), lambdas, n_lambda)
+
+
+def test_key(tmp_path):
+    cache_key = ResultCache(tmp_path).key
+    lambdas, intensities = stack()
+    n_values = n_lambda(lambdas)
+    reference = cache_key('minmax', lambdas, intensities[0], n_values,
+                          min_peak_prominence=0.02)
+    assert reference == cache_key('minmax', lambdas, intensities[0].copy(),
+                                  n_lambda, min_peak_prominence=0.02)
+    assert reference != cache_key('minmax', lambdas, intensities[1], n_values,
+                                  min_peak_prominence=0.02)
+    assert reference != cache_key('minmax', lambdas, intensities[0], n_values,
+                                  min_peak_prominence=0.03)
+    assert reference != cache_key('minmax', lambdas, intensities[0], n_values,
+                                  min_peak_prominence=0.02, method='ransac')
+    assert reference != cache_key('fft', lambdas, intensities[0], n_values,
+                                  min_peak_prominence=0.02)
+    assert reference != cache_key('minmax', lambdas, intensities[0], 1.33,
+                                  min_peak_prominence=0.02)
+
+
+def test_key_versioned(tmp_path, monkeypatch):
+    import optifik.cache
+
+    cache_key = ResultCache(tmp_path).key
+    lambdas, intensities = stack()
+    reference = cache_key('fft', lambdas, intensities[0], 1.33)
+    monkeypatch.setattr(optifik.cache, '__version__', optifik.__version__ + '.dev0')
+    assert cache_key('fft', lambdas, intensities[0], 1.33) != reference
+    monkeypatch.undo()
+    monkeypatch.setattr(optifik.cache, 'CACHE_FORMAT', optifik.cache.CACHE_FORMAT + 1)
+    assert cache_key('fft', lambdas, intensities[0], 1.33) != reference
+
+
+def test_size_of_replaced_results(tmp_path):
+    lambdas, intensities = stack()
+    cache = ResultCache(tmp_path / 'cache')
+    key = cache.key('fft', lambdas, intensities[0], 1.33)
+    result = cache.analyse('fft', lambdas, intensities[0], 1.33)
+    for _ in range(3):
+        cache.put(key, result)
+    assert cache._size == cache.size
+
+
+def test_analyse(tmp_path):
+    lambdas, intensities = stack()
+    cache = ResultCache(tmp_path / 'cache')
+    first = cache.analyse('minmax', lambdas, intensities[0], 1.33, min_peak_prominence=None)
+    second = cache.analyse('minmax', lambdas, intensities[0], 1.33, min_peak_prominence=None)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert second.thickness == first.thickness
+    assert_allclose(second.peaks_min, first.peaks_min)
+    assert len(cache) == 1
+
+    # Not cached
+    result = cache.analyse('fft', lambdas, intensities[0], 1.33, timings=True)
+    assert 'timings' in result
+    assert len(cache) == 1
+
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_metrics_disabled(tmp_path, monkeypatch):
+    REGISTRY.reset()
+    monkeypatch.setattr(REGISTRY, 'enabled', False)
+    cache = ResultCache(tmp_path)
+    lambdas, intensities = stack()
+    for _ in range(2):
+        cache.analyse('fft', lambdas, intensities[0], 1.33)
+    assert cache.hits == cache.misses == 1
+    for result in ('hit', 'miss'):
+        assert REGISTRY.counter_value('optifik_cache_requests_total', result=result) == 0
+
+
+def test_eviction(tmp_path):
+    lambdas, intensities = stack(20)
+    cache = ResultCache(tmp_path / 'cache')
+    cache.analyse('fft', lambdas, intensities[0], 1.33)
+    entry_size = cache.size
+
+    cache = ResultCache(tmp_path / 'cache', max_bytes=5 * entry_size)
+    for idx, spectrum in enumerate(intensities):
+        cache.analyse('fft', lambdas, spectrum, 1.33)
+        # Distinct modification times
+        path = cache._path(cache.key('fft', lambdas, spectrum, 1.33))
+        os.utime(path, ns=(idx * 10**9, idx * 10**9))
+    assert cache.size <= 5 * entry_size
+    # The most recent results are kept
+    cache.hits = 0
+    cache.analyse('fft', lambdas, intensities[-1], 1.33)
+    assert cache.hits == 1
+
+
+def test_batch_with_cache(tmp_path):
+    lambdas, intensities = stack()
+    cache = ResultCache(tmp_path / 'cache')
+    expected = thickness_batch('scheludko', lambdas, intensities, 1.33,
+                               min_peak_prominence=None)
+
+    first = thickness_batch('scheludko', lambdas, intensities, 1.33, max_workers=2,
+                            cache=cache, min_peak_prominence=None)
+    assert cache.misses == len(intensities)
+    second = thickness_batch('scheludko', lambdas, intensities, 1.33, max_workers=2,
+                             cache=cache, min_peak_prominence=None)
+    assert cache.hits == len(intensities)
+    assert_allclose(first.thickness, expected.thickness)
+    assert_allclose(second.thickness, expected.thickness)
+
+    # Workers use the same cache directory
+    intensities[0] = reflectance(5_000, lambdas, 1.33)
+    shared = thickness_batch_shared('scheludko', lambdas, intensities, 1.33, max_workers=2,
+                                    cache=cache, min_peak_prominence=None)
+    assert_allclose(shared.thickness[1:], expected.thickness[1:])
+    assert len(cache) == len(intensities) + 1
@@ -0,0 +1,98 @@
+import pytest
+
+import numpy as np
+from numpy.testing import assert_allclose, assert_equal
+
+from optifik.calibration import Calibration
+from optifik.synthetic import generate_spectra, reflectance
+
+
+@pytest.fixture
+def frames():
+    rng = np.random.default_rng(0)
+    dark = rng.normal(100, 3, (8, 50))
+    reference = np.linspace(2000, 3000, 50)
+    counts = rng.integers(90, 3500, (20, 50)).astype(np.uint16)
+    return dark, reference, counts
+
+
+def test_apply(frames):
+    dark, reference, counts = frames
+    calibration = Calibration(dark, reference)
+    assert calibration.num_dark_frames == 8
+    mean_dark = dark.mean(axis=0)
+    expected = (counts - mean_dark) / (reference - mean_dark)
+
+    result = calibration.apply(counts)
+    assert result.dtype == np.float32
+    assert_allclose(result, expected, rtol=1e-5, atol=1e-6)
+    assert_allclose(calibration.apply(counts.astype(float), chunk_size=3), expected)
+    # One spectrum
+    assert_allclose(calibration.apply(counts[0].astype(float)), expected[0])
+
+    # In place
+    stack = counts.astype(float)
+    assert calibration.apply(stack, out=stack) is stack
+    assert_allclose(stack, expected)
+
+    with pytest.raises(ValueError):
+        calibration.apply(counts[:, 1:])
+    with pytest.raises(ValueError):
+        calibration.apply(counts, out=np.empty(counts.shape, dtype=int))
+
+
+def test_saturation_and_invalid(frames):
+    dark, reference, counts = frames
+    reference = reference.copy()
+    reference[3] = 50
+    reference[7] = 4000
+    calibration = Calibration(dark[0], reference, saturation=3000, fill_value=1.)
+    assert_equal(np.flatnonzero(~calibration.valid), [3, 7, 49])
+
+    result = calibration.apply(counts.astype(float), chunk_size=7)
+    assert np.all(np.isnan(result[:, ~calibration.valid]))
+    saturated = (counts >= 3000) & calibration.valid
+    assert saturated.any()
+    assert_equal(result[saturated], 1.)
+    normal = (counts < 3000) & calibration.valid
+    assert_allclose(result[normal],
+                    ((counts - dark[0]) / (reference - dark[0]))[normal])
+
+
+def test_add_dark(frames):
+    dark, reference, counts = frames
+    calibration = Calibration(dark[:3], reference)
+    calibration.add_dark(dark[3])
+    calibration.add_dark(dark[4:])
+    assert calibration.num_dark_frames == 8
+    assert_allclose(calibration.dark, dark.mean(axis=0))
+    assert_allclose(calibration.apply(counts), Calibration(dark, reference).apply(counts))
+
+
+def test_apply_chunks():
+    lambdas = np.linspace(450, 800, 100)
+    dark = np.linspace(0.1, 0.2, 100)
+    thicknesses = np.linspace(400, 900, 25)
+    calibration = Calibration(dark, dark + 2)
+    chunks = generate_spectra(thicknesses, lambdas, 1.33, amplitude=2,
+                              dark_offset=dark, chunk_size=10)
+    result = np.concatenate([chunk.copy() for chunk in calibration.apply_chunks(chunks)])
+    assert_allclose(result, reflectance(thicknesses, lambdas, 1.33))
+
+
+def test_from_files(frames, tmp_path):
+    dark, reference, _ = frames
+    lambdas = np.linspace(400, 800, 50)
+    paths = []
+    for idx, spectrum in enumerate([*dark[:2], reference]):
+        paths.append(tmp_path / f'{idx}.csv')
+        np.savetxt(paths[-1], np.column_stack([lambdas, spectrum]), delimiter=',')
+    calibration = Calibration.from_files(paths[:2], paths[2], wavelength_min=500)
+    mask = lambdas >= 500
+    assert_allclose(calibration.wavelengths, lambdas[mask])
+    assert_allclose(calibration.dark, dark[:2].mean(axis=0)[mask])
+    assert calibration.num_dark_frames == 2
+
+    np.savetxt(paths[0], np.column_stack([lambdas + 1, dark[0]]), delimiter=',')
+    with pytest.raises(ValueError):
+        Calibration.from_files(paths[:2], paths[2])
@@ -0,0 +1,68 @@
+import pytest
+
+import numpy as np
+from numpy.testing import assert_allclose, assert_equal
+
+from optifik.utils import OptimizeResult
+from optifik.results import BatchResult, STATUS_FAILED
+from optifik.catalog import ResultCatalog, parameter_hash
+
+
+def n_lambda(lmbda):
+    return 1.324188 + 3102.060378 / (lmbda**2)
+
+
+def test_parameter_hash():
+    lambdas = np.linspace(450, 800, 10)
+    params = {'min_peak_prominence': 0.02, 'refractive_index': 1.33 + 0 * lambdas}
+    assert parameter_hash('minmax', params) == \
+        parameter_hash('minmax', dict(reversed(list(params.items()))))
+    assert parameter_hash('minmax', params) != parameter_hash('fft', params)
+    assert parameter_hash('minmax', params) != \
+        parameter_hash('minmax', {**params, 'refractive_index': 1.34 + 0 * lambdas})
+    assert parameter_hash('minmax', {'min_peak_prominence': np.float64(0.02)}) == \
+        parameter_hash('minmax', {'min_peak_prominence': 0.02})
+    # Functions are not identified by their name
+    for function in (lambda lambdas: 1.33 + 0 * lambdas, n_lambda):
+        with pytest.raises(TypeError):
+            parameter_hash('fft', {'refractive_index': function})
+
+
+def test_catalog(tmp_path):
+    spectra = [f'campaign/sample{idx % 2}/{idx:06d}.xy' for idx in range(10)]
+    batch = BatchResult(10, thickness=np.arange(10.) * 100,
+                        thickness_uncertainty=np.ones(10),
+                        interference_order=np.arange(10) % 3)
+    batch.thickness[4] = np.nan
+    batch.status[4] = STATUS_FAILED
+
+    with ResultCatalog(tmp_path / 'catalog.db', batch_size=4) as catalog:
+        catalog.add_batch(spectra, 'scheludko', {'max_order_tested': 8}, batch,
+                          timestamps=np.arange(10.))
+        catalog.add(spectra[0], 'fft', {'N_padding': 1},
+                    OptimizeResult(thickness=5.), timestamp=0.)
+
+    with ResultCatalog(tmp_path / 'catalog.db') as catalog:
+        results = catalog.query(method='scheludko')
+        assert_equal(results['spectrum'], spectra)
+        assert_allclose(results['thickness'], batch.thickness)
+        assert_equal(results['interference_order'], batch.interference_order)
+        assert results['status'][4] == STATUS_FAILED
+
+        sample1 = catalog.query(sample='sample1', time_start=2, time_stop=8)
+        assert_equal(sample1['spectrum'], spectra[3:8:2])
+
+        first = catalog.query(spectrum=spectra[0])
+        assert sorted(first['method']) == ['fft', 'scheludko']
+
+        assert len(catalog.query(method='fft', parameters={'N_padding': 1})['thickness']) == 1
+        assert len(catalog.query(method='fft', parameters={'N_padding': 2})['thickness']) == 0
+        assert catalog.parameter_sets('fft') == \
+            {parameter_hash('fft', {'N_padding': 1}): {'N_padding': 1}}
+
+        # Same spectrum, method and parameters: replaced
+        catalog.add(spectra[0], 'fft', {'N_padding': 1}, OptimizeResult(thickness=6.))
+        assert_allclose(catalog.query(method='fft')['thickness'], [6.])
+
+        with pytest.raises(ValueError):
+            catalog.query(parameters={'N_padding': 1})
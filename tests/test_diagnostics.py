@@ -0,0 +1,78 @@
+import pytest
+
+import numpy as np
+from numpy.testing import assert_equal
+
+from optifik.diagnostics import select_spectra, render_diagnostics, DiagnosticFigure
+from optifik.batch import _analyse
+from optifik.results import BatchResult, STATUS_FAILED
+
+
+def n_lambda(lmbda):
+    return 1.324188 + 3102.060378 / (lmbda**2)
+
+
+def compute_spectrum_theory(h, lambdas, n_values):
+    sin_term = np.sin(2 * np.pi * n_values * h / lambdas) ** 2
+    denominator = (2 * n_values / (n_values**2 - 1)) ** 2 + sin_term
+    return sin_term / denominator
+
+
+@pytest.fixture
+def stack():
+    lambdas = np.linspace(450, 800, 500)
+    n_values = n_lambda(lambdas)
+    intensities = np.array([compute_spectrum_theory(h, lambdas, n_values)
+                            for h in np.linspace(400, 900, 6)])
+    # No extremum
+    intensities[3] = 0.5
+    return lambdas, intensities, n_values
+
+
+def test_select_spectra():
+    assert_equal(select_spectra(5), np.arange(5))
+    assert_equal(select_spectra(101, max_plots=11), np.arange(0, 101, 10))
+    priority = np.zeros(100, dtype=bool)
+    priority[[13, 57]] = True
+    selected = select_spectra(100, max_plots=4, priority=priority)
+    assert len(selected) == 4
+    assert {13, 57} <= set(selected)
+
+
+@pytest.mark.parametrize('method', ['fft', 'minmax', 'scheludko'])
+def test_figure_reused(stack, method):
+    lambdas, intensities, n_values = stack
+    figure = DiagnosticFigure(method)
+    lines = list(figure.ax_method.lines)
+    kwargs = {} if method == 'fft' else {'min_peak_prominence': None}
+    for idx, spectrum in enumerate(intensities):
+        result, plot_data = _analyse(method, lambdas, spectrum, n_values,
+                                     errors='coerce', **kwargs)
+        figure.draw(idx, lambdas, spectrum, result, plot_data)
+        figure.figure.canvas.draw()
+    assert list(figure.ax_method.lines) == lines
+    assert figure.ax_spectrum.get_title().startswith('Spectrum 5')
+
+
+def test_render_png(stack, tmp_path):
+    lambdas, intensities, n_values = stack
+    results = BatchResult(len(intensities))
+    results.status[3] = STATUS_FAILED
+    paths = render_diagnostics('scheludko', lambdas, intensities, n_values,
+                               tmp_path / 'plots', max_plots=2, results=results,
+                               max_workers=1, page_size=1, min_peak_prominence=None)
+    assert [p.rsplit('/', 1)[1] for p in paths] == ['spectrum_000000.png',
+                                                    'spectrum_000003.png']
+    assert all((tmp_path / 'plots' / name).stat().st_size > 0
+               for name in ('spectrum_000000.png', 'spectrum_000003.png'))
+
+
+def test_render_pdf_pages(stack, tmp_path):
+    lambdas, intensities, n_values = stack
+    paths = render_diagnostics('fft', lambdas, intensities, n_values, tmp_path,
+                               file_format='pdf', page_size=4, max_workers=2)
+    assert [p.rsplit('/', 1)[1] for p in paths] == ['diagnostics_0000.pdf',
+                                                    'diagnostics_0001.pdf']
+    with pytest.raises(ValueError):
+        render_diagnostics('fft', lambdas, intensities, n_values, tmp_path,
+                           file_format='bmp')
@@ -0,0 +1,141 @@
+import pickle
+
+import pytest
+
+import numpy as np
+from numpy.testing import assert_allclose, assert_equal
+
+from optifik.dispersion import RefractiveIndex
+from optifik.dispersion import ConstantIndex, CauchyIndex, SellmeierIndex, TabulatedIndex
+from optifik.batch import thickness_batch, thickness_batch_shared
+from optifik.catalog import parameter_hash
+from optifik.fft import thickness_from_fft
+from optifik.minmax import thickness_from_minmax
+from optifik.scheludko import thickness_from_scheludko
+from optifik.scheludko import get_default_start_stop_wavelengths
+
+
+WATER = (1.324188, 3102.060378)
+
+
+def compute_spectrum_theory(h, lambdas, n_values):
+    sin_term = np.sin(2 * np.pi * n_values * h / lambdas) ** 2
+    denominator = (2 * n_values / (n_values**2 - 1)) ** 2 + sin_term
+    return sin_term / denominator
+
+
+@pytest.fixture
+def lambdas():
+    return np.linspace(450, 800, 1_000)
+
+
+def test_models(lambdas):
+    assert_equal(ConstantIndex(1.33)(lambdas), np.full_like(lambdas, 1.33))
+    assert_allclose(CauchyIndex(*WATER)(lambdas), WATER[0] + WATER[1] / lambdas**2)
+    assert_allclose(CauchyIndex(1.5, 0, 1e9)(lambdas), 1.5 + 1e9 / lambdas**4)
+
+    # Fused silica (Malitson)
+    silica = SellmeierIndex([0.6961663, 0.4079426, 0.8974794],
+                            [0.0684043**2, 0.1162414**2, 9.896161**2])
+    assert_allclose(silica(np.array([587.6])), [1.4585], atol=1e-4)
+    with pytest.raises(ValueError):
+        SellmeierIndex([1., 2.], [1.])
+
+
+def test_incomplete_model():
+    class NoEvaluate(RefractiveIndex):
+        @property
+        def parameters(self):
+            return {}
+
+    class NoParameters(RefractiveIndex):
+        def evaluate(self, wavelengths):
+            return np.ones_like(wavelengths)
+
+    for model in (RefractiveIndex, NoEvaluate, NoParameters):
+        with pytest.raises(TypeError):
+            model()
+
+
+def test_tabulated(lambdas, tmp_path):
+    table = np.column_stack([[800, 400, 600], [1.32, 1.34, 1.33]])
+    path = tmp_path / 'index.csv'
+    np.savetxt(path, table, delimiter=',')
+    model = TabulatedIndex.from_file(path)
+    assert_allclose(model(np.array([400, 500, 700, 800])), [1.34, 1.335, 1.325, 1.32])
+    with pytest.raises(ValueError):
+        model(np.array([300., 500.]))
+    with pytest.raises(ValueError):
+        TabulatedIndex([400], [1.33])
+
+
+def test_memoisation(lambdas):
+    model = CauchyIndex(*WATER)
+    n_values = model(lambdas)
+    # Same content, another array
+    assert model(lambdas.copy()) is n_values
+    assert model.n_over_lambda(lambdas) is model.n_over_lambda(lambdas)
+    assert_allclose(model.n_over_lambda(lambdas), n_values / lambdas)
+    assert_allclose(model.alpha(lambdas), (n_values**2 - 1)**2 / (4 * n_values**2))
+    with pytest.raises(ValueError):
+        n_values[0] = 1.
+
+    # Modified grid
+    other = lambdas.copy()
+    other[500] += 0.1
+    assert model(other) is not n_values
+    assert_allclose(model(other)[500], WATER[0] + WATER[1] / other[500]**2)
+
+    for num in range(model.max_grids):
+        model(lambdas + num + 1)
+    assert model(lambdas) is not n_values
+
+    copy = pickle.loads(pickle.dumps(model))
+    assert len(copy._cache) == 0
+    assert_equal(copy(lambdas), model(lambdas))
+
+
+def test_methods_accept_models(lambdas):
+    model = CauchyIndex(*WATER)
+    n_values = WATER[0] + WATER[1] / lambdas**2
+    intensities = compute_spectrum_theory(700, lambdas, n_values)
+    w_start, w_stop = get_default_start_stop_wavelengths(lambdas, intensities, model,
+                                                         min_peak_prominence=None)
+
+    for refractive_index in (model, n_values):
+        fft = thickness_from_fft(lambdas, intensities, refractive_index)
+        minmax = thickness_from_minmax(lambdas, intensities, refractive_index,
+                                       min_peak_prominence=None)
+        scheludko = thickness_from_scheludko(lambdas, intensities, refractive_index,
+                                             wavelength_start=w_start,
+                                             wavelength_stop=w_stop)
+        # The FFT is coarse for a few fringes
+        assert_allclose(fft.thickness, 700, rtol=1e-1)
+        assert_allclose([minmax.thickness, scheludko.thickness], 700, rtol=2e-2)
+        if refractive_index is model:
+            expected = (fft.thickness, minmax.thickness, scheludko.thickness)
+    assert_allclose((fft.thickness, minmax.thickness, scheludko.thickness), expected)
+
+    constant = thickness_from_scheludko(lambdas, intensities, ConstantIndex(1.33),
+                                        wavelength_start=w_start, wavelength_stop=w_stop)
+    scalar = thickness_from_scheludko(lambdas, intensities, 1.33,
+                                      wavelength_start=w_start, wavelength_stop=w_stop)
+    assert_allclose(constant.thickness, scalar.thickness)
+
+
+def test_batch_with_model(lambdas):
+    model = CauchyIndex(*WATER)
+    n_values = model(lambdas)
+    intensities = np.array([compute_spectrum_theory(h, lambdas, n_values)
+                            for h in (500, 600, 700, 800)])
+    expected = thickness_batch('fft', lambdas, intensities, n_values)
+    result = thickness_batch_shared('fft', lambdas, intensities, model,
+                                    max_workers=2, chunk_size=2)
+    assert_allclose(result.thickness, [r.thickness for r in expected])
+
+
+def test_parameter_hash_of_models():
+    assert parameter_hash('fft', {'refractive_index': CauchyIndex(*WATER)}) == \
+        parameter_hash('fft', {'refractive_index': CauchyIndex(*WATER)})
+    assert parameter_hash('fft', {'refractive_index': CauchyIndex(*WATER)}) != \
+        parameter_hash('fft', {'refractive_index': CauchyIndex(1.33)})
@@ -162,3 +162,18 @@ def test_FFT_data_Lorene(spectrum_path, expected):
 
 
     assert_allclose(result.thickness, expected, rtol=1e-1)
+
+
+def test_FFT_timings():
+    lambdas = np.linspace(450, 800, 1_000)
+    n_values = n_lambda(lambdas)
+    intensities = compute_spectrum_theory(3_000, lambdas, n_values)
+
+    result = thickness_from_fft(lambdas, intensities, n_values, N_padding=4)
+    assert 'timings' not in result
+
+    result = thickness_from_fft(lambdas, intensities, n_values, N_padding=4,
+                                timings=True)
+    assert set(result.timings) == {'interpolation', 'fft', 'padded_fft', 'total'}
+    assert all(stage['time'] >= 0 for stage in result.timings.values())
+    assert 'allocated_blocks' in result.timings['fft']
@@ -0,0 +1,143 @@
+import os
+import time
+import multiprocessing
+from pathlib import Path
+
+import pytest
+
+import numpy as np
+from numpy.testing import assert_allclose
+
+from optifik import jobqueue
+from optifik.minmax import thickness_from_minmax
+from optifik.analysis import smooth_intensities
+from optifik.io import load_spectrum
+from optifik.dispersion import CauchyIndex, TabulatedIndex
+from optifik.results import STATUS_OK, STATUS_FAILED, STATUS_NO_EXTREMUM
+
+
+def spectrum_paths():
+    folder = Path(__file__).parent.parent / 'data' / 'spectraVictor1'
+    return sorted(folder.glob('*.xy'))
+
+
+def expected_thicknesses(paths):
+    values = []
+    for path in paths:
+        lambdas, intensities = load_spectrum(path, wavelength_min=450)
+        result = thickness_from_minmax(lambdas, smooth_intensities(intensities),
+                                       refractive_index=1.33,
+                                       min_peak_prominence=0.02)
+        values.append(result.thickness)
+    return values
+
+
+def test_jobqueue_several_workers(tmp_path):
+    paths = spectrum_paths()
+    job_dir = tmp_path / 'job'
+    num_chunks = jobqueue.submit_job(job_dir, paths, 'minmax', 1.33,
+                                     chunk_size=4, wavelength_min=450,
+                                     smooth=True, min_peak_prominence=0.02)
+    assert num_chunks == 7
+
+    workers = [multiprocessing.Process(target=jobqueue.run_worker,
+                                       args=(job_dir,),
+                                       kwargs={'worker_id': f'w{idx}'})
+               for idx in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert jobqueue.job_status(job_dir) == {'todo': 0, 'running': 0, 'done': 7}
+    results = jobqueue.collect_results(job_dir)
+    assert results.path == [str(path) for path in paths]
+    assert_allclose(results.thickness, expected_thicknesses(paths))
+    assert all(message == '' for message in results.message)
+
+
+def test_jobqueue_recover_crashed_worker(tmp_path):
+    paths = spectrum_paths()[:6]
+    job_dir = tmp_path / 'job'
+    jobqueue.submit_job(job_dir, paths, 'minmax', 1.33,
+                        chunk_size=3, wavelength_min=450,
+                        smooth=True, min_peak_prominence=0.02)
+
+    # A worker claims a chunk and dies
+    crashed = job_dir / 'running' / 'chunk-000000.json.crashed'
+    os.rename(job_dir / 'todo' / 'chunk-000000.json', crashed)
+
+    assert jobqueue.run_worker(job_dir, stale_timeout=60) == 1
+    assert jobqueue.job_status(job_dir)['running'] == 1
+
+    old = time.time() - 120
+    os.utime(crashed, (old, old))
+    assert jobqueue.run_worker(job_dir, stale_timeout=60) == 1
+
+    results = jobqueue.collect_results(job_dir)
+    assert_allclose(results.thickness, expected_thicknesses(paths))
+
+
+def test_jobqueue_failures_are_recorded(tmp_path):
+    job_dir = tmp_path / 'job'
+    paths = [tmp_path / 'missing.xy'] + spectrum_paths()[:1]
+    jobqueue.submit_job(job_dir, paths, 'minmax', 1.33, wavelength_min=450,
+                        min_peak_prominence=0.02)
+    jobqueue.run_worker(job_dir)
+    results = jobqueue.collect_results(job_dir)
+    assert np.isnan(results.thickness[0])
+    assert results.message[0].startswith('FileNotFoundError')
+    assert results.message[1] == ''
+    assert list(results.status) == [STATUS_FAILED, STATUS_OK]
+
+
+def test_jobqueue_failure_status(tmp_path):
+    job_dir = tmp_path / 'job'
+    flat = tmp_path / 'flat.xy'
+    np.savetxt(flat, np.column_stack([np.linspace(450, 800, 100), np.full(100, 0.5)]),
+               delimiter=',')
+    jobqueue.submit_job(job_dir, [flat], 'scheludko', 1.33, min_peak_prominence=0.02)
+    jobqueue.run_worker(job_dir)
+    results = jobqueue.collect_results(job_dir)
+    assert list(results.status) == [STATUS_NO_EXTREMUM]
+    assert results.message[0]
+
+
+def test_jobqueue_models_and_arrays(tmp_path):
+    paths = spectrum_paths()[:2]
+    lambdas, _ = load_spectrum(paths[0], wavelength_min=450)
+    model = CauchyIndex(1.324188, 3102.060378)
+    expected = [thickness_from_minmax(lambdas, load_spectrum(path, wavelength_min=450)[1],
+                                      refractive_index=model(lambdas),
+                                      min_peak_prominence=0.02).thickness
+                for path in paths]
+
+    for idx, refractive_index in enumerate((model, model(lambdas),
+                                            TabulatedIndex(lambdas, model(lambdas)))):
+        job_dir = tmp_path / f'job{idx}'
+        jobqueue.submit_job(job_dir, paths, 'minmax', refractive_index, wavelength_min=450,
+                            min_peak_prominence=np.float64(0.02))
+        jobqueue.run_worker(job_dir, metrics_file=tmp_path / f'metrics{idx}.json',
+                            worker_id='w')
+        results = jobqueue.collect_results(job_dir)
+        assert list(results.status) == [STATUS_OK, STATUS_OK]
+        assert_allclose(results.thickness, expected)
+        # One metrics file per worker
+        assert (tmp_path / f'metrics{idx}.w.json').exists()
+
+    with pytest.raises(TypeError):
+        jobqueue.submit_job(tmp_path / 'invalid', paths, 'minmax', lambda w: 1.33 + 0 * w)
+    assert not (tmp_path / 'invalid').exists()
+
+
+def test_claimed_chunk_of_old_job_is_not_stale(tmp_path):
+    job_dir = tmp_path / 'job'
+    jobqueue.submit_job(job_dir, spectrum_paths()[:2], 'minmax', 1.33, chunk_size=1)
+    old = time.time() - 120
+    for path in (job_dir / 'todo').iterdir():
+        os.utime(path, (old, old))
+
+    _, running_path = jobqueue._claim_chunk(job_dir, 'w0')
+    assert jobqueue.recover_stale_chunks(job_dir, stale_timeout=60) == []
+    assert os.path.exists(running_path)
+    assert jobqueue.job_status(job_dir) == {'todo': 1, 'running': 1, 'done': 0}
@@ -0,0 +1,55 @@
+import pytest
+
+import numpy as np
+from numpy.testing import assert_equal
+
+from optifik.utils import OptimizeResult
+from optifik.synthetic import reflectance
+from optifik.live import downsample, LiveViewer
+
+
+@pytest.fixture
+def agg():
+    import matplotlib
+    import matplotlib.pyplot as plt
+    backend = matplotlib.get_backend()
+    plt.switch_backend('Agg')
+    yield
+    plt.close('all')
+    plt.switch_backend(backend)
+
+
+def test_downsample():
+    times = np.arange(10_000.)
+    values = np.sin(times / 100)
+    values[5_000] = 10.
+    values[7_000] = np.nan
+    t, v = downsample(times, values, 200)
+    assert len(t) <= 200
+    assert np.all(np.diff(t) >= 0)
+    assert v.max() == 10.
+    assert v.min() == values[np.isfinite(values)].min()
+    assert np.all(np.isfinite(v))
+
+    t, v = downsample(times[:5], values[:5], 200)
+    assert_equal(t, times[:5])
+
+
+def test_viewer(agg):
+    wavelengths = np.linspace(450, 800, 300)
+    viewer = LiveViewer('fft', 1.33, max_points=100)
+    assert not viewer.refresh()
+
+    for idx, h in enumerate(np.linspace(1_000, 1_010, 500)):
+        intensities = reflectance(h, wavelengths, 1.33)
+        viewer.update(OptimizeResult(thickness=h, thickness_uncertainty=1.),
+                      timestamp=1000. + idx, spectrum=(wavelengths, intensities))
+        if idx % 5 == 0:
+            assert viewer.refresh()
+    # Limits enlarged with a margin: most refreshes only blit
+    assert viewer.num_blits > viewer.num_full_draws
+    assert len(viewer.history_line.get_xdata()) <= 100
+    assert viewer.spectrum.ax_spectrum.get_title().startswith('Spectrum 495')
+    assert viewer.refresh()
+    assert viewer.spectrum.ax_spectrum.get_title().startswith('Spectrum 499')
+    assert not viewer.refresh()
@@ -0,0 +1,117 @@
+import json
+import threading
+
+import pytest
+import numpy as np
+
+from optifik.metrics import MetricsRegistry, REGISTRY
+from optifik.fft import thickness_from_fft
+from optifik.minmax import thickness_from_minmax
+from optifik.scheludko import thickness_from_scheludko
+from optifik.scheludko import get_default_start_stop_wavelengths
+from optifik.batch import analyse_spectrum, thickness_batch_shared
+
+
+@pytest.fixture
+def registry():
+    REGISTRY.reset()
+    yield REGISTRY
+    REGISTRY.reset()
+
+
+def test_registry_threads():
+    registry = MetricsRegistry(buckets=(0.1, 1.))
+
+    def work():
+        for _ in range(1_000):
+            registry.inc('calls', method='a')
+            registry.observe('latency', 0.5, method='a')
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert registry.counter_value('calls', method='a') == 4_000
+    snapshot = registry.snapshot()
+    assert snapshot['histograms'][0]['counts'] == [0, 4_000, 0]
+    assert snapshot['histograms'][0]['sum'] == pytest.approx(2_000)
+
+
+def test_registry_merge_and_export(tmp_path):
+    registry = MetricsRegistry(buckets=(0.1, 1.))
+    registry.inc('calls', method='a')
+    registry.observe('latency', 0.05, method='a')
+    registry.observe('latency', 5., method='a')
+
+    other = MetricsRegistry(buckets=(0.1, 1.))
+    other.merge(json.loads(json.dumps(registry.snapshot())))
+    other.merge(registry.snapshot(reset=True))
+    assert registry.snapshot()['counters'] == []
+    assert other.counter_value('calls', method='a') == 2
+
+    text = other.to_prometheus()
+    assert 'calls{method="a"} 2' in text
+    assert 'latency_bucket{method="a",le="0.1"} 2' in text
+    assert 'latency_bucket{method="a",le="+Inf"} 4' in text
+    assert 'latency_count{method="a"} 4' in text
+
+    other.write(tmp_path / 'metrics.prom')
+    assert (tmp_path / 'metrics.prom').read_text() == text
+    other.write(tmp_path / 'metrics.json')
+    assert json.loads((tmp_path / 'metrics.json').read_text()) == other.snapshot()
+
+    with pytest.raises(ValueError):
+        MetricsRegistry(buckets=(1.,)).merge(other.snapshot())
+
+
+def n_lambda(lmbda):
+    return 1.324188 + 3102.060378 / (lmbda**2)
+
+
+def compute_spectrum_theory(h, lambdas, n_values):
+    sin_term = np.sin(2 * np.pi * n_values * h / lambdas) ** 2
+    denominator = (2 * n_values / (n_values**2 - 1)) ** 2 + sin_term
+    return sin_term / denominator
+
+
+def test_analysis_metrics(registry):
+    lambdas = np.linspace(450, 800, 1_000)
+    n_values = n_lambda(lambdas)
+
+    thickness_from_fft(lambdas, compute_spectrum_theory(3_000, lambdas, n_values), n_values)
+    with pytest.warns(RuntimeWarning):
+        thickness_from_minmax(lambdas, compute_spectrum_theory(100, lambdas, n_values),
+                              n_values, min_peak_prominence=None)
+    # Not an analysis: not counted
+    with pytest.raises(RuntimeError):
+        get_default_start_stop_wavelengths(lambdas, np.ones_like(lambdas), n_values,
+                                           min_peak_prominence=None)
+    with pytest.raises(RuntimeError):
+        analyse_spectrum('scheludko', lambdas, np.ones_like(lambdas), n_values)
+    analyse_spectrum('scheludko', lambdas, np.ones_like(lambdas), n_values, errors='coerce')
+    with pytest.raises(ValueError):
+        thickness_from_scheludko(lambdas, np.ones_like(lambdas), n_values,
+                                 wavelength_start=600, wavelength_stop=500)
+
+    assert registry.counter_value('optifik_spectra_total', method='fft') == 1
+    assert registry.counter_value('optifik_spectra_total', method='minmax') == 1
+    assert registry.counter_value('optifik_failures_total', method='minmax',
+                                  reason='too_few_peaks') == 1
+    assert registry.counter_value('optifik_spectra_total', method='scheludko') == 3
+    assert registry.counter_value('optifik_failures_total', method='scheludko',
+                                  reason='no_extremum') == 2
+    assert registry.counter_value('optifik_failures_total', method='scheludko',
+                                  reason='invalid_input') == 1
+    assert 'optifik_analysis_seconds_count{method="fft"} 1' in registry.to_prometheus()
+
+
+def test_shared_batch_metrics(registry):
+    lambdas = np.linspace(450, 800, 1_000)
+    n_values = n_lambda(lambdas)
+    intensities = np.array([compute_spectrum_theory(h, lambdas, n_values)
+                            for h in np.linspace(2_000, 4_000, 6)])
+    thickness_batch_shared('fft', lambdas, intensities, n_values,
+                           max_workers=2, chunk_size=2)
+    assert registry.counter_value('optifik_spectra_total', method='fft') == 6
@@ -144,3 +144,14 @@ def test_minmax_linreg_data_basic(test_data_dir):
     tol = 1e-1
     assert_allclose(result.thickness, expected, rtol=tol)
     assert result.thickness_uncertainty / result.thickness < tol
+
+
+def test_minmax_timings():
+    lambdas = np.linspace(450, 800, 1_000)
+    n_values = n_lambda(lambdas)
+    intensities = compute_spectrum_theory(2_000, lambdas, n_values)
+
+    result = thickness_from_minmax(lambdas, intensities, n_values,
+                                   min_peak_prominence=None,
+                                   method='ransac', timings=True)
+    assert set(result.timings) == {'peak_detection', 'regression', 'total'}
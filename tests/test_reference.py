@@ -0,0 +1,98 @@
+import pickle
+from pathlib import Path
+
+import pytest
+
+import numpy as np
+from numpy.testing import assert_allclose, assert_equal
+
+from optifik.reference import ReferenceSpectrum
+from optifik.batch import thickness_batch, thickness_batch_shared
+from optifik.cache import ResultCache
+from optifik.io import load_spectrum
+from optifik.analysis import smooth_intensities
+from optifik.scheludko import thickness_from_scheludko
+
+
+@pytest.fixture
+def order0_data():
+    folder = Path(__file__).parent.parent / 'data' / 'spectraVictor2'
+    spectra = [smooth_intensities(load_spectrum(path, wavelength_min=450)[1])
+               for path in sorted((folder / 'order0').glob('*.xy'))[:4]]
+    lambdas, void = load_spectrum(folder / 'void.xy', wavelength_min=450)
+    return lambdas, np.array(spectra), void, folder / 'void.xy'
+
+
+def test_resample():
+    lambdas = np.linspace(400, 800, 401)
+    reference = ReferenceSpectrum(lambdas, lambdas / 100)
+    assert_equal(reference.resample(lambdas), reference.intensities)
+    assert_allclose(reference.resample(np.array([450.5, 700.25])), [4.505, 7.0025])
+
+    resampled = reference.resample(np.linspace(450, 750, 20))
+    assert reference.resample(np.linspace(450, 750, 20)) is resampled
+    with pytest.raises(ValueError):
+        resampled[0] = 0.
+    with pytest.raises(ValueError):
+        reference.resample(np.array([390., 500.]))
+    with pytest.raises(ValueError):
+        ReferenceSpectrum(lambdas, lambdas[:-1])
+
+
+def test_minimum_from():
+    rng = np.random.default_rng(0)
+    lambdas = np.linspace(400, 800, 401)
+    reference = ReferenceSpectrum(lambdas, rng.random(401))
+    for grid in (np.linspace(420, 780, 300), rng.permutation(np.linspace(420, 780, 300))):
+        intensities = reference.resample(grid)
+        for start in (300., 420., 421.3, 600., 780.):
+            assert reference.minimum_from(grid, start) == \
+                np.min(intensities[grid >= start])
+        assert np.isnan(reference.minimum_from(grid, 790.))
+
+
+def test_pickle():
+    lambdas = np.linspace(400, 800, 401)
+    reference = ReferenceSpectrum(lambdas, lambdas / 100)
+    reference.resample(lambdas[::2])
+    copy = pickle.loads(pickle.dumps(reference))
+    assert len(copy._cache) == 0
+    assert_equal(copy.resample(lambdas[::2]), reference.resample(lambdas[::2]))
+
+
+def test_scheludko_order0(order0_data):
+    lambdas, intensities, void, void_path = order0_data
+    reference = ReferenceSpectrum.from_file(void_path, wavelength_min=450)
+    r_index = 1.324188 + 3102.060378 / (lambdas**2)
+    for spectrum in intensities:
+        expected = thickness_from_scheludko(lambdas, spectrum, r_index,
+                                            interference_order=0,
+                                            intensities_void=void)
+        result = thickness_from_scheludko(lambdas, spectrum, r_index,
+                                          interference_order=0,
+                                          intensities_void=reference)
+        assert_allclose(result.thickness, expected.thickness, rtol=1e-12)
+    # One resampling for all the spectra
+    assert len(reference._cache) == 1
+
+
+def test_batch_order0(order0_data):
+    lambdas, intensities, void, void_path = order0_data
+    reference = ReferenceSpectrum.from_file(void_path, wavelength_min=450)
+    r_index = 1.324188 + 3102.060378 / (lambdas**2)
+    expected = thickness_batch('scheludko', lambdas, intensities, r_index,
+                               interference_order=0, intensities_void=void)
+    result = thickness_batch_shared('scheludko', lambdas, intensities, r_index,
+                                    max_workers=2, chunk_size=2,
+                                    interference_order=0, intensities_void=reference)
+    assert_allclose(result.thickness, [r.thickness for r in expected], rtol=1e-12)
+
+
+def test_cache_key(tmp_path):
+    lambdas = np.linspace(400, 800, 401)
+    cache = ResultCache(tmp_path)
+    keys = [cache.key('scheludko', lambdas, lambdas, 1.33,
+                      intensities_void=ReferenceSpectrum(lambdas, lambdas / scale))
+            for scale in (100, 100, 200)]
+    assert keys[0] == keys[1]
+    assert keys[0] != keys[2]
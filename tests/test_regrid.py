@@ -0,0 +1,95 @@
+import pytest
+
+import numpy as np
+from numpy.testing import assert_allclose, assert_equal
+
+from optifik.regrid import Regridder, common_grid
+from optifik.batch import thickness_batch
+
+
+def compute_spectrum_theory(h, lambdas, n_values):
+    sin_term = np.sin(2 * np.pi * n_values * h / lambdas) ** 2
+    denominator = (2 * n_values / (n_values**2 - 1)) ** 2 + sin_term
+    return sin_term / denominator
+
+
+@pytest.fixture
+def grids():
+    rng = np.random.default_rng(0)
+    grid_a = np.linspace(400, 800, 1200)
+    # Irregular and decreasing
+    grid_b = np.sort(rng.uniform(420, 780, 900))[::-1]
+    return grid_a, grid_b
+
+
+def test_common_grid(grids):
+    grid = common_grid(grids)
+    assert grid[0] == grids[1].min()
+    assert grid[-1] == grids[1].max()
+    assert len(grid) == 1200
+    assert len(common_grid(grids, num=10)) == 10
+    with pytest.raises(ValueError):
+        common_grid([np.linspace(400, 500, 10), np.linspace(600, 700, 10)])
+
+
+def test_resample(grids):
+    grid_a, grid_b = grids
+    regridder = Regridder(np.linspace(410, 790, 500))
+    intensities = np.random.default_rng(1).random((3, len(grid_b)))
+    result = regridder.resample(grid_b, intensities)
+    order = np.argsort(grid_b)
+    inside = (regridder.wavelengths >= grid_b.min()) & (regridder.wavelengths <= grid_b.max())
+    for row, spectrum in zip(result, intensities):
+        assert_allclose(row[inside],
+                        np.interp(regridder.wavelengths[inside], grid_b[order], spectrum[order]))
+        assert np.all(np.isnan(row[~inside]))
+
+    # One spectrum
+    assert_allclose(regridder.resample(grid_b, intensities[0]), result[0])
+    # Memoised operator
+    assert regridder.operator(grid_b.copy())[0] is regridder.operator(grid_b)[0]
+
+    with pytest.raises(ValueError):
+        regridder.resample(grid_a, intensities)
+    with pytest.raises(ValueError):
+        regridder.operator(np.array([400., 500., 500.]))
+
+
+def test_regrid(grids):
+    grid_a, grid_b = grids
+    rng = np.random.default_rng(2)
+    regridder = Regridder(common_grid(grids))
+    stack_a = rng.random((4, len(grid_a)))
+    stack_b = rng.random((3, len(grid_b)))
+    spectra = [(grid_a, stack_a[0]), (grid_b.copy(), stack_b[0]), (grid_a, stack_a[1:3]),
+               (grid_b.copy(), stack_b[1:]), (grid_a.copy(), stack_a[3])]
+    result = regridder.regrid(spectra)
+    expected = np.concatenate([np.atleast_2d(regridder.resample(*spectrum))
+                               for spectrum in spectra])
+    assert_equal(result, expected)
+    assert not np.any(np.isnan(result))
+
+    out = np.empty_like(result)
+    assert regridder.regrid(spectra, out=out) is out
+    with pytest.raises(ValueError):
+        regridder.regrid(spectra, out=out[1:])
+
+    # Contiguous groups
+    assert_equal(regridder.regrid([(grid_a, stack_a), (grid_b, stack_b)]),
+                 np.concatenate([regridder.resample(grid_a, stack_a),
+                                 regridder.resample(grid_b, stack_b)]))
+
+
+def test_batch_on_common_grid(grids):
+    grid_a, grid_b = grids
+    spectra = []
+    for h, grid in zip((500, 600, 700, 800), (grid_a, grid_b, grid_a, grid_b)):
+        n_values = 1.324188 + 3102.060378 / grid**2
+        spectra.append((grid, compute_spectrum_theory(h, grid, n_values)))
+    regridder = Regridder(common_grid(grids))
+    stack = regridder.regrid(spectra)
+    n_values = 1.324188 + 3102.060378 / regridder.wavelengths**2
+    results = thickness_batch('minmax', regridder.wavelengths, stack, n_values,
+                              min_peak_prominence=None)
+    assert_allclose([result.thickness for result in results], [500, 600, 700, 800],
+                    rtol=2e-2)
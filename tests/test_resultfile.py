@@ -0,0 +1,124 @@
+import pytest
+
+import numpy as np
+from numpy.testing import assert_allclose, assert_equal
+
+from optifik.utils import OptimizeResult
+from optifik.results import BatchResult, STATUS_OK, STATUS_FAILED
+from optifik.resultfile import ResultWriter, ResultReader
+
+
+def make_batch(num_spectra, start=0):
+    thickness = np.arange(start, start + num_spectra, dtype=float)
+    thickness[::7] = np.nan
+    return BatchResult(num_spectra,
+                       thickness=thickness,
+                       thickness_uncertainty=thickness / 100,
+                       interference_order=np.arange(num_spectra) % 5,
+                       status=np.where(np.isnan(thickness), STATUS_FAILED, STATUS_OK))
+
+
+def test_write_read(tmp_path):
+    path = tmp_path / 'results.bin'
+    batch = make_batch(100)
+    with ResultWriter(path, chunk_size=16) as writer:
+        writer.extend(batch, timestamps=np.arange(100.))
+        writer.append(OptimizeResult(thickness=123.), timestamp=100.)
+        assert len(writer) == 101
+
+    reader = ResultReader(path)
+    assert reader.complete
+    assert len(reader) == 101
+    assert_allclose(reader['thickness'][:100], batch.thickness)
+    assert reader['thickness'][100] == 123.
+    assert_equal(reader['interference_order'][:100], batch.interference_order)
+    assert reader['interference_order'][100] == -1
+    assert_equal(reader['status'][:100], batch.status)
+    assert_allclose(reader.column('timestamp', 30, 50), np.arange(30., 50.))
+    assert [len(chunk) for chunk in reader.chunks('thickness')] == [16] * 6 + [5]
+
+
+def test_append_to_existing(tmp_path):
+    path = tmp_path / 'results.bin'
+    with ResultWriter(path, chunk_size=8) as writer:
+        writer.extend(make_batch(10), timestamps=np.arange(10.))
+    with ResultWriter(path, chunk_size=64) as writer:
+        assert writer.chunk_size == 8
+        writer.extend(make_batch(5, start=10), timestamps=np.arange(10., 15.))
+
+    reader = ResultReader(path)
+    assert len(reader) == 15
+    expected = np.concatenate([make_batch(10).thickness, make_batch(5, start=10).thickness])
+    assert_allclose(reader['thickness'], expected)
+    assert_allclose(reader['timestamp'], np.arange(15.))
+
+
+def test_interrupted_file(tmp_path):
+    path = tmp_path / 'results.bin'
+    writer = ResultWriter(path, chunk_size=8)
+    writer.extend(make_batch(20), timestamps=np.arange(20.))
+
+    # Two complete chunks, no footer: the last rows are still buffered
+    reader = ResultReader(path)
+    assert not reader.complete
+    assert len(reader) == 16
+
+    # A chunk cut by a crash is ignored
+    writer.flush()
+    size = path.stat().st_size
+    with open(path, 'r+b') as fh:
+        fh.truncate(size - 10)
+    assert len(ResultReader(path)) == 16
+
+    # And dropped when appending
+    with ResultWriter(path) as writer:
+        writer.extend(make_batch(3), timestamps=np.arange(16., 19.))
+    reader = ResultReader(path)
+    assert reader.complete
+    assert_allclose(reader['timestamp'], np.arange(19.))
+
+
+def test_flush_interval(tmp_path):
+    path = tmp_path / 'results.bin'
+    with ResultWriter(path, chunk_size=8, flush_interval=0) as writer:
+        writer.append(OptimizeResult(thickness=1.))
+        assert len(ResultReader(path)) == 1
+
+
+def test_flushed_chunks_hold_only_their_rows(tmp_path):
+    path = tmp_path / 'results.bin'
+    with ResultWriter(path, chunk_size=1024, flush_interval=0) as writer:
+        for num in range(3):
+            writer.append(OptimizeResult(thickness=float(num)), timestamp=num)
+        size = path.stat().st_size
+    # Three chunks of one row, not of 1024 rows
+    assert size < 3 * 1024
+    reader = ResultReader(path)
+    assert reader.complete
+    assert_equal(reader['thickness'], [0., 1., 2.])
+    assert [len(chunk) for chunk in reader.chunks('timestamp')] == [1, 1, 1]
+
+
+def test_rows_between(tmp_path):
+    path = tmp_path / 'results.bin'
+    with ResultWriter(path, chunk_size=8) as writer:
+        writer.extend(make_batch(50), timestamps=np.arange(50.) * 2)
+    reader = ResultReader(path)
+    start, stop = reader.rows_between(21, 40)
+    assert_allclose(reader.column('timestamp', start, stop), np.arange(22., 41., 2))
+    assert reader.rows_between(200, 300) == (0, 0)
+
+
+def test_empty_and_invalid(tmp_path):
+    path = tmp_path / 'results.bin'
+    ResultWriter(path).close()
+    reader = ResultReader(path)
+    assert len(reader) == 0
+    assert len(reader['thickness']) == 0
+
+    other = tmp_path / 'other.bin'
+    other.write_bytes(b'not a result file')
+    with pytest.raises(ValueError):
+        ResultReader(other)
+    with pytest.raises(ValueError):
+        ResultWriter(tmp_path / 'new.bin', chunk_size=10)
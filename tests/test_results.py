@@ -0,0 +1,202 @@
+import pytest
+
+import numpy as np
+from numpy.testing import assert_allclose, assert_equal
+
+from optifik.utils import OptimizeResult
+from optifik.results import BatchResult, Diagnostics, STATUS_OK, STATUS_FAILED
+from optifik.batch import thickness_batch, thickness_batch_shared, analyse_spectrum
+from optifik.synthetic import reflectance, wavelength_grid
+
+
+@pytest.fixture
+def results():
+    return [OptimizeResult(thickness=1000., thickness_uncertainty=2.,
+                           peaks_min=np.array([3, 10]), peaks_max=np.array([6])),
+            OptimizeResult(thickness=np.nan),
+            OptimizeResult(thickness=500., thickness_uncertainty=1.,
+                           num_inliers=4, num_outliers=1,
+                           peaks_min=np.array([], dtype=int), peaks_max=np.array([2, 8, 9])),
+            OptimizeResult(thickness=800., thickness_uncertainty=3., interference_order=2)]
+
+
+def test_from_results(results):
+    batch = BatchResult.from_results(results)
+    assert len(batch) == 4
+    assert_allclose(batch.thickness, [1000, np.nan, 500, 800])
+    assert_allclose(batch.thickness_uncertainty, [2, np.nan, 1, 3])
+    assert_equal(batch.interference_order, [-1, -1, -1, 2])
+    assert_equal(batch.num_inliers, [-1, -1, 4, -1])
+    assert_equal(batch.status, [STATUS_OK, STATUS_FAILED, STATUS_OK, STATUS_OK])
+    assert_equal(batch.peaks_max_values, [6, 2, 8, 9])
+    assert_equal(batch.peaks_max_offsets, [0, 1, 1, 4, 4])
+
+
+def test_items(results):
+    batch = BatchResult.from_results(results)
+    for item, result in zip(batch, results):
+        assert set(item) - {'status', 'peaks_min', 'peaks_max'} \
+            == set(result) - {'peaks_min', 'peaks_max'}
+        for key, value in result.items():
+            assert_equal(getattr(item, key), value)
+    assert batch[-1].interference_order == 2
+    assert 'thickness_uncertainty' not in batch[1]
+    assert len(batch[1].peaks_min) == 0
+    with pytest.raises(AttributeError):
+        batch[0].interference_order
+    with pytest.raises(IndexError):
+        batch[4]
+
+
+def test_concatenate(results):
+    whole = BatchResult.from_results(results)
+    parts = BatchResult.concatenate([BatchResult.from_results(results[:1]),
+                                     BatchResult.from_results(results[1:2]),
+                                     BatchResult.from_results(results[2:])])
+    assert_allclose(parts.thickness, whole.thickness)
+    assert_equal(parts.status, whole.status)
+    assert_equal(parts.peaks_min_values, whole.peaks_min_values)
+    assert_equal(parts.peaks_min_offsets, whole.peaks_min_offsets)
+    assert len(BatchResult.concatenate([])) == 0
+
+
+def test_to_structured(results):
+    array = BatchResult.from_results(results).to_structured()
+    assert array.shape == (4,)
+    assert_allclose(array['thickness'], [1000, np.nan, 500, 800])
+    assert array['interference_order'][3] == 2
+
+
+def test_to_dataframe(results):
+    pytest.importorskip('pandas')
+    frame = BatchResult.from_results(results).to_dataframe()
+    assert list(frame['num_outliers']) == [-1, -1, 1, -1]
+
+
+def test_batch_runners_return_batch_result():
+    lambdas = wavelength_grid(1_000, 450, 800)
+    intensities = reflectance(np.linspace(1_000, 3_000, 6), lambdas, 1.33)
+
+    threads = thickness_batch('minmax', lambdas, intensities, 1.33,
+                              max_workers=2, chunk_size=4, min_peak_prominence=None)
+    assert isinstance(threads, BatchResult)
+    assert np.all(threads.status == STATUS_OK)
+    assert threads.peaks_min_offsets[-1] == len(threads.peaks_min_values)
+    assert_equal(threads[5].peaks_min, threads.peaks_min_values[threads.peaks_min_offsets[5]:])
+
+    processes = thickness_batch_shared('minmax', lambdas, intensities, 1.33,
+                                       max_workers=2, chunk_size=4,
+                                       min_peak_prominence=None, method='ransac')
+    assert isinstance(processes, BatchResult)
+    assert np.all(processes.num_inliers > 0)
+    assert_allclose(processes.thickness, threads.thickness, rtol=1e-2)
+
+
+@pytest.mark.parametrize('method, kwargs', [('fft', {}),
+                                            ('minmax', {'min_peak_prominence': None,
+                                                        'method': 'ransac'}),
+                                            ('scheludko', {'min_peak_prominence': None})])
+def test_diagnostics_capture(method, kwargs, tmp_path):
+    wavelengths = wavelength_grid(1_000, 450, 800)
+    intensities = reflectance(1_500., wavelengths, 1.33)
+    result = analyse_spectrum(method, wavelengths, intensities, 1.33,
+                              diagnostics=True, **kwargs)
+    captured = result.diagnostics
+    assert isinstance(captured, Diagnostics)
+    assert captured.result.thickness == result.thickness
+    assert captured.intensities.dtype == np.float32
+    assert captured.nbytes < 40_000
+    if method == 'fft':
+        assert len(captured.data['fft']) <= 129
+        assert captured.data['fft'][captured.data['peak_index']] == captured.data['fft'].max()
+    elif method == 'minmax':
+        assert captured.data['inliers'].dtype == bool
+    else:
+        assert captured.data['h_curves'].shape[0] == len(captured.data['orders'])
+        assert np.abs(captured.data['residuals']).max() < 0.1
+
+    figure = captured.render(tmp_path / 'plot.png')
+    assert (tmp_path / 'plot.png').stat().st_size > 0
+    assert figure.ax_spectrum.get_title().startswith('Spectrum None')
+    if method == 'scheludko':
+        # Order scan
+        assert len(figure.order_lines) == len(captured.data['orders'])
+        assert_allclose(figure.order_lines[0].get_ydata(), captured.data['h_curves'][0])
+
+
+@pytest.mark.filterwarnings('ignore:.*spectra failed')
+@pytest.mark.parametrize('method', ['minmax', 'scheludko'])
+def test_diagnostics_of_failures(method, tmp_path):
+    # A single maximum: too few peaks for 'minmax', no minimum for 'scheludko'
+    wavelengths = wavelength_grid(500, 450, 800)
+    intensities = 0.2 + 0.5 * np.exp(-((wavelengths - 600) / 30)**2)
+    results = thickness_batch(method, wavelengths, intensities[np.newaxis], 1.33,
+                              errors='coerce', diagnostics='failed',
+                              min_peak_prominence=0.1)
+    assert results.status[0] != STATUS_OK
+    captured = results.diagnostics[0]
+    assert_equal(captured.data['peaks_max'], [np.argmax(intensities)])
+    assert len(captured.data['peaks_min']) == 0
+
+    figure = captured.render(tmp_path / 'plot.png')
+    assert_allclose(figure.extrema_line.get_xdata(), [wavelengths[np.argmax(intensities)]],
+                    rtol=1e-6)
+    assert not figure.ax_spectrum.get_title().startswith('Spectrum 0: $h')
+
+
+def test_diagnostics_of_scheludko_without_convergence(monkeypatch, tmp_path):
+    import optifik.scheludko
+
+    def no_convergence(*args, **kwargs):
+        raise RuntimeError('Optimal parameters not found')
+
+    monkeypatch.setattr(optifik.scheludko, 'curve_fit', no_convergence)
+    wavelengths = wavelength_grid(1_000, 450, 800)
+    intensities = reflectance(1_500., wavelengths, 1.33)
+    result = analyse_spectrum('scheludko', wavelengths, intensities, 1.33,
+                              errors='coerce', diagnostics=True, min_peak_prominence=None)
+    assert result.message == 'Optimal parameters not found'
+    captured = result.diagnostics
+    # The order scan and the data to fit, without the fit
+    assert 'fitted_h' not in captured.data
+    assert len(captured.data['Delta']) == len(captured.data['wavelengths'])
+    assert captured.data['h_curves'].shape[0] == len(captured.data['orders'])
+
+    figure = captured.render(tmp_path / 'plot.png')
+    assert len(figure.lines[0].get_xdata()) == len(captured.data['wavelengths'])
+    assert len(figure.lines[1].get_xdata()) == 0
+    assert len(figure.order_lines) == len(captured.data['orders'])
+
+
+@pytest.mark.filterwarnings('ignore:.*spectra failed')
+def test_batch_diagnostics(tmp_path):
+    from optifik.diagnostics import render_captured
+
+    wavelengths = wavelength_grid(500, 450, 800)
+    intensities = reflectance(np.linspace(500, 3_000, 40), wavelengths, 1.33)
+    intensities[[7, 31]] = 0.5
+    results = thickness_batch('scheludko', wavelengths, intensities, 1.33,
+                              max_workers=2, chunk_size=6, errors='coerce',
+                              diagnostics='failed', min_peak_prominence=None)
+    assert sorted(results.diagnostics) == [7, 31]
+    assert results.diagnostics[31].index == 31
+    # No extremum detected
+    assert len(results.diagnostics[31].data['peaks_max']) == 0
+    assert 'diagnostics' not in results[0]
+
+    sampled = thickness_batch('scheludko', wavelengths, intensities, 1.33,
+                              max_workers=2, chunk_size=6, errors='coerce',
+                              diagnostics=0.1, min_peak_prominence=None)
+    assert sorted(sampled.diagnostics) == [0, 7, 10, 20, 30, 31]
+
+    shared = thickness_batch_shared('scheludko', wavelengths, intensities, 1.33,
+                                    max_workers=2, chunk_size=6, errors='coerce',
+                                    diagnostics=0.1, min_peak_prominence=None)
+    assert sorted(shared.diagnostics) == [0, 7, 10, 20, 30, 31]
+
+    paths = render_captured(sampled.diagnostics, tmp_path)
+    assert [path.rsplit('/', 1)[1] for path in paths][-1] == 'spectrum_000031.png'
+
+    assert thickness_batch('fft', wavelengths, intensities, 1.33).diagnostics is None
+    with pytest.raises(ValueError):
+        thickness_batch('fft', wavelengths, intensities, 1.33, diagnostics='some')
@@ -208,3 +208,38 @@ def test_data_order0(test_data_dir):
     assert result.thickness_uncertainty / result.thickness < tol
 
 
+
+
+def test_scheludko_timings(dataset1):
+    lambdas = dataset1['lambdas']
+    smoothed_intensities = dataset1['smoothed_intensities']
+    r_index = dataset1['r_index']
+
+    w_start, w_stop = get_default_start_stop_wavelengths(lambdas,
+                                                         smoothed_intensities,
+                                                         refractive_index=r_index,
+                                                         min_peak_prominence=0.02)
+    result = thickness_from_scheludko(lambdas,
+                                      smoothed_intensities,
+                                      refractive_index=r_index,
+                                      wavelength_start=w_start,
+                                      wavelength_stop=w_stop,
+                                      timings=True)
+    assert set(result.timings) == {'masking', 'order_scan', 'curve_fit', 'total'}
+    stages_time = sum(result.timings[stage]['time']
+                      for stage in ('masking', 'order_scan', 'curve_fit'))
+    assert stages_time <= result.timings['total']['time']
+
+
+def test_guessed_order_0():
+    # Thin film, a single maximum: the guessed order is 0, which does
+    # not require the intensities in absence of film
+    lambdas = np.linspace(400, 800, 1000)
+    n_values = 1.324188 + 3102.060378 / (lambdas**2)
+    sin_term = np.sin(2 * np.pi * n_values * 80 / lambdas) ** 2
+    intensities = sin_term / ((2 * n_values / (n_values**2 - 1)) ** 2 + sin_term)
+    result = thickness_from_scheludko(lambdas, intensities, n_values,
+                                      wavelength_start=lambdas[np.argmax(intensities)],
+                                      wavelength_stop=800)
+    assert result.interference_order == 0
+    assert np.isfinite(result.thickness)
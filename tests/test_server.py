@@ -0,0 +1,156 @@
+import asyncio
+
+import numpy as np
+from numpy.testing import assert_allclose
+
+from optifik.server import SpectrumServer, send_spectra, encode_request
+from optifik.server import REQUEST_HEADER, RESPONSE
+from optifik.results import STATUS_OK, STATUS_NO_EXTREMUM, STATUS_INVALID_INPUT
+from optifik.fft import thickness_from_fft
+from optifik.dispersion import CauchyIndex
+
+
+def n_lambda(lmbda):
+    """
+    For water + TTAB 1 CMC
+    """
+    return 1.324188 + 3102.060378 / (lmbda**2)
+
+
+def compute_spectrum_theory(h, lambdas, n_values):
+    sin_term = np.sin(2 * np.pi * n_values * h / lambdas) ** 2
+    denominator = (2 * n_values / (n_values**2 - 1)) ** 2 + sin_term
+    return sin_term / denominator
+
+
+def test_server_concurrent_clients():
+    lambdas = np.linspace(450, 800, 500)
+    n_values = n_lambda(lambdas)
+    intensities = np.array([compute_spectrum_theory(h, lambdas, n_values)
+                            for h in np.linspace(2_000, 5_000, 20)])
+
+    async def run():
+        server = SpectrumServer('fft', n_lambda, max_workers=2, queue_size=4)
+        host, port = await server.start()
+        try:
+            results = await asyncio.gather(*[send_spectra(host, port, lambdas, intensities)
+                                             for _ in range(3)])
+        finally:
+            await server.close()
+        return results, server.stats()
+
+    results, stats = asyncio.run(run())
+
+    expected = [thickness_from_fft(lambdas, spectrum, n_values).thickness
+                for spectrum in intensities]
+    for result in results:
+        assert list(result.frame_id) == list(range(20))
+        assert np.all(result.status == STATUS_OK)
+        assert_allclose(result.thickness, expected)
+        assert result.fps > 0
+    assert stats.num_frames == 60
+    assert stats.num_failures == 0
+    assert stats.latency_max >= stats.latency_p50 > 0
+
+
+def test_server_memoises_models():
+    lambdas = np.linspace(450, 800, 500)
+    calls = []
+
+    class Water(CauchyIndex):
+        def __call__(self, wavelengths):
+            calls.append(len(wavelengths))
+            return super().__call__(wavelengths)
+
+    model = Water(1.324188, 3102.060378)
+    intensities = np.array([compute_spectrum_theory(h, lambdas, model(lambdas))
+                            for h in np.linspace(2_000, 5_000, 20)])
+    calls.clear()
+
+    async def run():
+        server = SpectrumServer('fft', model, max_workers=2)
+        host, port = await server.start()
+        try:
+            return await send_spectra(host, port, lambdas, intensities)
+        finally:
+            await server.close()
+
+    result = asyncio.run(run())
+    assert np.all(result.status == STATUS_OK)
+    # Evaluated once for the grid, not for each frame
+    assert calls == [len(lambdas)]
+
+
+def test_server_failure_status():
+    lambdas = np.linspace(450, 800, 500)
+    flat = np.ones((2, 500))
+
+    async def run():
+        server = SpectrumServer('scheludko', 1.33, max_workers=1)
+        host, port = await server.start()
+        try:
+            return await send_spectra(host, port, lambdas, flat)
+        finally:
+            await server.close()
+
+    result = asyncio.run(run())
+    assert np.all(result.status == STATUS_NO_EXTREMUM)
+    assert np.all(np.isnan(result.thickness))
+
+
+def test_server_rejects_large_frames():
+    lambdas = np.linspace(450, 800, 500)
+    spectrum = compute_spectrum_theory(1_000, lambdas, n_lambda(lambdas))
+
+    async def run():
+        server = SpectrumServer('fft', 1.33, max_workers=1, max_points=500)
+        host, port = await server.start()
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            # The payload of the second frame is never sent
+            writer.write(encode_request(0, lambdas, spectrum)
+                         + REQUEST_HEADER.pack(1, 501))
+            await writer.drain()
+            responses = [RESPONSE.unpack(await reader.readexactly(RESPONSE.size))
+                         for _ in range(2)]
+            closed = await asyncio.wait_for(reader.read(), timeout=5) == b''
+            writer.close()
+            return responses, closed
+        finally:
+            await server.close()
+
+    responses, closed = asyncio.run(run())
+    assert [response[:2] for response in responses] == [(0, STATUS_OK),
+                                                        (1, STATUS_INVALID_INPUT)]
+    assert closed
+
+
+def test_server_cancels_reader_when_writer_fails():
+    lambdas = np.linspace(450, 800, 500)
+    intensities = np.ones((10, 500))
+
+    class FailingServer(SpectrumServer):
+        async def _write_results(self, writer, pending):
+            await pending.get()
+            raise ConnectionResetError
+
+    async def run():
+        server = FailingServer('fft', 1.33, max_workers=1, queue_size=2)
+        host, port = await server.start()
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            for frame_id, spectrum in enumerate(intensities):
+                writer.write(encode_request(frame_id, lambdas, spectrum))
+            await writer.drain()
+            # The client connection is closed by the server
+            await asyncio.wait_for(reader.read(), timeout=5)
+            writer.close()
+            while server._clients:
+                await asyncio.sleep(0.01)
+            # No reader left blocked on the full queue
+            return [task for task in asyncio.all_tasks()
+                    if task is not asyncio.current_task()]
+        finally:
+            await server.close()
+
+    assert asyncio.run(run()) == []
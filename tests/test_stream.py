@@ -0,0 +1,139 @@
+import csv
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+from numpy.testing import assert_allclose
+
+from optifik.stream import watch_directory
+from optifik.batch import analyse_file
+from optifik.resultfile import ResultReader
+from optifik.results import STATUS_OK, STATUS_FAILED, STATUS_TOO_FEW_PEAKS
+
+
+def spectrum_paths():
+    folder = Path(__file__).parent.parent / 'data' / 'spectraLorene' / 'sample1'
+    return sorted(folder.glob('*.xy'))[:12]
+
+
+def producer(paths, directory, delay):
+    for idx, path in enumerate(paths):
+        target = directory / f'{idx:06d}.xy'
+        # Write under a temporary name, then rename atomically
+        content = path.read_bytes()
+        with open(target.with_suffix('.xy.tmp'), 'wb') as fh:
+            fh.write(content[:len(content) // 2])
+            fh.flush()
+            time.sleep(delay)
+            fh.write(content[len(content) // 2:])
+        os.replace(target.with_suffix('.xy.tmp'), target)
+        if idx == 5:
+            # Burst
+            delay = 0
+
+
+def test_watch_directory(tmp_path):
+    paths = spectrum_paths()
+    watched = tmp_path / 'acquisition'
+    watched.mkdir()
+    output = tmp_path / 'results.csv'
+
+    thread = threading.Thread(target=producer, args=(paths, watched, 0.02))
+    thread.start()
+    results = list(watch_directory(watched, 'fft', 1.33,
+                                   output=output,
+                                   results_file=tmp_path / 'results.bin',
+                                   poll_interval=0.01,
+                                   settle_time=0,
+                                   idle_timeout=0.5,
+                                   wavelength_min=450))
+    thread.join()
+
+    names = [Path(path).name for path, _ in results]
+    assert names == [f'{idx:06d}.xy' for idx in range(len(paths))]
+    expected = [analyse_file('fft', path, 1.33, wavelength_min=450).thickness
+                for path in paths]
+    assert_allclose([result.thickness for _, result in results], expected)
+
+    with open(output, newline='') as fh:
+        rows = list(csv.DictReader(fh))
+    assert len(rows) == len(paths)
+    assert_allclose([float(row['thickness']) for row in rows], expected)
+    assert all(int(row['status']) == STATUS_OK for row in rows)
+
+    reader = ResultReader(tmp_path / 'results.bin')
+    assert reader.complete
+    assert_allclose(reader['thickness'], expected)
+    assert np.all(np.diff(reader['timestamp']) >= 0)
+
+
+def test_watch_directory_stop_event_and_failure(tmp_path):
+    (tmp_path / 'a.xy').write_text('not a spectrum\n')
+    shutil.copy(spectrum_paths()[0], tmp_path / 'b.xy')
+    stop_event = threading.Event()
+
+    results = []
+    for path, result in watch_directory(tmp_path, 'fft', 1.33,
+                                        poll_interval=0.01,
+                                        settle_time=0,
+                                        stop_event=stop_event):
+        results.append(result)
+        if len(results) == 2:
+            stop_event.set()
+
+    assert np.isnan(results[0].thickness)
+    assert results[0].status == STATUS_FAILED
+    assert results[0].message.startswith('ValueError')
+    assert np.isfinite(results[1].thickness)
+
+
+def test_watch_directory_csv_of_failures(tmp_path):
+    watched = tmp_path / 'acquisition'
+    watched.mkdir()
+    shutil.copy(spectrum_paths()[0], watched / 'a, "quoted".xy')
+    (watched / 'b.xy').write_text('not a spectrum\n')
+    output = tmp_path / 'results.csv'
+    results = list(watch_directory(watched, 'minmax', 1.33,
+                                   output=output,
+                                   poll_interval=0.01,
+                                   settle_time=0,
+                                   idle_timeout=0.2,
+                                   min_peak_prominence=10.))
+
+    with open(output, newline='') as fh:
+        rows = list(csv.DictReader(fh))
+    # Failures are reported, not raised
+    assert [row['path'] for row in rows] == [path for path, _ in results]
+    assert [int(row['status']) for row in rows] == [STATUS_TOO_FEW_PEAKS, STATUS_FAILED]
+    assert [row['message'] for row in rows] == [result.message for _, result in results]
+
+
+def test_watch_directory_settle_time(tmp_path):
+    content = spectrum_paths()[0].read_bytes()
+    target = tmp_path / 'a.xy'
+    target.write_bytes(content[:len(content) // 2])
+    stop_event = threading.Event()
+
+    def complete():
+        # Well within the settle time
+        time.sleep(0.1)
+        with open(target, 'ab') as fh:
+            fh.write(content[len(content) // 2:])
+        time.sleep(1.5)
+        stop_event.set()
+
+    thread = threading.Thread(target=complete)
+    thread.start()
+    results = list(watch_directory(tmp_path, 'fft', 1.33,
+                                   poll_interval=0.01,
+                                   settle_time=1.,
+                                   stop_event=stop_event,
+                                   wavelength_min=450))
+    thread.join()
+
+    assert len(results) == 1
+    expected = analyse_file('fft', spectrum_paths()[0], 1.33, wavelength_min=450)
+    assert_allclose(results[0][1].thickness, expected.thickness)
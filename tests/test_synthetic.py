@@ -0,0 +1,78 @@
+import numpy as np
+from numpy.testing import assert_allclose
+
+from optifik import synthetic
+from optifik.fft import thickness_from_fft
+from optifik.batch import thickness_batch_shared
+
+
+def n_lambda(lmbda):
+    """
+    For water + TTAB 1 CMC
+    """
+    return 1.324188 + 3102.060378 / (lmbda**2)
+
+
+def compute_spectrum_theory(h, lambdas, n_values):
+    sin_term = np.sin(2 * np.pi * n_values * h / lambdas) ** 2
+    denominator = (2 * n_values / (n_values**2 - 1)) ** 2 + sin_term
+    return sin_term / denominator
+
+
+def test_reflectance():
+    lambdas = synthetic.wavelength_grid(500, 450, 800)
+    n_values = n_lambda(lambdas)
+    assert_allclose(synthetic.reflectance(1_000, lambdas, n_lambda),
+                    compute_spectrum_theory(1_000, lambdas, n_values))
+    stack = synthetic.reflectance([500, 1_000], lambdas, n_values)
+    assert stack.shape == (2, 500)
+    assert_allclose(stack[1], compute_spectrum_theory(1_000, lambdas, n_values))
+
+
+def test_generate_spectra_chunks():
+    lambdas = synthetic.wavelength_grid(300)
+    h_values = synthetic.thickness_trajectory(25, 3_000, 500)
+    assert_allclose(h_values[[0, -1]], [3_000, 500])
+
+    chunks = [chunk.copy() for chunk in synthetic.generate_spectra(h_values, lambdas, 1.33,
+                                                                   chunk_size=10)]
+    assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+    assert_allclose(np.concatenate(chunks),
+                    synthetic.reflectance(h_values, lambdas, 1.33), atol=1e-12)
+
+
+def test_generate_spectra_noise_dark_drift():
+    lambdas = synthetic.wavelength_grid(200)
+    h_values = np.full(4, 1_000.)
+    dark = np.linspace(0, 0.1, 200)
+
+    clean, = synthetic.generate_spectra(h_values, lambdas, 1.33,
+                                        amplitude=2, dark_offset=dark, drift=0.01)
+    expected = 2 * synthetic.reflectance(h_values, lambdas, 1.33) + dark \
+        + 0.01 * np.arange(4)[:, np.newaxis]
+    assert_allclose(clean, expected, atol=1e-12)
+
+    noisy1 = next(synthetic.generate_spectra(h_values, lambdas, 1.33, noise=0.1, seed=1)).copy()
+    noisy2 = next(synthetic.generate_spectra(h_values, lambdas, 1.33, noise=0.1, seed=1))
+    assert_allclose(noisy1, noisy2)
+    assert 0.05 < np.std(noisy1 - synthetic.reflectance(h_values, lambdas, 1.33)) < 0.15
+
+
+def test_generate_to_file(tmp_path):
+    lambdas = synthetic.wavelength_grid(1_000, 450, 800)
+    h_values = np.linspace(3_000, 5_000, 8)
+    path = tmp_path / 'stack.npy'
+    stack = synthetic.generate_to_file(path, h_values, lambdas, n_lambda,
+                                       chunk_size=3, dtype=np.float32,
+                                       noise=0.01, seed=0)
+    assert stack.dtype == np.float32
+
+    stored = np.load(path, mmap_mode='r')
+    assert stored.shape == (8, 1_000)
+
+    result = thickness_batch_shared('fft', lambdas, stored, n_lambda(lambdas),
+                                    max_workers=2)
+    for thickness, spectrum in zip(result.thickness, stored):
+        expected = thickness_from_fft(lambdas, np.asarray(spectrum), n_lambda(lambdas))
+        assert_allclose(thickness, expected.thickness)
+    assert_allclose(result.thickness, h_values, rtol=5e-2)
@@ -1,5 +1,8 @@
 import unittest
-from optifik.utils import round_to_uncertainty
+
+import numpy as np
+
+from optifik.utils import round_to_uncertainty, round_to_uncertainty_array
 
 class TestRoundToUncertainty(unittest.TestCase):
 
@@ -154,6 +157,40 @@ class TestRoundToUncertainty(unittest.TestCase):
             self.assertEqual(results[0], results[i])
 
 
+class TestRoundToUncertaintyArray(unittest.TestCase):
+
+    def test_same_as_scalar(self):
+        """Test that the array version matches the scalar version"""
+        cases = [(12.34567, 0.0234), (12.34567, 0.234), (12.34567, 2.34),
+                 (12.34567, 0.00234), (100, 5.67), (1.23456789, 0.000123),
+                 (12.345, 0.056), (12.344, 0.054), (12.345, 0.05),
+                 (100, 25), (12.3456, 25.67), (1.234, 10.5),
+                 (-0.001, 0.01), (9.999, 0.0999), (1234.56, 123.45),
+                 (0.001234, 0.000123), (5., 1e-8), (3., -0.5)]
+        values, uncertainties = np.array(cases).T
+        for digits in (1, 2, 3):
+            result_val, result_unc = round_to_uncertainty_array(values, uncertainties, digits)
+            for (value, uncertainty), val, unc in zip(cases, result_val, result_unc):
+                expected = round_to_uncertainty(value, uncertainty, digits)
+                self.assertEqual((val, unc), tuple(map(str, expected)))
+
+    def test_random(self):
+        """Test random values against the scalar version"""
+        rng = np.random.default_rng(0)
+        values = rng.uniform(-1e4, 1e4, 2_000)
+        uncertainties = 10 ** rng.uniform(-5, 4, 2_000)
+        result_val, result_unc = round_to_uncertainty_array(values, uncertainties, 2)
+        for value, uncertainty, val, unc in zip(values, uncertainties, result_val, result_unc):
+            self.assertEqual((val, unc), round_to_uncertainty(value, uncertainty, 2))
+
+    def test_shape_and_non_finite(self):
+        """Test broadcasting and non-finite values"""
+        result_val, result_unc = round_to_uncertainty_array([[12.34567, np.nan]], 0.0234)
+        self.assertEqual(result_val.shape, (1, 2))
+        self.assertEqual(result_val.tolist(), [['12.35', 'nan']])
+        self.assertEqual(result_unc.tolist(), [['0.02', '0.0234']])
+
+
 # Additional test class for specific scenarios
 #class TestRoundToUncertaintyAdvanced(unittest.TestCase):
 #